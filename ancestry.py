@@ -0,0 +1,89 @@
+import os
+import logging
+import threading
+import subprocess
+from collections import OrderedDict
+
+from git_batch import get_git_batch
+
+# Number of (repo, patch commit) pairs whose ancestry answers are kept
+MAX_CACHED_TIPS = 256
+
+_ancestry_cache = OrderedDict()
+_commit_graph_checked = set()
+_lock = threading.Lock()
+
+
+def ensure_commit_graph(repo):
+    """Write the repo's commit-graph file once, if it has none.
+    The commit-graph stores generation numbers for every commit, which lets
+    git answer reachability walks without parsing commit objects.
+    """
+    git_dir = repo.git_dir
+    with _lock:
+        if git_dir in _commit_graph_checked:
+            return
+        _commit_graph_checked.add(git_dir)
+
+    graph_file = os.path.join(git_dir, "objects", "info", "commit-graph")
+    graph_chain = os.path.join(git_dir, "objects", "info", "commit-graphs")
+    if os.path.exists(graph_file) or os.path.exists(graph_chain):
+        return
+    logging.info(f"Writing commit-graph for {git_dir}")
+    try:
+        subprocess.run(
+            ["git", f"--git-dir={git_dir}", "commit-graph", "write", "--reachable"],
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    except (subprocess.CalledProcessError, OSError) as e:
+        logging.warning(f"Could not write commit-graph for {git_dir}: {str(e)}")
+
+
+def _get_known(git_dir, tip):
+    key = (git_dir, tip)
+    with _lock:
+        if key in _ancestry_cache:
+            _ancestry_cache.move_to_end(key)
+        else:
+            _ancestry_cache[key] = {}
+            while len(_ancestry_cache) > MAX_CACHED_TIPS:
+                _ancestry_cache.popitem(last=False)
+        return _ancestry_cache[key]
+
+
+def get_ancestors(repo, tip, candidates):
+    """Find which of many commits are ancestors of tip.
+    Answers are memoized per (repo, tip), so only candidates that were never
+    asked about before trigger a history walk, and all of them share one.
+    Args:
+        repo (git.Repo): Repository object
+        tip (str): Full SHA of the commit whose history is searched
+        candidates (iterable): Full commit SHAs
+    Returns:
+        set: The candidates that are ancestors of (or equal to) tip
+    """
+    candidates = set(candidates)
+    known = _get_known(repo.git_dir, tip)
+
+    with _lock:
+        unknown = candidates.difference(known)
+    if unknown:
+        ensure_commit_graph(repo)
+        try:
+            found = get_git_batch(repo).filter_ancestors(tip, unknown)
+        except subprocess.CalledProcessError as e:
+            # A missing or unfetched tip must not be memoized as "no
+            # ancestors", or later calls would never walk it again
+            logging.error(
+                f"git rev-list {tip} failed in {repo.git_dir}: {e.stderr.strip()}"
+            )
+            with _lock:
+                return {sha for sha in candidates if known.get(sha)}
+        with _lock:
+            for sha in unknown:
+                known[sha] = sha in found
+
+    with _lock:
+        return {sha for sha in candidates if known.get(sha)}
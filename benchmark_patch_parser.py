@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+from patch_parser import get_changed_lines
+
+
+def legacy_get_changed_lines(patch_content):
+    """The split-based parser each stage used before patch_parser."""
+    file_changes = {}
+    current_file = None
+    for line in patch_content.split("\n"):
+        if line.startswith("diff --git"):
+            current_file = line.split()[-1][2:]
+            file_changes[current_file] = {"added_lines": [], "removed_lines": []}
+        elif current_file:
+            if line.startswith("+") and not line.startswith("+++"):
+                file_changes[current_file]["added_lines"].append(line[1:])
+            elif line.startswith("-") and not line.startswith("---"):
+                file_changes[current_file]["removed_lines"].append(line[1:])
+    return file_changes
+
+
+def make_synthetic_patch(num_files, hunks_per_file, seed=0):
+    """Build a git-style patch with the given number of files and hunks."""
+    rng = random.Random(seed)
+    parts = []
+    for f in range(num_files):
+        path = f"src/module_{f}/file_{f}.c"
+        parts.append(
+            f"diff --git a/{path} b/{path}\n"
+            f"index {f:07x}..{f + 1:07x} 100644\n"
+            f"--- a/{path}\n"
+            f"+++ b/{path}\n"
+        )
+        line = 1
+        for _ in range(hunks_per_file):
+            line += rng.randint(10, 40)
+            parts.append(f"@@ -{line},7 +{line},8 @@ static int func_{f}(void)\n")
+            parts.append("".join(f"     int ctx_{i} = {i};\n" for i in range(3)))
+            parts.append("-    if (len > size)\n")
+            parts.append("+    if (len >= size)\n")
+            parts.append("+        return -EINVAL;\n")
+            parts.append("".join(f"     ctx_{i}++;\n" for i in range(3)))
+    return "".join(parts)
+
+
+def read_then_legacy(path):
+    """The legacy parser has to read the whole patch before splitting it."""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return legacy_get_changed_lines(f.read())
+
+
+def stream_patch_parser(path):
+    """patch_parser reads an open file a chunk at a time."""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return get_changed_lines(f)
+
+
+def measure(func, patch_content, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(patch_content)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func(patch_content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the patch parser")
+    parser.add_argument("patches", nargs="*", help="Patch files to parse")
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--hunks", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.patches:
+        patch_content = ""
+        for path in args.patches:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                patch_content += f.read()
+    else:
+        patch_content = make_synthetic_patch(args.files, args.hunks)
+    print(f"Patch size: {len(patch_content) / 2**20:.1f} MiB")
+
+    with tempfile.NamedTemporaryFile("w", suffix=".patch", delete=False) as f:
+        f.write(patch_content)
+    try:
+        # Peaks don't count the patch string itself, which the string
+        # runs get as their input; the file runs read it themselves
+        for name, func, source in [
+            ("legacy split", legacy_get_changed_lines, patch_content),
+            ("patch_parser", get_changed_lines, patch_content),
+            ("legacy file", read_then_legacy, f.name),
+            ("parser file", stream_patch_parser, f.name),
+        ]:
+            seconds, peak = measure(func, source, args.repeat)
+            print(f"{name:>14}: {seconds:.3f}s, peak {peak / 2**20:.1f} MiB")
+    finally:
+        os.remove(f.name)
+
+    # Both parsers should agree on the added/removed lines of every file
+    if legacy_get_changed_lines(patch_content) != get_changed_lines(patch_content):
+        print("Warning: parsers disagree on this patch", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import os
+import mmap
+import random
+import hashlib
+import logging
+import subprocess
+
+from constants import BENIGN_SAMPLE_SEED
+
+# Every commit reachable from any ref, as packed 20-byte SHAs, kept in the
+# repository's git dir next to the hash of the refs it was listed from
+SHA_LIST_FILE = "all_commits.shas"
+SHA_LIST_REFS_FILE = "all_commits.refs"
+SHA_SIZE = 20
+
+
+def _git(repo, *args):
+    return ["git", f"--git-dir={repo.git_dir}", *args]
+
+
+def get_refs_hash(repo):
+    """Hash every ref and its target, so a changed ref invalidates the list."""
+    refs = subprocess.run(
+        _git(repo, "for-each-ref", "--format=%(objectname) %(refname)"),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        check=True,
+    ).stdout
+    return hashlib.sha256(refs).hexdigest()
+
+
+def build_sha_list(repo, refs_hash):
+    """Stream `git rev-list --all` into the packed SHA list file.
+    Returns:
+        int: Number of commits in the list
+    """
+    sha_file = os.path.join(repo.git_dir, SHA_LIST_FILE)
+    tmp_file = f"{sha_file}.{os.getpid()}.tmp"
+    num_commits = 0
+    process = subprocess.Popen(
+        _git(repo, "rev-list", "--all"),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    with open(tmp_file, "wb") as f:
+        for line in process.stdout:
+            f.write(bytes.fromhex(line.strip().decode()))
+            num_commits += 1
+    process.stdout.close()
+    if process.wait() != 0:
+        os.remove(tmp_file)
+        raise RuntimeError(f"git rev-list --all failed in {repo.git_dir}")
+
+    os.replace(tmp_file, sha_file)
+    with open(os.path.join(repo.git_dir, SHA_LIST_REFS_FILE), "w") as f:
+        f.write(refs_hash)
+    logging.info(f"Listed {num_commits} commits of {repo.git_dir}")
+    return num_commits
+
+
+def get_sha_list(repo):
+    """Get the path of the repo's packed SHA list, rebuilding it if refs moved."""
+    sha_file = os.path.join(repo.git_dir, SHA_LIST_FILE)
+    refs_file = os.path.join(repo.git_dir, SHA_LIST_REFS_FILE)
+    refs_hash = get_refs_hash(repo)
+    stored_hash = None
+    if os.path.exists(sha_file) and os.path.exists(refs_file):
+        with open(refs_file, "r") as f:
+            stored_hash = f.read().strip()
+    if stored_hash != refs_hash:
+        build_sha_list(repo, refs_hash)
+    return sha_file
+
+
+def sample_commits(repo, excluded_commits, num_samples, seed=BENIGN_SAMPLE_SEED):
+    """Draw random commits from all of a repo's history.
+    Indices are drawn into the packed SHA list and read through mmap, so
+    memory stays proportional to the sample, not to the history. The same
+    seed, repo and refs always give the same samples in the same order.
+    Args:
+        repo (git.Repo): Repository object
+        excluded_commits (set): Full SHAs that must not be sampled
+        num_samples (int): Number of commits to draw
+        seed: Seed for the random generator
+    Returns:
+        list: Up to num_samples full commit SHAs
+    """
+    sha_file = get_sha_list(repo)
+    num_commits = os.path.getsize(sha_file) // SHA_SIZE
+    if num_commits == 0 or num_samples <= 0:
+        return []
+
+    # Seeded per repo so repos don't all draw the same indices
+    git_dir = os.path.abspath(repo.git_dir)
+    if os.path.basename(git_dir) == ".git":
+        git_dir = os.path.dirname(git_dir)
+    rng = random.Random(f"{seed}:{os.path.basename(git_dir)}")
+    num_draws = min(num_commits, num_samples + len(excluded_commits))
+    samples = []
+    with open(sha_file, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as shas:
+        for index in rng.sample(range(num_commits), num_draws):
+            sha = shas[index * SHA_SIZE : (index + 1) * SHA_SIZE].hex()
+            if sha not in excluded_commits:
+                samples.append(sha)
+                if len(samples) == num_samples:
+                    break
+    return samples
@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import logging
+import threading
+
+from constants import BLAME_CACHE_DB, BLAME_CACHE_MAX_BYTES
+from blame_engine import blame_ranges
+
+# Fraction of BLAME_CACHE_MAX_BYTES to shrink to once the limit is exceeded
+EVICTION_TARGET = 0.9
+# Cache hits whose last-access update is written in one batch
+ACCESS_BATCH = 256
+
+
+class BlameCache:
+    """Persistent cache of blame results.
+    Entries are keyed by (repo, revision SHA, path, line ranges); since the
+    revision is a commit SHA the result never changes, so entries are only
+    ever evicted for space, least recently used first.
+    """
+
+    def __init__(self, db_file=BLAME_CACHE_DB, max_bytes=BLAME_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, timeout=60, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS blame (
+                repo TEXT,
+                rev TEXT,
+                path TEXT,
+                ranges TEXT,
+                data BLOB,
+                size INTEGER,
+                last_access REAL,
+                PRIMARY KEY (repo, rev, path, ranges)
+            )""")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_last_access ON blame (last_access)"
+        )
+        # Entries once keyed by ".git" for every non-bare repo; they may
+        # belong to any repo, so they can't be trusted
+        self._conn.execute("DELETE FROM blame WHERE repo = '.git'")
+        self._conn.commit()
+        # Kept up to date by put; recounted before evicting, since other
+        # processes write to the same database
+        self._total = self._count_size()
+        self._accessed = {}  # key -> time of the latest unwritten hit
+
+    @staticmethod
+    def _key(repo, rev, path, line_ranges):
+        # Keyed by the repo's cache directory, without the ".git" of either
+        # a working tree's git dir or a bare repo's directory
+        git_dir = os.path.abspath(repo.git_dir)
+        if os.path.basename(git_dir) == ".git":
+            git_dir = os.path.dirname(git_dir)
+        repo_key = os.path.basename(git_dir)
+        if repo_key.endswith(".git"):
+            repo_key = repo_key[: -len(".git")]
+        ranges = ",".join(f"{start}-{end}" for start, end in line_ranges or [])
+        return repo_key, rev, path, ranges
+
+    def get(self, repo, rev, path, line_ranges):
+        key = self._key(repo, rev, path, line_ranges)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM blame WHERE repo = ? AND rev = ? AND path = ? AND ranges = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._accessed[key] = time.time()
+            if len(self._accessed) >= ACCESS_BATCH:
+                self._flush_accessed()
+        return [tuple(item) for item in json.loads(zlib.decompress(row[0]))]
+
+    def put(self, repo, rev, path, line_ranges, blamed):
+        key = self._key(repo, rev, path, line_ranges)
+        data = zlib.compress(json.dumps(blamed).encode())
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size FROM blame WHERE repo = ? AND rev = ? AND path = ? AND ranges = ?",
+                key,
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO blame VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*key, data, len(data), time.time()),
+            )
+            self._conn.commit()
+            self._total += len(data) - (row[0] if row else 0)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _count_size(self):
+        return self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM blame"
+        ).fetchone()[0]
+
+    def _flush_accessed(self):
+        """Write the last-access times of the hits since the last flush."""
+        if not self._accessed:
+            return
+        self._conn.executemany(
+            "UPDATE blame SET last_access = ? WHERE repo = ? AND rev = ? AND path = ? AND ranges = ?",
+            ((accessed, *key) for key, accessed in self._accessed.items()),
+        )
+        self._conn.commit()
+        self._accessed.clear()
+
+    def flush(self):
+        with self._lock:
+            self._flush_accessed()
+
+    def _evict(self):
+        # Evict by the latest access times, counting other processes' puts
+        self._flush_accessed()
+        total = self._total = self._count_size()
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * EVICTION_TARGET
+        evicted = 0
+        for rowid, size in self._conn.execute(
+            "SELECT rowid, size FROM blame ORDER BY last_access"
+        ).fetchall():
+            if total <= target:
+                break
+            self._conn.execute("DELETE FROM blame WHERE rowid = ?", (rowid,))
+            total -= size
+            evicted += 1
+        self._conn.commit()
+        self._total = total
+        logging.info(f"Evicted {evicted} entries from the blame cache")
+
+    def get_stats(self):
+        with self._lock:
+            self._flush_accessed()
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blame"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "size_bytes": size,
+        }
+
+
+_blame_cache = None
+_blame_cache_lock = threading.Lock()
+
+
+def get_blame_cache():
+    global _blame_cache
+    with _blame_cache_lock:
+        if _blame_cache is None:
+            _blame_cache = BlameCache()
+        return _blame_cache
+
+
+def cached_blame_ranges(repo, rev, file_path, line_ranges=None):
+    """Like blame_engine.blame_ranges, but served from the blame cache."""
+    cache = get_blame_cache()
+    blamed = cache.get(repo, rev, file_path, line_ranges)
+    if blamed is None:
+        blamed = blame_ranges(repo, rev, file_path, line_ranges)
+        cache.put(repo, rev, file_path, line_ranges, blamed)
+    return blamed
@@ -0,0 +1,83 @@
+import re
+from collections import defaultdict
+
+SHA_RE = re.compile(r"^[0-9a-f]{40}$")
+
+
+def merge_ranges(ranges):
+    """Sort (start, end) line ranges and merge overlapping or adjacent ones."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def iter_line_porcelain(lines):
+    """Parse `git blame --line-porcelain` output as a stream.
+    Args:
+        lines (iterable): Raw output lines (bytes or str)
+    Yields:
+        tuple: (commit SHA, line content) for every blamed line
+    """
+    commit_hash = None
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        line = line.rstrip("\n")
+        if line.startswith("\t"):
+            if commit_hash is not None:
+                yield commit_hash, line[1:]
+            commit_hash = None
+        else:
+            first_field = line.split(" ", 1)[0]
+            if SHA_RE.match(first_field):
+                commit_hash = first_field
+
+
+def blame_ranges(repo, rev, file_path, line_ranges=None):
+    """Blame line ranges of a file and index the result by line content.
+    Only the given ranges are blamed, so the cost scales with the size of
+    the hunks instead of the size of the file.
+    Args:
+        repo (git.Repo): Repository object
+        rev (str): Revision to blame at
+        file_path (str): Path of the file in the repository
+        line_ranges (list): (start, end) ranges; None blames the whole file
+    Returns:
+        list: (commit SHA, line content) pairs in file order
+    Raises:
+        git.GitCommandError: If git blame fails
+    """
+    range_args = []
+    for start, end in line_ranges or []:
+        range_args.extend(["-L", f"{start},{end}"])
+
+    process = repo.git.blame(
+        "--line-porcelain", *range_args, rev, "--", file_path, as_process=True
+    )
+    blamed = list(iter_line_porcelain(process.stdout))
+    process.wait()
+    return blamed
+
+
+def build_content_index(blamed):
+    """Map stripped line content to the commits that last touched it."""
+    index = defaultdict(set)
+    for commit_hash, content in blamed:
+        stripped = content.strip()
+        if stripped:
+            index[stripped].add(commit_hash)
+    return index
+
+
+def lookup_lines(index, lines_to_blame):
+    """Get the commits that last touched any of the given lines."""
+    commits = set()
+    for line in lines_to_blame:
+        stripped = line.strip()
+        if stripped:
+            commits |= index.get(stripped, set())
+    return commits
@@ -1,5 +1,3 @@
-import os
-import json
 import logging
 from tqdm import tqdm
 
@@ -8,6 +6,7 @@ from constants import (
     VULNERABILITY_INTRO_METADATA_DIR,
     loggingConfig,
 )
+from commit_dataset import COMMIT_METADATA, VULN_INTRO_METADATA, iter_json_records
 
 
 def check_duplicates():
@@ -17,23 +16,19 @@ def check_duplicates():
     vuln_intro_commits = set()
 
     # Collect security patch commits
-    for file in tqdm(
-        os.listdir(COMMIT_METADATA_DIR), desc="Processing security patch metadata"
+    for _, data in tqdm(
+        iter_json_records(COMMIT_METADATA, COMMIT_METADATA_DIR),
+        desc="Processing security patch metadata",
     ):
-        if file.endswith(".json"):
-            with open(os.path.join(COMMIT_METADATA_DIR, file), "r") as f:
-                data = json.load(f)
-                security_patch_commits.add(data["commit_id"])
+        security_patch_commits.add(data["commit_id"])
 
     # Collect vulnerability-introducing commits
-    for file in tqdm(
-        os.listdir(VULNERABILITY_INTRO_METADATA_DIR),
+    for key, _ in tqdm(
+        iter_json_records(VULN_INTRO_METADATA, VULNERABILITY_INTRO_METADATA_DIR),
         desc="Processing vuln intro metadata",
     ):
-        if file.endswith(".json"):
-            vuln_intro_commits.add(
-                file.split("_")[-1][:-5]
-            )  # Extract commit ID from filename
+        # Keys are "<cve_id>/<commit_id>.json"
+        vuln_intro_commits.add(key.split("/")[-1][:-5])
 
     # Check for duplicates
     duplicates = security_patch_commits.intersection(vuln_intro_commits)
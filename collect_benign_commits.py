@@ -1,104 +1,87 @@
 import os
 import json
-import random
 import logging
-import subprocess
-import requests
+from collections import defaultdict
 from git import Repo
 from tqdm import tqdm
 
 from constants import (
     BENIGN_COMMITS_DIR,
-    BENIGN_PATCHES_DIR,
-    REPO_CACHE_DIR,
+    COMMITS_CSV_FILE,
+    VULNERABILITY_INTRO_METADATA_DIR,
     loggingConfig,
 )
+from get_cache import get_repo_path
+from patch_store import get_patches
+from commit_extension_index import sample_matching_commits
+from stage_manifest import get_manifest, hash_bytes
+from commit_dataset import (
+    BENIGN_COMMITS,
+    VULN_INTRO_METADATA,
+    get_dataset_keys,
+    save_records,
+)
+from organize_commits import process_csv
 
 from ensure_directories import ensure_dirs
+from patch_parser import get_changed_lines
 
 BENIGN_COMMITS_PER_VULN = 5
-
-
-def get_benign_commits(repo, excluded_commits, num_benign):
-    all_commits = list(repo.iter_commits("--all"))
-    benign_commits = [
-        commit for commit in all_commits if commit.hexsha not in excluded_commits
-    ]
-    return random.sample(benign_commits, min(num_benign, len(benign_commits)))
-
-
-def download_patch(repo_url, commit_id, output_path):
-    if os.path.exists(output_path):
-        logging.info(
-            f"Patch file already exists for commit {commit_id}. Skipping download."
-        )
-        return True
-
-    patch_url = f"{repo_url}/commit/{commit_id}.patch"
-
-    # Try wget first
-    try:
-        subprocess.run(["wget", "-q", "-O", output_path, patch_url], check=True)
-        return True
-    except subprocess.CalledProcessError:
-        logging.warning(f"wget failed for {patch_url}. Falling back to requests.")
-    except FileNotFoundError:
-        logging.warning("wget not found. Falling back to requests.")
-
-    # Fall back to requests
-    try:
-        response = requests.get(patch_url)
-        response.raise_for_status()
-        with open(output_path, "wb") as f:
-            f.write(response.content)
-        return True
-    except requests.RequestException as e:
-        logging.error(f"Failed to download patch for {commit_id}: {str(e)}")
-        return False
-
-
-def read_patch_file(file_path):
-    encodings = ["utf-8", "latin-1", "ascii"]
-    for encoding in encodings:
-        try:
-            with open(file_path, "r", encoding=encoding) as f:
-                return f.read()
-        except UnicodeDecodeError:
-            continue
-    logging.error(f"Failed to read patch file with any encoding: {file_path}")
-    return None
+MANIFEST_STAGE = "benign_commits"
+
+
+def get_benign_commits(repo, repo_url, excluded_commits, vuln_commits, num_benign):
+    # Only sample commits that look like the repo's vuln-introducing commits
+    return sample_matching_commits(
+        repo, repo_url, excluded_commits, vuln_commits, num_benign
+    )
+
+
+def get_vuln_intro_commits_by_repo():
+    """Get the vulnerability-introducing commits of every repository.
+    organized_commits.json also holds the security fixes, so the profile
+    benign commits are matched against comes from vuln_intro_metadata.
+    Returns:
+        dict: repo_url -> set of commit ids
+    """
+    _, cve_to_repo = process_csv(COMMITS_CSV_FILE)
+    vuln_commits = defaultdict(set)
+    for key in get_dataset_keys(VULN_INTRO_METADATA, VULNERABILITY_INTRO_METADATA_DIR):
+        # Keys are "<cve_id>/<commit_id>.json"
+        cve_id, commit_file = key.split("/")
+        repo_url = cve_to_repo.get(cve_id)
+        if repo_url:
+            vuln_commits[repo_url].add(commit_file[:-5])
+    return vuln_commits
 
 
 def get_patch_info(patch_content):
     if patch_content is None:
         return {}
-
-    file_changes = {}
-    current_file = None
-    for line in patch_content.split("\n"):
-        if line.startswith("diff --git"):
-            current_file = line.split()[-1][2:]
-            file_changes[current_file] = {"added_lines": [], "removed_lines": []}
-        elif current_file:
-            if line.startswith("+") and not line.startswith("+++"):
-                file_changes[current_file]["added_lines"].append(line[1:])
-            elif line.startswith("-") and not line.startswith("---"):
-                file_changes[current_file]["removed_lines"].append(line[1:])
-    return file_changes
+    return get_changed_lines(patch_content)
 
 
 def count_existing_benign_commits(repo_name):
+    manifest = get_manifest()
+    count = manifest.count_done(MANIFEST_STAGE, f"{repo_name}/")
+    if count or any(
+        item.startswith(f"{repo_name}/") for item in manifest.get_items(MANIFEST_STAGE)
+    ):
+        return count
+
+    # Register commits saved before the manifest existed
     repo_benign_dir = os.path.join(BENIGN_COMMITS_DIR, repo_name)
     if not os.path.exists(repo_benign_dir):
         return 0
-    return len([f for f in os.listdir(repo_benign_dir) if f.endswith(".json")])
-
-
-def count_existing_patch_files(repo_name):
-    repo_patches_dir = os.path.join(BENIGN_PATCHES_DIR, repo_name)
-    if not os.path.exists(repo_patches_dir):
-        return 0
-    return len([f for f in os.listdir(repo_patches_dir) if f.endswith(".patch")])
+    json_files = [f for f in os.listdir(repo_benign_dir) if f.endswith(".json")]
+    manifest.record_many(
+        MANIFEST_STAGE,
+        (
+            (f"{repo_name}/{f}", "done", None, os.path.join(repo_benign_dir, f), None)
+            for f in json_files
+        ),
+    )
+    return len(json_files)
 
 
 def process_benign_commits():
@@ -107,30 +90,18 @@ def process_benign_commits():
 
     with open("organized_commits.json", "r") as f:
         organized_commits = json.load(f)
+    vuln_commits_by_repo = get_vuln_intro_commits_by_repo()
 
     for repo_url, commits in tqdm(
         organized_commits.items(), desc="Processing repositories"
     ):
         repo_name = repo_url.split("/")[-1]
-        repo_path = os.path.join(REPO_CACHE_DIR, repo_name)
-
-        if not os.path.exists(repo_path):
-            logging.warning(f"Repository not found: {repo_path}. Skipping.")
-            continue
-
-        try:
-            repo = Repo(repo_path)
-        except Exception as e:
-            logging.error(f"Failed to load repository {repo_path}: {str(e)}")
-            continue
+        repo_path = get_repo_path(repo_url)
 
         num_benign_commits_required = len(commits) * BENIGN_COMMITS_PER_VULN
         existing_benign_commits = count_existing_benign_commits(repo_name)
-        existing_patch_files = count_existing_patch_files(repo_name)
         num_benign_commits_to_process = max(
-            0,
-            num_benign_commits_required
-            - max(existing_benign_commits, existing_patch_files),
+            0, num_benign_commits_required - existing_benign_commits
         )
 
         if num_benign_commits_to_process == 0:
@@ -143,40 +114,56 @@ def process_benign_commits():
             f"Processing {num_benign_commits_to_process} additional benign commits for {repo_name}"
         )
 
+        if not os.path.exists(repo_path):
+            logging.warning(f"Repository not found: {repo_path}. Skipping.")
+            continue
+
+        try:
+            repo = Repo(repo_path)
+        except Exception as e:
+            logging.error(f"Failed to load repository {repo_path}: {str(e)}")
+            continue
+
+        # The sample is reproducible, so draw the full quota and skip the
+        # commits earlier runs already saved
         try:
             benign_commits = get_benign_commits(
-                repo, set(commits), num_benign_commits_to_process
+                repo,
+                repo_url,
+                set(commits),
+                vuln_commits_by_repo.get(repo_url, set()),
+                num_benign_commits_required,
             )
         except Exception as e:
             logging.error(f"Failed to get benign commits for {repo_path}: {str(e)}")
             continue
 
-        # Create repository-specific directories for patches and benign commits
-        repo_patches_dir = os.path.join(BENIGN_PATCHES_DIR, repo_name)
+        # Create repository-specific directory for benign commits
         repo_benign_commits_dir = os.path.join(BENIGN_COMMITS_DIR, repo_name)
-        os.makedirs(repo_patches_dir, exist_ok=True)
         os.makedirs(repo_benign_commits_dir, exist_ok=True)
 
-        for commit in benign_commits:
-            commit_id = commit.hexsha
+        pending_commits = []
+        for commit_id in benign_commits:
+            if len(pending_commits) == num_benign_commits_to_process:
+                break
 
             # Check if JSON file already exists
-            json_file = os.path.join(repo_benign_commits_dir, f"{commit_id}.json")
-            if os.path.exists(json_file):
+            if get_manifest().is_done(MANIFEST_STAGE, f"{repo_name}/{commit_id}.json"):
                 logging.info(
                     f"JSON file already exists for commit {commit_id}. Skipping processing."
                 )
                 continue
+            pending_commits.append(commit_id)
 
-            # Download and save patch content
-            patch_file = os.path.join(repo_patches_dir, f"{commit_id}.patch")
-            if download_patch(repo_url, commit_id, patch_file):
-                logging.info(f"Downloaded patch for benign commit: {commit_id}")
+        # Get the patches through the patch store
+        patches = get_patches(repo_url, pending_commits, repo)
 
-                # Read the patch content
-                patch_content = read_patch_file(patch_file)
-                if patch_content is None:
-                    continue
+        records = []  # (item, json_data, json_file, patch hash), saved at once
+        for commit_id in pending_commits:
+            json_file = os.path.join(repo_benign_commits_dir, f"{commit_id}.json")
+            patch_content = patches.get(commit_id)
+            if patch_content is not None:
+                logging.info(f"Got patch for benign commit: {commit_id}")
 
                 # Process patch info
                 file_changes = get_patch_info(patch_content)
@@ -188,18 +175,39 @@ def process_benign_commits():
                     "file_changes": file_changes,
                 }
 
-                # Save JSON data in repository-specific subfolder
-                try:
-                    with open(json_file, "w") as f:
-                        json.dump(json_data, f, indent=2)
-                except IOError as e:
-                    logging.error(f"Failed to write JSON file {json_file}: {str(e)}")
+                records.append(
+                    (
+                        f"{repo_name}/{commit_id}.json",
+                        json_data,
+                        json_file,
+                        hash_bytes(patch_content),
+                    )
+                )
 
             else:
                 logging.warning(
                     f"Failed to download patch for benign commit: {commit_id}"
                 )
 
+        # Save the repo's records in one batch
+        try:
+            output_hashes = save_records(
+                BENIGN_COMMITS,
+                ((item, data, path) for item, data, path, _ in records),
+            )
+        except IOError as e:
+            logging.error(f"Failed to save benign commits of {repo_name}: {str(e)}")
+            continue
+        get_manifest().record_many(
+            MANIFEST_STAGE,
+            (
+                (item, "done", input_hash, path, output_hash)
+                for (item, _, path, input_hash), output_hash in zip(
+                    records, output_hashes
+                )
+            ),
+        )
+
     logging.info("Benign commit processing completed.")
 
 
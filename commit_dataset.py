@@ -0,0 +1,266 @@
+import os
+import gzip
+import json
+import fcntl
+import sqlite3
+import hashlib
+import threading
+
+from constants import DATASET_DIR, DATASET_SHARDS, DATASET_WRITE_JSON_FILES
+from stage_manifest import hash_bytes
+
+# Datasets, named after the directories of JSON files they replace
+COMMIT_METADATA = "commit_metadata"  # key: "<cve_id>.json"
+VULN_INTRO_METADATA = "vuln_intro_metadata"  # key: "<cve_id>/<commit_id>.json"
+BENIGN_COMMITS = "benign_commits"  # key: "<repo_name>/<commit_id>.json"
+TOKENIZED_VULN_INTRO_COMMITS = "tokenized_vuln_intro_commits"
+TOKENIZED_BENIGN_COMMITS = "tokenized_benign_commits"
+
+
+def record_hash(record):
+    """Hash a record as the indented JSON file it used to be stored in."""
+    return hash_bytes(json.dumps(record, indent=2))
+
+
+class CommitDataset:
+    """Append-only store of JSON records keyed by their old relative path.
+    Records are spread over gzip-compressed JSONL shards; every record is
+    its own gzip member, so it can be read alone through the SQLite index
+    of (shard, offset, length), while a scan reads the shards front to
+    back. Rewriting a key appends a new record and repoints the index.
+    """
+
+    def __init__(self, name, root=DATASET_DIR, num_shards=DATASET_SHARDS):
+        self.name = name
+        self.path = os.path.join(root, name)
+        self.num_shards = num_shards
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+        self._conn = sqlite3.connect(
+            os.path.join(self.path, "index.db"), timeout=60, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS records (
+                key TEXT PRIMARY KEY,
+                shard INTEGER,
+                offset INTEGER,
+                length INTEGER
+            )""")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        self._conn.commit()
+
+    def get_meta(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value)
+            )
+            self._conn.commit()
+
+    def _shard_path(self, shard):
+        return os.path.join(self.path, f"shard-{shard:02d}.jsonl.gz")
+
+    def _shard(self, key):
+        return int(hashlib.md5(key.encode()).hexdigest()[:8], 16) % self.num_shards
+
+    def put(self, key, record):
+        self.put_many([(key, record)])
+
+    def put_many(self, items):
+        """Append (key, record) pairs, holding each shard's file lock once."""
+        by_shard = {}
+        for key, record in items:
+            line = json.dumps(record, separators=(",", ":")) + "\n"
+            by_shard.setdefault(self._shard(key), []).append(
+                (key, gzip.compress(line.encode("utf-8")))
+            )
+
+        entries = []
+        for shard, members in by_shard.items():
+            with open(self._shard_path(shard), "ab") as f:
+                # Other processes may append to the same shard
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    offset = f.seek(0, os.SEEK_END)
+                    for key, data in members:
+                        f.write(data)
+                        entries.append((key, shard, offset, len(data)))
+                        offset += len(data)
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)", entries
+            )
+            self._conn.commit()
+
+    def get(self, key):
+        """Read one record, or None if the key isn't in the dataset."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT shard, offset, length FROM records WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        shard, offset, length = row
+        with open(self._shard_path(shard), "rb") as f:
+            f.seek(offset)
+            return json.loads(gzip.decompress(f.read(length)))
+
+    def __contains__(self, key):
+        with self._lock:
+            return (
+                self._conn.execute(
+                    "SELECT 1 FROM records WHERE key = ?", (key,)
+                ).fetchone()
+                is not None
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def keys(self, prefix=""):
+        with self._lock:
+            return [
+                key
+                for (key,) in self._conn.execute(
+                    "SELECT key FROM records WHERE substr(key, 1, ?) = ? ORDER BY key",
+                    (len(prefix), prefix),
+                )
+            ]
+
+    def iter_records(self, prefix=""):
+        """Yield (key, record) for every current record, shard by shard.
+        Records are read in file order, so a scan is one sequential read
+        per shard; records superseded by a later put are skipped.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT key, shard, offset, length FROM records
+                WHERE substr(key, 1, ?) = ? ORDER BY shard, offset""",
+                (len(prefix), prefix),
+            ).fetchall()
+        f = None
+        current_shard = None
+        try:
+            for key, shard, offset, length in rows:
+                if shard != current_shard:
+                    if f is not None:
+                        f.close()
+                    f = open(self._shard_path(shard), "rb")
+                    current_shard = shard
+                if f.tell() != offset:
+                    f.seek(offset)
+                yield key, json.loads(gzip.decompress(f.read(length)))
+        finally:
+            if f is not None:
+                f.close()
+
+
+_datasets = {}
+_datasets_lock = threading.Lock()
+
+
+def get_dataset(name):
+    with _datasets_lock:
+        if name not in _datasets:
+            _datasets[name] = CommitDataset(name)
+        return _datasets[name]
+
+
+def save_records(name, records):
+    """Save (key, record, json_path) triples to a dataset in one put_many.
+    The JSON files are only written if DATASET_WRITE_JSON_FILES is set.
+    Returns:
+        list: record_hash of each record, in order, which equals the hash
+        of its JSON file
+    """
+    records = list(records)
+    if records:
+        get_dataset(name).put_many((key, record) for key, record, _ in records)
+    hashes = []
+    for _, record, json_path in records:
+        if json_path is not None and DATASET_WRITE_JSON_FILES:
+            os.makedirs(os.path.dirname(json_path), exist_ok=True)
+            with open(json_path, "w") as f:
+                json.dump(record, f, indent=2)
+        hashes.append(record_hash(record))
+    return hashes
+
+
+def save_record(name, key, record, json_path=None):
+    """Save one record; prefer save_records when saving many."""
+    return save_records(name, [(key, record, json_path)])[0]
+
+
+def _get_imported_dataset(name, directory):
+    # JSON files written to directory before the dataset existed are
+    # imported the first time, so callers never need to walk it again
+    dataset = get_dataset(name)
+    if dataset.get_meta("imported_from") != directory:
+        import_directory(name, directory)
+    return dataset
+
+
+def iter_json_records(name, directory):
+    """Yield (key, record) for every record of a dataset.
+    Args:
+        name (str): Dataset name
+        directory (str): Directory of JSON files the dataset replaces
+    """
+    yield from _get_imported_dataset(name, directory).iter_records()
+
+
+def get_dataset_keys(name, directory):
+    """Get the keys of a dataset without reading its records."""
+    return _get_imported_dataset(name, directory).keys()
+
+
+def count_records(name, directory):
+    """Count the records of a dataset from its index."""
+    return len(_get_imported_dataset(name, directory))
+
+
+def import_directory(name, directory, batch_size=1000):
+    """Load a directory of per-commit JSON files into a dataset.
+    Files whose key is already in the dataset are left alone, since the
+    dataset copy is at least as new.
+    Returns:
+        int: Number of records imported
+    """
+    dataset = get_dataset(name)
+    existing = set(dataset.keys())
+    batch = []
+    count = 0
+    for root, _, files in os.walk(directory):
+        for file in files:
+            if not file.endswith(".json"):
+                continue
+            path = os.path.join(root, file)
+            key = os.path.relpath(path, directory)
+            if key in existing:
+                continue
+            try:
+                with open(path, "r") as f:
+                    batch.append((key, json.load(f)))
+            except (OSError, json.JSONDecodeError):
+                continue
+            if len(batch) >= batch_size:
+                dataset.put_many(batch)
+                count += len(batch)
+                batch = []
+    dataset.put_many(batch)
+    count += len(batch)
+    dataset.set_meta("imported_from", directory)
+    return count
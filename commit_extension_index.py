@@ -0,0 +1,316 @@
+import os
+import array
+import random
+import sqlite3
+import logging
+import threading
+import subprocess
+
+from constants import (
+    COMMIT_EXTENSION_INDEX_DB,
+    BENIGN_SIZE_TOLERANCE,
+    BENIGN_SAMPLE_SEED,
+)
+from git_batch import get_git_batch
+from patch_store import normalize_repo_url
+from patch_parser import unquote_path
+from benign_sampler import sample_commits
+
+# Commits are written to the index in batches of this many
+INSERT_BATCH_SIZE = 10000
+
+
+def get_file_key(path):
+    """Get the extension of a path, or its file name if it has none."""
+    _, ext = os.path.splitext(path)
+    return ext.lower() if ext else os.path.basename(path)
+
+
+def iter_commit_changes(repo, revs):
+    """Stream the touched file keys and changed line count of commits.
+    Args:
+        repo (git.Repo): Repository object
+        revs (list): Revisions for `git log --stdin`, e.g. tips and ^old tips
+    Yields:
+        tuple: (full SHA, set of file keys, lines added plus removed)
+    """
+    process = subprocess.Popen(
+        [
+            "git",
+            f"--git-dir={repo.git_dir}",
+            "log",
+            "--stdin",
+            "--numstat",
+            "--no-renames",
+            "--diff-merges=first-parent",
+            "--format=%x1e%H",
+        ],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    # git reads all of stdin before it starts writing, so this can't block
+    process.stdin.write("".join(f"{rev}\n" for rev in revs).encode())
+    process.stdin.close()
+
+    sha = None
+    file_keys = set()
+    size = 0
+    for line in process.stdout:
+        line = line.decode("utf-8", errors="replace").rstrip("\n")
+        if line.startswith("\x1e"):
+            if sha is not None:
+                yield sha, file_keys, size
+            sha, file_keys, size = line[1:], set(), 0
+            continue
+        fields = line.split("\t", 2)
+        if sha is None or len(fields) != 3:
+            continue
+        added, removed, path = fields
+        file_keys.add(get_file_key(unquote_path(path)))
+        # Binary files show "-" for both counts
+        size += int(added) if added.isdigit() else 0
+        size += int(removed) if removed.isdigit() else 0
+    if sha is not None:
+        yield sha, file_keys, size
+    process.stdout.close()
+    if process.wait() != 0:
+        raise RuntimeError(f"git log failed in {repo.git_dir}")
+
+
+class CommitExtensionIndex:
+    """Index of every commit's touched file extensions and size, per repo.
+    The tips the index was last built from are stored, so an update only
+    walks commits that became reachable since then.
+    """
+
+    def __init__(self, db_file=COMMIT_EXTENSION_INDEX_DB):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, timeout=60, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS commits (
+                id INTEGER PRIMARY KEY,
+                repo TEXT,
+                sha TEXT,
+                size INTEGER,
+                UNIQUE (repo, sha)
+            )""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS commit_exts (
+                commit_id INTEGER,
+                ext TEXT,
+                PRIMARY KEY (ext, commit_id)
+            )""")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tips (repo TEXT, sha TEXT, PRIMARY KEY (repo, sha))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_repo_size ON commits (repo, size)"
+        )
+        self._conn.commit()
+
+    def update(self, repo, repo_url):
+        """Index the commits that became reachable since the last update.
+        Returns:
+            int: Number of commits added to the index
+        """
+        repo_key = normalize_repo_url(repo_url)
+        tips = (
+            subprocess.run(
+                [
+                    "git",
+                    f"--git-dir={repo.git_dir}",
+                    "for-each-ref",
+                    "--format=%(objectname)",
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                check=True,
+            )
+            .stdout.decode()
+            .split()
+        )
+        tips = sorted(set(tips))
+        with self._lock:
+            old_tips = [
+                sha
+                for (sha,) in self._conn.execute(
+                    "SELECT sha FROM tips WHERE repo = ?", (repo_key,)
+                )
+            ]
+        if sorted(old_tips) == tips:
+            return 0
+
+        # Old tips that were gc'd after a force-push can't be excluded; their
+        # commits are simply walked again and ignored as duplicates
+        known_tips = [
+            sha for sha in get_git_batch(repo).resolve_commits(old_tips).values() if sha
+        ]
+        revs = tips + [f"^{sha}" for sha in known_tips]
+        logging.info(
+            f"Updating extension index for {repo_key} from {len(tips)} tips, "
+            f"excluding {len(known_tips)} indexed tips"
+        )
+
+        num_commits = 0
+        batch = []
+        for change in iter_commit_changes(repo, revs):
+            batch.append(change)
+            if len(batch) >= INSERT_BATCH_SIZE:
+                num_commits += self._insert(repo_key, batch)
+                batch = []
+        num_commits += self._insert(repo_key, batch)
+
+        with self._lock:
+            self._conn.execute("DELETE FROM tips WHERE repo = ?", (repo_key,))
+            self._conn.executemany(
+                "INSERT INTO tips VALUES (?, ?)", ((repo_key, sha) for sha in tips)
+            )
+            self._conn.commit()
+        logging.info(f"Indexed {num_commits} new commits of {repo_key}")
+        return num_commits
+
+    def _insert(self, repo_key, batch):
+        num_inserted = 0
+        with self._lock:
+            for sha, file_keys, size in batch:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO commits (repo, sha, size) VALUES (?, ?, ?)",
+                    (repo_key, sha, size),
+                )
+                if cursor.rowcount == 0:
+                    continue
+                num_inserted += 1
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO commit_exts VALUES (?, ?)",
+                    ((cursor.lastrowid, ext) for ext in file_keys),
+                )
+            self._conn.commit()
+        return num_inserted
+
+    def get_profile(self, repo_url, commit_shas, tolerance=BENIGN_SIZE_TOLERANCE):
+        """Get the extensions and size range of a set of commits.
+        Returns:
+            tuple: (set of file keys, min size, max size), or None if none
+            of the commits are indexed
+        """
+        repo_key = normalize_repo_url(repo_url)
+        exts = set()
+        sizes = []
+        with self._lock:
+            for sha in commit_shas:
+                row = self._conn.execute(
+                    "SELECT id, size FROM commits WHERE repo = ? AND sha = ?",
+                    (repo_key, sha),
+                ).fetchone()
+                if row is None:
+                    continue
+                sizes.append(row[1])
+                exts.update(
+                    ext
+                    for (ext,) in self._conn.execute(
+                        "SELECT ext FROM commit_exts WHERE commit_id = ?", (row[0],)
+                    )
+                )
+        if not sizes or not exts:
+            return None
+        return exts, min(sizes) // tolerance, max(sizes) * tolerance
+
+    def get_matching_ids(self, repo_url, exts, min_size, max_size):
+        """Get the ids of commits touching one of exts within a size range."""
+        repo_key = normalize_repo_url(repo_url)
+        exts = sorted(exts)
+        placeholders = ",".join("?" * len(exts))
+        ids = array.array("q")
+        with self._lock:
+            ids.extend(
+                commit_id
+                for (commit_id,) in self._conn.execute(
+                    f"""SELECT DISTINCT c.id FROM commits c
+                    JOIN commit_exts e ON e.commit_id = c.id
+                    WHERE c.repo = ? AND c.size BETWEEN ? AND ?
+                    AND e.ext IN ({placeholders})
+                    ORDER BY c.id""",
+                    (repo_key, min_size, max_size, *exts),
+                )
+            )
+        return ids
+
+    def get_shas(self, commit_ids):
+        with self._lock:
+            return [
+                self._conn.execute(
+                    "SELECT sha FROM commits WHERE id = ?", (commit_id,)
+                ).fetchone()[0]
+                for commit_id in commit_ids
+            ]
+
+
+_extension_index = None
+_extension_index_lock = threading.Lock()
+
+
+def get_extension_index():
+    global _extension_index
+    with _extension_index_lock:
+        if _extension_index is None:
+            _extension_index = CommitExtensionIndex()
+        return _extension_index
+
+
+def sample_matching_commits(
+    repo,
+    repo_url,
+    excluded_commits,
+    profile_commits,
+    num_samples,
+    seed=BENIGN_SAMPLE_SEED,
+):
+    """Draw random commits that match the profile of a repo's vuln commits.
+    Candidates must touch a file extension the profile commits touch and
+    have a size within BENIGN_SIZE_TOLERANCE of theirs. If the profile is
+    unknown or too few commits match, the rest is sampled uniformly.
+    Args:
+        repo (git.Repo): Repository object
+        repo_url (str): URL of the repository
+        excluded_commits (iterable): Commits never sampled, e.g. the repo's
+            security fixes and vuln commits
+        profile_commits (iterable): The repo's vulnerability-introducing
+            commits, whose profile the samples match; also never sampled
+        num_samples (int): Number of commits to draw
+        seed: Seed for the random generator
+    Returns:
+        list: Up to num_samples full commit SHAs
+    """
+    git_batch = get_git_batch(repo)
+    resolved = git_batch.resolve_commits(profile_commits)
+    profile_shas = {sha for sha in resolved.values() if sha}
+    excluded = set(profile_shas)
+    excluded.update(resolved)
+    resolved = git_batch.resolve_commits(excluded_commits)
+    excluded.update(sha for sha in resolved.values() if sha)
+    excluded.update(resolved)
+
+    samples = []
+    try:
+        index = get_extension_index()
+        index.update(repo, repo_url)
+        profile = index.get_profile(repo_url, profile_shas)
+        if profile is not None:
+            ids = index.get_matching_ids(repo_url, *profile)
+            rng = random.Random(f"{seed}:{normalize_repo_url(repo_url)}")
+            num_draws = min(len(ids), num_samples + len(excluded))
+            drawn = [ids[i] for i in rng.sample(range(len(ids)), num_draws)]
+            samples = [sha for sha in index.get_shas(drawn) if sha not in excluded]
+            samples = samples[:num_samples]
+            logging.info(
+                f"{len(ids)} commits of {repo_url} match extensions "
+                f"{sorted(profile[0])} and sizes {profile[1]}-{profile[2]}"
+            )
+    except Exception as e:
+        logging.error(f"Extension index unavailable for {repo_url}: {str(e)}")
+
+    if len(samples) < num_samples:
+        samples += sample_commits(
+            repo, excluded | set(samples), num_samples - len(samples), seed
+        )
+    return samples
@@ -0,0 +1,159 @@
+import os
+import csv
+import json
+import sqlite3
+import hashlib
+import logging
+
+from constants import COMMITS_CSV_FILE, COMMIT_INDEX_DB
+
+# One open connection per (csv_file, db_file) for the lifetime of the process
+_connections = {}
+
+
+def _file_hash(path):
+    """Return the SHA-256 of a file's contents."""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _stored_hash(db_file):
+    if not os.path.exists(db_file):
+        return None
+    try:
+        conn = sqlite3.connect(db_file)
+        try:
+            row = conn.execute(
+                "SELECT value FROM meta WHERE key = 'csv_hash'"
+            ).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+    except sqlite3.DatabaseError:
+        return None
+
+
+def _build_index(csv_file, db_file, csv_hash):
+    """Parse the CSV once and write it to a fresh SQLite index.
+    The index is built in a temporary file and moved into place so that
+    concurrent readers never see a half-written database.
+    """
+    logging.info(f"Building commit index {db_file} from {csv_file}")
+    tmp_file = f"{db_file}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+
+    conn = sqlite3.connect(tmp_file)
+    try:
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("""CREATE TABLE commits (
+                row_number INTEGER PRIMARY KEY,
+                cve_id TEXT,
+                commit_id TEXT,
+                repo_url TEXT,
+                row_json TEXT
+            )""")
+        with open(csv_file, "r", newline="") as f:
+            reader = csv.DictReader(f)
+            conn.executemany(
+                "INSERT INTO commits VALUES (?, ?, ?, ?, ?)",
+                (
+                    (
+                        i,
+                        row.get("cve_id"),
+                        row.get("commit_id"),
+                        row.get("repo_url"),
+                        json.dumps(row),
+                    )
+                    for i, row in enumerate(reader)
+                ),
+            )
+            fieldnames = reader.fieldnames or []
+        conn.execute("CREATE INDEX idx_commit_id ON commits (commit_id)")
+        conn.execute("CREATE INDEX idx_cve_id ON commits (cve_id)")
+        conn.execute("CREATE INDEX idx_repo_url ON commits (repo_url)")
+        conn.executemany(
+            "INSERT INTO meta VALUES (?, ?)",
+            [("csv_hash", csv_hash), ("fieldnames", json.dumps(fieldnames))],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.replace(tmp_file, db_file)
+    logging.info(f"Commit index {db_file} is up to date")
+
+
+def get_index(csv_file=COMMITS_CSV_FILE, db_file=COMMIT_INDEX_DB):
+    """Get a connection to the commit index, rebuilding it if the CSV changed.
+    Args:
+        csv_file (str): Path to the commits CSV
+        db_file (str): Path to the SQLite index
+    Returns:
+        sqlite3.Connection: Connection to the up-to-date index
+    """
+    key = (os.path.abspath(csv_file), os.path.abspath(db_file))
+    if key in _connections:
+        return _connections[key]
+
+    csv_hash = _file_hash(csv_file)
+    if _stored_hash(db_file) != csv_hash:
+        _build_index(csv_file, db_file, csv_hash)
+
+    conn = sqlite3.connect(db_file, check_same_thread=False)
+    _connections[key] = conn
+    return conn
+
+
+def get_fieldnames(csv_file=COMMITS_CSV_FILE):
+    conn = get_index(csv_file)
+    row = conn.execute("SELECT value FROM meta WHERE key = 'fieldnames'").fetchone()
+    return json.loads(row[0])
+
+
+def count_rows(csv_file=COMMITS_CSV_FILE):
+    conn = get_index(csv_file)
+    return conn.execute("SELECT COUNT(*) FROM commits").fetchone()[0]
+
+
+def iter_rows(csv_file=COMMITS_CSV_FILE):
+    """Yield every CSV row as a dict, in file order."""
+    conn = get_index(csv_file)
+    for (row_json,) in conn.execute("SELECT row_json FROM commits ORDER BY row_number"):
+        yield json.loads(row_json)
+
+
+def get_repo_url(commit_id, csv_file=COMMITS_CSV_FILE):
+    """Get the repository URL of a commit, or None if it isn't in the CSV."""
+    conn = get_index(csv_file)
+    row = conn.execute(
+        "SELECT repo_url FROM commits WHERE commit_id = ? ORDER BY row_number LIMIT 1",
+        (commit_id,),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def get_rows_by_commit(commit_id, csv_file=COMMITS_CSV_FILE):
+    return _select_rows("commit_id", commit_id, csv_file)
+
+
+def get_rows_by_cve(cve_id, csv_file=COMMITS_CSV_FILE):
+    return _select_rows("cve_id", cve_id, csv_file)
+
+
+def get_rows_by_repo(repo_url, csv_file=COMMITS_CSV_FILE):
+    return _select_rows("repo_url", repo_url, csv_file)
+
+
+def _select_rows(column, value, csv_file):
+    conn = get_index(csv_file)
+    return [
+        json.loads(row_json)
+        for (row_json,) in conn.execute(
+            f"SELECT row_json FROM commits WHERE {column} = ? ORDER BY row_number",
+            (value,),
+        )
+    ]
@@ -0,0 +1,169 @@
+import json
+import sqlite3
+import logging
+import threading
+import subprocess
+
+from constants import COMMIT_METADATA_DB
+from git_batch import get_git_batch
+from patch_parser import unquote_path
+
+# One record per commit: RS, then the header fields separated by US and
+# terminated by a final US, then the --numstat lines
+LOG_FORMAT = "%x1e%H%x1f%an%x1f%ae%x1f%cI%x1f%B%x1f"
+RECORD_SEPARATOR = "\x1e"
+FIELD_SEPARATOR = "\x1f"
+
+
+def _parse_numstat(numstat):
+    files_changed = []
+    insertions = deletions = 0
+    for line in numstat.splitlines():
+        fields = line.split("\t", 2)
+        if len(fields) != 3:
+            continue
+        added, removed, path = fields
+        files_changed.append(unquote_path(path))
+        # Binary files show "-" for both counts
+        insertions += int(added) if added.isdigit() else 0
+        deletions += int(removed) if removed.isdigit() else 0
+    return files_changed, insertions, deletions
+
+
+def extract_metadata(repo, commit_ids):
+    """Extract the metadata of many commits with a single `git log` stream.
+    Files changed and line counts are taken against the first parent with
+    renames off, which is what `commit.stats` reports.
+    Args:
+        repo (git.Repo): Repository object
+        commit_ids (iterable): Commit SHAs, possibly abbreviated
+    Returns:
+        dict: commit_id -> metadata dict, for the commits found in the repo
+    """
+    resolved = get_git_batch(repo).resolve_commits(commit_ids)
+    full_shas = list(dict.fromkeys(sha for sha in resolved.values() if sha))
+    if not full_shas:
+        return {}
+
+    process = subprocess.Popen(
+        [
+            "git",
+            f"--git-dir={repo.git_dir}",
+            "log",
+            "--no-walk=unsorted",
+            "--stdin",
+            "--numstat",
+            "--no-renames",
+            "--diff-merges=first-parent",
+            f"--format={LOG_FORMAT}",
+        ],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    output, error = process.communicate("\n".join(full_shas).encode() + b"\n")
+    if process.returncode != 0:
+        logging.error(
+            f"git log failed in {repo.git_dir}: {error.decode(errors='replace')}"
+        )
+        return {}
+
+    metadata = {}
+    for record in output.decode("utf-8", errors="replace").split(RECORD_SEPARATOR):
+        fields = record.split(FIELD_SEPARATOR, 5)
+        if len(fields) != 6:
+            continue
+        sha, author, author_email, committed_date, message, numstat = fields
+        files_changed, insertions, deletions = _parse_numstat(numstat)
+        metadata[sha] = {
+            "hash": sha,
+            "author": author,
+            "author_email": author_email,
+            "committed_date": committed_date,
+            "message": message.strip(),
+            "files_changed": files_changed,
+            "insertions": insertions,
+            "deletions": deletions,
+        }
+
+    return {
+        commit_id: metadata[sha]
+        for commit_id, sha in resolved.items()
+        if sha in metadata
+    }
+
+
+class MetadataStore:
+    """Persistent commit metadata keyed by full commit SHA.
+    Metadata of a commit never changes, so entries are never invalidated
+    and can be shared by every stage and repository.
+    """
+
+    def __init__(self, db_file=COMMIT_METADATA_DB):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, timeout=60, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS metadata (sha TEXT PRIMARY KEY, data TEXT)"
+        )
+        self._conn.commit()
+
+    def get_many(self, shas):
+        found = {}
+        with self._lock:
+            for sha in shas:
+                row = self._conn.execute(
+                    "SELECT data FROM metadata WHERE sha = ?", (sha,)
+                ).fetchone()
+                if row is not None:
+                    found[sha] = json.loads(row[0])
+        return found
+
+    def put_many(self, metadata):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?)",
+                ((sha, json.dumps(data)) for sha, data in metadata.items()),
+            )
+            self._conn.commit()
+
+
+_metadata_store = None
+_metadata_store_lock = threading.Lock()
+
+
+def get_metadata_store():
+    global _metadata_store
+    with _metadata_store_lock:
+        if _metadata_store is None:
+            _metadata_store = MetadataStore()
+        return _metadata_store
+
+
+def get_metadata(repo, commit_ids):
+    """Get the metadata of many commits, from the store or in one git call.
+    Args:
+        repo (git.Repo): Repository object
+        commit_ids (iterable): Commit SHAs, possibly abbreviated
+    Returns:
+        dict: commit_id -> metadata dict, for the commits found
+    """
+    commit_ids = list(dict.fromkeys(commit_ids))
+    full_shas = {commit_id: commit_id for commit_id in commit_ids}
+    short_ids = [commit_id for commit_id in commit_ids if len(commit_id) != 40]
+    if short_ids:
+        for commit_id, sha in get_git_batch(repo).resolve_commits(short_ids).items():
+            full_shas[commit_id] = sha or commit_id
+
+    stored = get_metadata_store().get_many(set(full_shas.values()))
+    metadata = {
+        commit_id: stored[sha] for commit_id, sha in full_shas.items() if sha in stored
+    }
+    missing = [commit_id for commit_id in commit_ids if commit_id not in metadata]
+    if missing:
+        extracted = extract_metadata(repo, missing)
+        get_metadata_store().put_many(
+            {data["hash"]: data for data in extracted.values()}
+        )
+        metadata.update(extracted)
+    return metadata
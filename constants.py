@@ -19,6 +19,69 @@ VECTOR_VULN_INTRO_COMMITS_DIR = "vector_vuln_intro_commits_dir"
 PADDED_BENIGN_COMMITS_DIR = "padded_benign_commits"
 PADDED_VULN_INTRO_COMMITS_DIR = "padded_vuln_intro_commits"
 
+COMMITS_CSV_FILE = "commits_with_parent_ids.csv"
+COMMIT_INDEX_DB = "commit_index.db"  # SQLite index over COMMITS_CSV_FILE
+
+REPO_FETCH_TTL_SECONDS = 6 * 60 * 60  # skip fetching repos updated more recently
+REPO_FETCH_WORKERS = 4  # concurrent clone/fetch operations
+
+# Keep the repo cache as bare clones: blame, metadata and diffs are resolved
+# from the object database by SHA, so no stage ever rewrites a working tree
+REPO_CACHE_BARE = False
+
+MAX_OPEN_REPOS = 32  # open repos (and their git helper processes) per process
+
+BLAME_CACHE_DB = "blame_cache.db"
+BLAME_CACHE_MAX_BYTES = 2 * 1024**3  # compressed blame data kept before evicting
+
+BLAME_WORKERS = 8  # files of one security patch blamed concurrently
+
+HTTP_MAX_CONNECTIONS = 8  # concurrent requests and pooled keep-alive connections
+HTTP_MAX_RETRIES = 5
+HTTP_TIMEOUT_SECONDS = 30
+HTTP_BACKOFF_SECONDS = 1.0  # doubled after every failed attempt
+HTTP_MAX_BACKOFF_SECONDS = 300
+
+PATCH_STORE_DIR = "patch_store"  # compressed patches keyed by (repo, full SHA)
+PATCH_STORE_SHARDS = 16
+
+# Per-CVE list of vulnerability-introducing commits in VULNERABILITY_PATCHES_DIR;
+# their patches live in the patch store
+VULN_COMMITS_FILE = "vuln_commits.json"
+
+COMMIT_METADATA_DB = "commit_metadata.db"  # commit metadata keyed by full SHA
+
+BENIGN_SAMPLE_SEED = 0  # benign samples are reproducible for a given seed and refs
+
+# Per-repo commit -> touched extensions and size, for profile-matched benign sampling
+COMMIT_EXTENSION_INDEX_DB = "commit_extension_index.db"
+BENIGN_SIZE_TOLERANCE = 2  # benign sizes may be this factor outside the vuln range
+
+# Shared job queue; keep it on storage every worker node can reach
+WORK_QUEUE_DB = "work_queue.db"
+WORK_LEASE_SECONDS = 600  # a job whose lease expires is handed to another worker
+WORK_MAX_ATTEMPTS = 3  # attempts before a job moves to the dead-letter table
+
+STAGE_MANIFEST_DB = "stage_manifest.db"  # per-item resume state of every stage
+
+CVES_TO_PROCESS_FILE = "CVEs_to_process.txt"
+PIPELINE_MAX_PARALLEL_STAGES = 2  # independent pipeline stages run at the same time
+
+# Append-only gzip JSONL shards with an offset index, one dataset per stage output
+DATASET_DIR = "datasets"
+DATASET_SHARDS = 16
+# The pipeline reads the datasets only; set to also write the per-commit JSON
+# files that the ad-hoc analysis scripts walk
+DATASET_WRITE_JSON_FILES = False
+DATASET_WRITE_BATCH = 500  # records collected by a writer before one put_many
+
+# Tokenize all added/removed lines of a file in one call instead of per line
+TOKENIZER_BATCH_LINES = True
+
+# Worker processes and files per task for the semantic tokenizer (main3)
+TOKENIZER_WORKERS = 1
+TOKENIZER_CHUNKSIZE = 8
+
 
 def loggingConfig():
     logging.basicConfig(
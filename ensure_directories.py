@@ -15,6 +15,8 @@ from constants import (
     VECTOR_VULN_INTRO_COMMITS_DIR,
     PADDED_BENIGN_COMMITS_DIR,
     PADDED_VULN_INTRO_COMMITS_DIR,
+    PATCH_STORE_DIR,
+    DATASET_DIR,
 )
 from constants import loggingConfig
 
@@ -36,6 +38,8 @@ def ensure_dirs():
         VECTOR_VULN_INTRO_COMMITS_DIR,
         PADDED_BENIGN_COMMITS_DIR,
         PADDED_VULN_INTRO_COMMITS_DIR,
+        PATCH_STORE_DIR,
+        DATASET_DIR,
     ]:
         os.makedirs(directory, exist_ok=True)
         logging.info(f"Directory {directory} exists.")
@@ -1,303 +1,482 @@
 import os
 import json
+import queue
 import logging
+import argparse
+import multiprocessing
+from collections import Counter, defaultdict
 from git import Repo, GitCommandError
 from tqdm import tqdm
-import requests
-import csv
-import re
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 from constants import (
-    COMMIT_METADATA_DIR,
     VULNERABILITY_PATCHES_DIR,
-    PATCH_CACHE_DIR,
+    VULN_COMMITS_FILE,
     VULNERABILITY_INTRO_METADATA_DIR,
+    BLAME_WORKERS,
+    CVES_TO_PROCESS_FILE,
     loggingConfig,
 )
 from ensure_directories import ensure_dirs
-from get_cache import get_or_create_repo
-
-CSV_FILE = "commits_with_parent_ids.csv"
-CVES_TO_PROCESS_FILE = "CVEs_to_process.txt"
-
-
-def read_cves_to_process():
-    with open(CVES_TO_PROCESS_FILE, "r") as f:
+from get_cache import get_pooled_repo, get_repo_path, repo_lock
+from commit_index import get_repo_url as lookup_repo_url
+from git_batch import get_git_batch
+from ancestry import get_ancestors
+from blame_engine import build_content_index, lookup_lines, merge_ranges
+from blame_cache import cached_blame_ranges, get_blame_cache
+from patch_store import get_patch, get_patches
+from patch_parser import parse_patch
+from work_queue import WorkQueue, run_worker
+from stage_manifest import get_manifest, dump_json
+from read_existing_data import read_existing_metadata
+
+MANIFEST_STAGE = "vuln_intro_commits"
+
+
+def read_cves_to_process(cves_file=CVES_TO_PROCESS_FILE):
+    with open(cves_file, "r") as f:
         cves = f.read().splitlines()
     # Remove the last line and any empty lines
     return [cve.strip() for cve in cves[:-1] if cve.strip()]
 
 
 def get_repo_url(commit_id):
-    with open(CSV_FILE, "r") as f:
-        reader = csv.reader(f)
-        next(reader)  # Skip header
-        for row in reader:
-            if row[4] == commit_id:  # Commit ID is in the 5th column
-                return row[5]  # Repo URL is in the 6th column
-    return None
+    return lookup_repo_url(commit_id)
 
 
-def get_lines_to_blame(patch_content):
+def get_lines_to_blame(hunks):
+    """Get the context lines around the added lines of a file's hunks.
+    Args:
+        hunks (list): (HunkRecord, [LineRecord]) pairs from parse_patch
+    Returns:
+        list: Stripped context lines, without duplicates
+    """
     lines_to_blame = []
-    lines = patch_content.split("\n")
-    for i, line in enumerate(lines):
-        if line.startswith("+") and not line.startswith("+++"):
-            # Get context lines (up to 3 lines before and after)
-            start = max(0, i - 3)
-            end = min(len(lines), i + 4)
-            context = [
-                l.strip() for l in lines[start:end] if not l.startswith(("+", "-", "@"))
-            ]
-            lines_to_blame.extend(context)
+    for _, lines in hunks:
+        for i, line in enumerate(lines):
+            if line.kind == "+":
+                # Get context lines (up to 3 lines before and after)
+                start = max(0, i - 3)
+                end = min(len(lines), i + 4)
+                context = [l.text.strip() for l in lines[start:end] if l.kind == " "]
+                lines_to_blame.extend(context)
     return list(set(lines_to_blame))  # Remove duplicates
 
 
-def is_valid_commit(repo, commit_hash):
-    try:
-        repo.git.rev_parse("--verify", commit_hash)
-        return True
-    except GitCommandError:
-        return False
-
-
-def blame_lines(repo, file_path, lines_to_blame, security_patch_commit):
+def get_hunk_ranges(hunks):
+    """Get the merged old-side (start, end) line ranges of a file's hunks."""
+    return merge_ranges(
+        (hunk.old_start, hunk.old_start + hunk.old_count - 1)
+        for hunk, _ in hunks
+        if hunk.old_count > 0
+    )
+
+
+def blame_candidates(
+    repo, file_path, lines_to_blame, security_patch_commit, line_ranges=None
+):
+    """Blame lines at the parent of the security patch.
+    Args:
+        line_ranges (list): Old-side (start, end) hunk ranges to blame;
+            None blames the whole file
+    Returns:
+        set: Full SHAs of the valid commits that last touched the lines
+    """
     clean_security_patch_commit = security_patch_commit.lstrip("^")
+    git_batch = get_git_batch(repo)
     try:
-        # Get the parent commit of the security patch
-        try:
-            parent_commit = repo.commit(clean_security_patch_commit + "^")
-        except GitCommandError:
+        # Get the parent commit of the security patch. The batch helper is
+        # thread-safe, unlike GitPython's shared object reader
+        parent_rev = clean_security_patch_commit + "^"
+        parent_commit = git_batch.resolve_commits([parent_rev]).get(parent_rev)
+        if parent_commit is None:
             logging.error(f"No parent commit found for {clean_security_patch_commit}")
-            return []
-
-        # Validate parent_commit
-        if not is_valid_commit(repo, parent_commit.hexsha):
-            logging.error(f"Invalid parent commit: {parent_commit.hexsha}")
-            return []
+            return set()
 
-        # Blame on the parent commit
+        # Blame the hunk ranges on the parent commit
         try:
-            blame = repo.git.blame(
-                "-l", parent_commit.hexsha, "--", file_path
-            ).splitlines()
+            blamed = cached_blame_ranges(repo, parent_commit, file_path, line_ranges)
         except GitCommandError as e:
             if "no such path" in str(e).lower():
-                logging.warning(
-                    f"File {file_path} not found in commit {parent_commit.hexsha}"
-                )
+                logging.warning(f"File {file_path} not found in commit {parent_commit}")
             else:
                 logging.error(f"Git error in blame for {file_path}: {str(e)}")
-            return []
-
-        vuln_introducing_commits = set()
-
-        for line in lines_to_blame:
-            for blame_line in blame:
-                if line.strip() in blame_line:
-                    commit_hash = blame_line.split()[0]
-                    # Clean the commit hash by removing leading carets
-                    clean_commit_hash = commit_hash.lstrip("^")
-                    if is_valid_commit(repo, clean_commit_hash):
-                        try:
-                            if repo.is_ancestor(
-                                clean_commit_hash, security_patch_commit
-                            ):
-                                vuln_introducing_commits.add(clean_commit_hash)
-                        except GitCommandError as e:
-                            logging.error(
-                                f"Error checking ancestry for {clean_commit_hash}: {str(e)}"
-                            )
-
-        # Remove the security patch commit itself, if present
-        vuln_introducing_commits.discard(security_patch_commit)
-
-        return list(vuln_introducing_commits)
-    except Exception as e:
-        logging.error(f"Unexpected error in blame_lines for {file_path}: {str(e)}")
-        return []
+            return set()
 
+        candidate_commits = lookup_lines(build_content_index(blamed), lines_to_blame)
 
-def find_commit_in_all_branches(repo, commit_hash):
-    try:
-        # First, try to find the commit directly
-        commit = repo.commit(commit_hash)
-        return commit
-    except GitCommandError:
-        # If not found, search in all branches
-        for branch in repo.branches:
+        # Validate all candidates in bulk
+        resolved = git_batch.resolve_commits(candidate_commits)
+        return {sha for sha in resolved.values() if sha}
+    except Exception as e:
+        logging.error(f"Unexpected error in blame_candidates for {file_path}: {str(e)}")
+        return set()
+
+
+def blame_files_concurrently(repo, blame_jobs, security_patch_commit):
+    """Blame the files of one security patch in a bounded thread pool.
+    The work is bound by git subprocesses, so threads run it in parallel.
+    Args:
+        blame_jobs (list): (file_path, lines_to_blame, line_ranges) tuples
+    Returns:
+        set: Union of the candidate commits of every file
+    """
+    candidate_commits = set()
+    if not blame_jobs:
+        return candidate_commits
+
+    with ThreadPoolExecutor(
+        max_workers=min(BLAME_WORKERS, len(blame_jobs))
+    ) as executor:
+        futures = [
+            executor.submit(
+                blame_candidates,
+                repo,
+                file_path,
+                lines_to_blame,
+                security_patch_commit,
+                line_ranges,
+            )
+            for file_path, lines_to_blame, line_ranges in blame_jobs
+        ]
+        # Merge in patch order so results don't depend on thread timing
+        for (file_path, _, _), future in zip(blame_jobs, futures):
             try:
-                repo.git.checkout(branch.name)
-                commit = repo.commit(commit_hash)
-                return commit
-            except GitCommandError:
-                continue
-    return None
+                candidate_commits |= future.result()
+            except Exception as e:
+                logging.error(f"Error blaming {file_path}: {str(e)}")
+    return candidate_commits
+
+
+def save_vuln_commits(cve_output_dir, cve_id, repo_url, commit_ids):
+    """Record a CVE's vulnerability-introducing commits.
+    The patches themselves are kept once per commit in the patch store.
+    Returns:
+        str: Path of the file written
+        str: Hash of its contents
+    """
+    output_path = os.path.join(cve_output_dir, VULN_COMMITS_FILE)
+    output_hash = dump_json(
+        output_path,
+        {"cve_id": cve_id, "repo_url": repo_url, "commit_ids": commit_ids},
+    )
+    return output_path, output_hash
+
+
+def analyze_cve(cve_file):
+    """Find the vulnerability-introducing commits of one CVE.
+    Args:
+        cve_file (str): Key of the CVE's commit_metadata record, "<cve_id>.json"
+    Returns:
+        str: "processed", "no_patches", "already_processed", "skipped"
+        or "failed"
+    """
+    if not cve_file.endswith(".json"):
+        logging.warning(f"Skipping {cve_file} as it doesn't end with .json")
+        return "skipped"
+
+    cve_id = cve_file[:-5]  # Remove .json extension
+
+    # Check if this CVE has already been processed; CVEs finished before
+    # the manifest existed still have a flag file
+    manifest = get_manifest()
+    if manifest.is_done(MANIFEST_STAGE, cve_id):
+        logging.info(f"CVE {cve_id} has already been processed. Skipping.")
+        return "already_processed"
+    legacy_flag_file = os.path.join(
+        VULNERABILITY_INTRO_METADATA_DIR, f"{cve_id}_processed"
+    )
+    # A CVE with a row, e.g. one marked stale, is never taken as legacy
+    if cve_id not in manifest.get_items(MANIFEST_STAGE) and os.path.exists(
+        legacy_flag_file
+    ):
+        manifest.record(MANIFEST_STAGE, cve_id)
+        logging.info(f"CVE {cve_id} has already been processed. Skipping.")
+        return "already_processed"
+
+    # Create CVE-specific directory in VULNERABILITY_INTRO_METADATA_DIR
+    os.makedirs(os.path.join(VULNERABILITY_INTRO_METADATA_DIR, cve_id), exist_ok=True)
+
+    cve_output_dir = os.path.join(VULNERABILITY_PATCHES_DIR, cve_id)
+    os.makedirs(cve_output_dir, exist_ok=True)
 
-
-def get_patch_content(commit_url):
     try:
-        patch_url = commit_url.split("#")[0] + ".patch"
-        response = requests.get(patch_url)
-        response.raise_for_status()
-        return response.text
-    except Exception as e:
-        logging.error(f"Error fetching patch from {patch_url}: {str(e)}")
-        return None
+        security_patch_data = read_existing_metadata(cve_id)
+    except json.JSONDecodeError:
+        logging.error(f"Failed to parse JSON for {cve_id}. Skipping.")
+        return "failed"
+    if security_patch_data is None:
+        logging.error(f"No commit metadata found for {cve_id}. Skipping.")
+        return "failed"
+
+    commit_id = security_patch_data.get("commit_id")
+    if not commit_id:
+        logging.warning(f"No commit_id found for {cve_id}. Skipping.")
+        return "failed"
+
+    repo_url = get_repo_url(commit_id)
+    if not repo_url:
+        logging.warning(
+            f"No repo_url found for {cve_id}, commit {commit_id}. Skipping."
+        )
+        return "failed"
+
+    # CVEs of the same repo share one Repo, so its git helper processes
+    # aren't started again per CVE
+    repo = get_pooled_repo(repo_url)
+    if repo is None:
+        logging.error(f"Failed to get or create repo for {repo_url}. Skipping.")
+        return "failed"
+
+    # Blame and diffs only read the object database, so a bare cache
+    # needs no reset; get_pooled_repo already fetched if stale
+    if repo.bare:
+        return analyze_cve_in_repo(cve_id, commit_id, repo, repo_url)
+
+    # Queue workers aren't repo-affine, so hold the repo's lock while its
+    # working tree is reset and used
+    with repo_lock(repo_url):
+        try:
+            repo.git.reset("--hard")
+            repo.git.clean("-xdf")
+            logging.info(f"Repository reset for {cve_id}")
+        except GitCommandError as e:
+            logging.error(f"Git error in repo reset for {repo_url}: {str(e)}")
+            return "failed"
+        return analyze_cve_in_repo(cve_id, commit_id, repo, repo_url)
+
+
+def analyze_cve_in_repo(cve_id, commit_id, repo, repo_url):
+    """Blame a CVE's security patch and save its vulnerability-introducing
+    commits; the part of analyze_cve that uses the repository.
+    """
+    manifest = get_manifest()
+    cve_output_dir = os.path.join(VULNERABILITY_PATCHES_DIR, cve_id)
+
+    # Get the security patch from the patch store
+    patch_content = get_patch(repo_url, commit_id, repo)
+    if not patch_content:
+        logging.warning(
+            f"Failed to fetch patch for {cve_id}, commit {commit_id}. Skipping."
+        )
+        return "failed"
+
+    # Extract file paths and lines to blame from the patch
+    blame_jobs = []
+    for file_patch in parse_patch(patch_content):
+        patched_file = file_patch["file"]
+        # Blame runs on the parent commit, so use the pre-patch path
+        file_path = patched_file.old_path
+        if file_path is None or patched_file.is_binary:
+            continue
+        lines_to_blame = get_lines_to_blame(file_patch["hunks"])
+
+        if not lines_to_blame:
+            logging.info(
+                f"No lines to blame found for {file_path} in {cve_id}. Skipping this file."
+            )
+            continue
+
+        blame_jobs.append(
+            (file_path, lines_to_blame, get_hunk_ranges(file_patch["hunks"]))
+        )
+
+    candidate_commits = blame_files_concurrently(repo, blame_jobs, commit_id)
 
+    # Resolve the ancestry of every file's candidates in one walk
+    vuln_commits = get_ancestors(repo, commit_id, candidate_commits)
+    vuln_commits.discard(commit_id)
 
-def fetch_and_save_patch(commit_id, repo_url):
-    commit_url = f"{repo_url}/commit/{commit_id}"
-    patch_content = get_patch_content(commit_url)
-    if patch_content:
-        patch_file = os.path.join(PATCH_CACHE_DIR, f"{commit_id}.patch")
-        with open(patch_file, "w") as f:
-            f.write(patch_content)
-        logging.info(f"Fetched and saved patch for commit {commit_id}")
-        return patch_file
-    return None
+    # Patches shared with other CVEs are served by the patch store;
+    # the rest are generated locally in one batch or downloaded
+    patch_contents = get_patches(repo_url, sorted(vuln_commits), repo)
 
+    saved_commits = []
+    for vuln_commit in sorted(vuln_commits):
+        if patch_contents.get(vuln_commit):
+            logging.info(f"Stored patch for CVE {cve_id}, commit {vuln_commit}")
+            saved_commits.append(vuln_commit)
+        else:
+            logging.warning(
+                f"Failed to get patch content for {cve_id}, commit {vuln_commit}"
+            )
 
-def analyze_vulnerabilities():
+    if not saved_commits:
+        logging.warning(f"No patches were generated for CVE {cve_id}")
+        return "no_patches"
+    output_path, output_hash = save_vuln_commits(
+        cve_output_dir, cve_id, repo_url, saved_commits
+    )
+    manifest.record(
+        MANIFEST_STAGE,
+        cve_id,
+        input_hash=commit_id,
+        output=output_path,
+        output_hash=output_hash,
+    )
+    return "processed"
+
+
+def get_cve_repo_url(cve_file):
+    """Get the repository of a CVE's security patch, or None if unknown."""
+    try:
+        metadata = read_existing_metadata(cve_file[:-5])
+    except (OSError, json.JSONDecodeError):
+        return None
+    commit_id = metadata.get("commit_id") if metadata else None
+    return get_repo_url(commit_id) if commit_id else None
+
+
+def group_cves_by_repo(cve_files):
+    """Group CVE files by repository cache directory, largest group first.
+    The cache is keyed by the last URL segment only, so different URLs
+    (forks, http and https) can share a working tree; grouping by the
+    cache path keeps each tree in one worker. CVEs whose repository can't
+    be determined form their own groups so analyze_cve can log why they
+    are skipped.
+    """
+    groups = defaultdict(list)
+    for cve_file in cve_files:
+        repo_url = get_cve_repo_url(cve_file) if cve_file.endswith(".json") else None
+        groups[get_repo_path(repo_url) if repo_url else cve_file].append(cve_file)
+    return sorted(groups.values(), key=len, reverse=True)
+
+
+def analyze_repo_cves(cve_files, progress=None):
+    """Process-pool worker: analyze the CVEs of one repository in order.
+    Args:
+        cve_files (list): CVE files that share a repository
+        progress (queue): Receives (cve_file, status) after every CVE
+    Returns:
+        dict: Blame cache hits and misses while analyzing these CVEs
+    """
+    # A worker process runs many groups, so report only this group's share
+    cache = get_blame_cache()
+    hits, misses = cache.hits, cache.misses
+    for cve_file in cve_files:
+        try:
+            status = analyze_cve(cve_file)
+        except Exception as e:
+            logging.error(f"Error analyzing {cve_file}: {str(e)}")
+            status = "failed"
+        if progress is not None:
+            progress.put((cve_file, status))
+    cache.flush()
+    return {"hits": cache.hits - hits, "misses": cache.misses - misses}
+
+
+def analyze_vulnerabilities(num_workers=1):
+    """Analyze every CVE in CVES_TO_PROCESS_FILE.
+    Args:
+        num_workers (int): Worker processes; each owns whole repositories,
+            so no two workers ever touch the same repo. 1 runs in-process.
+    """
     ensure_dirs()
 
     # Read CVEs to process once at the beginning
     cves_to_process = read_cves_to_process()
     logging.info(f"Found {len(cves_to_process)} CVEs to process")
 
-    for cve_file in tqdm(cves_to_process, desc="Analyzing vulnerabilities"):
-        if not cve_file.endswith(".json"):
-            logging.warning(f"Skipping {cve_file} as it doesn't end with .json")
-            continue
-
-        cve_id = cve_file[:-5]  # Remove .json extension
-
-        # Create CVE-specific directory in VULNERABILITY_INTRO_METADATA_DIR
-        cve_output_dir = os.path.join(VULNERABILITY_INTRO_METADATA_DIR, cve_id)
-        os.makedirs(cve_output_dir, exist_ok=True)
-
-        # Check if this CVE has already been processed
-        processed_flag_file = os.path.join(
-            VULNERABILITY_INTRO_METADATA_DIR, f"{cve_id}_processed"
+    if num_workers <= 1:
+        statuses = Counter(
+            analyze_cve(cve_file)
+            for cve_file in tqdm(cves_to_process, desc="Analyzing vulnerabilities")
         )
-        if os.path.exists(processed_flag_file):
-            logging.info(f"CVE {cve_id} has already been processed. Skipping.")
-            continue
-
-        cve_output_dir = os.path.join(VULNERABILITY_PATCHES_DIR, cve_id)
-        os.makedirs(cve_output_dir, exist_ok=True)
-
-        input_path = os.path.join(COMMIT_METADATA_DIR, cve_file)
-
-        if not os.path.exists(input_path):
-            logging.error(f"File not found: {input_path}. Skipping.")
-            continue
-
-        try:
-            with open(input_path, "r") as f:
-                security_patch_data = json.load(f)
-        except json.JSONDecodeError:
-            logging.error(f"Failed to parse JSON for {cve_id}. Skipping.")
-            continue
-
-        commit_id = security_patch_data.get("commit_id")
-        if not commit_id:
-            logging.warning(f"No commit_id found for {cve_id}. Skipping.")
-            continue
+        logging.info(f"CVE results: {dict(statuses)}")
+        logging.info(f"Blame cache statistics: {get_blame_cache().get_stats()}")
+        return
+
+    repo_groups = group_cves_by_repo(cves_to_process)
+    logging.info(
+        f"Analyzing {len(repo_groups)} repositories with {num_workers} workers"
+    )
+    # Spawned workers open their own SQLite connections and git processes
+    # instead of inheriting the parent's
+    context = multiprocessing.get_context("spawn")
+    statuses = Counter()
+    cache_stats = Counter()
+    with context.Manager() as manager:
+        progress = manager.Queue()
+        with ProcessPoolExecutor(
+            max_workers=num_workers, mp_context=context, initializer=loggingConfig
+        ) as executor:
+            futures = [
+                executor.submit(analyze_repo_cves, cve_files, progress)
+                for cve_files in repo_groups
+            ]
+            with tqdm(
+                total=len(cves_to_process), desc="Analyzing vulnerabilities"
+            ) as pbar:
+                while pbar.n < len(cves_to_process):
+                    try:
+                        _, status = progress.get(timeout=1)
+                    except queue.Empty:
+                        if all(future.done() for future in futures):
+                            break
+                        continue
+                    statuses[status] += 1
+                    pbar.update(1)
+
+            for future in futures:
+                try:
+                    stats = future.result()
+                except Exception as e:
+                    logging.error(f"Worker failed: {str(e)}")
+                    continue
+                cache_stats.update(stats)
 
-        repo_url = get_repo_url(commit_id)
-        if not repo_url:
-            logging.warning(
-                f"No repo_url found for {cve_id}, commit {commit_id}. Skipping."
-            )
-            continue
+    logging.info(f"CVE results: {dict(statuses)}")
+    logging.info(f"Blame cache statistics across workers: {dict(cache_stats)}")
 
-        repo = get_or_create_repo(repo_url)
-        if repo is None:
-            logging.error(f"Failed to get or create repo for {repo_url}. Skipping.")
-            continue
 
-        # Reset and update the repo before processing each CVE
-        try:
-            repo.git.reset("--hard")
-            repo.git.clean("-xdf")
-            repo.git.fetch("--all")
-            repo.remotes.origin.pull()
-            logging.info(f"Repository reset and updated for {cve_id}")
-        except GitCommandError as e:
-            logging.error(f"Git error in repo reset for {repo_url}: {str(e)}")
-            continue
+def enqueue_cves(cves_file):
+    """Add the CVEs listed in a file to the shared work queue."""
+    cve_files = read_cves_to_process(cves_file)
+    added = WorkQueue().enqueue("cve", cve_files)
+    logging.info(f"Queued {added} of {len(cve_files)} CVEs from {cves_file}")
+    return added
 
-        # Get the patch file from patch_cache or fetch it if missing
-        patch_file = os.path.join(PATCH_CACHE_DIR, f"{commit_id}.patch")
-        if not os.path.exists(patch_file):
-            logging.info(
-                f"Patch file not found for {cve_id}, commit {commit_id}. Attempting to fetch."
-            )
-            patch_file = fetch_and_save_patch(commit_id, repo_url)
-            if not patch_file:
-                logging.warning(
-                    f"Failed to fetch patch for {cve_id}, commit {commit_id}. Skipping."
-                )
-                continue
-
-        with open(patch_file, "r") as f:
-            patch_content = f.read()
-
-        # Extract file paths and lines to blame from the patch
-        file_patches = re.split(r"diff --git ", patch_content)[
-            1:
-        ]  # Split patch into per-file sections
-        cve_has_patches = False
-        for file_patch in file_patches:
-            match = re.search(r"a/(.*) b/(.*)", file_patch)
-            if not match:
-                logging.warning(
-                    f"Could not extract file path from patch for {cve_id}. Skipping this file."
-                )
-                continue
-            file_path = match.group(2)
-            lines_to_blame = get_lines_to_blame(file_patch)
-
-            if not lines_to_blame:
-                logging.info(
-                    f"No lines to blame found for {file_path} in {cve_id}. Skipping this file."
-                )
-                continue
-
-            vuln_commits = blame_lines(repo, file_path, lines_to_blame, commit_id)
-
-            for vuln_commit in vuln_commits:
-                commit_url = f"{repo_url}/commit/{vuln_commit}"
-                output_file = os.path.join(cve_output_dir, f"{vuln_commit}.patch")
-
-                if os.path.exists(output_file):
-                    logging.info(
-                        f"Patch for CVE {cve_id}, commit {vuln_commit} already exists. Skipping."
-                    )
-                    cve_has_patches = True
-                    continue
 
-                vuln_patch_content = get_patch_content(commit_url)
+def analyze_cve_job(job):
+    status = analyze_cve(job.item)
+    if status == "failed":
+        raise RuntimeError(f"Analysis of {job.item} failed")
 
-                if vuln_patch_content:
-                    with open(output_file, "w") as f:
-                        f.write(vuln_patch_content)
-                    logging.info(f"Saved patch for CVE {cve_id}, commit {vuln_commit}")
-                    cve_has_patches = True
-                else:
-                    logging.warning(
-                        f"Failed to get patch content for {cve_id}, commit {vuln_commit}"
-                    )
 
-        if not cve_has_patches:
-            logging.warning(f"No patches were generated for CVE {cve_id}")
-        if cve_has_patches:
-            # Create a flag file to indicate that this CVE has been processed
-            with open(processed_flag_file, "w") as f:
-                f.write("")
+def run_cve_worker():
+    """Analyze CVEs from the shared work queue until none are left.
+    Start as many of these as wanted, on any node that shares the queue
+    database and caches.
+    """
+    ensure_dirs()
+    run_worker("cve", analyze_cve_job)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Find vulnerability-introducing commits"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes, each owning whole repositories (default: 1)",
+    )
+    parser.add_argument(
+        "--enqueue",
+        metavar="CVES_FILE",
+        help="Add the CVEs listed in CVES_FILE to the work queue and exit",
+    )
+    parser.add_argument(
+        "--queue-worker",
+        action="store_true",
+        help="Pull CVEs from the work queue instead of CVEs_to_process.txt",
+    )
+    args = parser.parse_args()
     loggingConfig()
-    analyze_vulnerabilities()
+    if args.enqueue:
+        enqueue_cves(args.enqueue)
+    elif args.queue_worker:
+        run_cve_worker()
+    else:
+        analyze_vulnerabilities(args.workers)
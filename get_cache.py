@@ -1,25 +1,87 @@
 import os
+import time
+import fcntl
 import logging
-import requests
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from git import Repo, GitCommandError
 import shutil
 
-from constants import REPO_CACHE_DIR, PATCH_CACHE_DIR
+from constants import (
+    REPO_CACHE_DIR,
+    REPO_FETCH_TTL_SECONDS,
+    REPO_FETCH_WORKERS,
+    REPO_CACHE_BARE,
+)
 from constants import loggingConfig
+from patch_store import get_patch, parse_commit_url
+from patch_parser import parse_patch
+from git_batch import LRUPool, close_repo
+from commit_metadata import get_metadata
 
 
-def get_cached_patch_path(commit_url):
-    """Generate a unique filename for caching the patch."""
-    filename = commit_url.split("/")[-1].replace("/", "_") + ".patch"
-    return os.path.join(PATCH_CACHE_DIR, filename)
+def get_repo_path(repo_url, bare=REPO_CACHE_BARE):
+    """Get the path of a repository inside the repo cache."""
+    repo_name = repo_url.split("/")[-1]
+    if bare:
+        repo_name += ".git"
+    return os.path.join(REPO_CACHE_DIR, repo_name)
+
+
+def get_git_dir(repo_path, bare=REPO_CACHE_BARE):
+    return repo_path if bare else os.path.join(repo_path, ".git")
+
+
+@contextmanager
+def repo_lock(repo_url):
+    """Hold an exclusive file lock on a cached repository.
+    Safe across both threads and processes sharing REPO_CACHE_DIR.
+    """
+    os.makedirs(REPO_CACHE_DIR, exist_ok=True)
+    lock_path = get_repo_path(repo_url) + ".lock"
+    with open(lock_path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_last_fetch_time(repo_url):
+    """Get the time of the last successful clone or fetch, or None."""
+    try:
+        with open(get_repo_path(repo_url) + ".last_fetch", "r") as f:
+            return float(f.read().strip())
+    except (OSError, ValueError):
+        return None
 
 
-def get_or_create_repo(repo_url):
-    """Get or create a repository object with full history."""
+def record_fetch_time(repo_url):
+    with open(get_repo_path(repo_url) + ".last_fetch", "w") as f:
+        f.write(str(time.time()))
+
+
+def is_fetch_fresh(repo_url, max_age=REPO_FETCH_TTL_SECONDS):
+    last_fetch = get_last_fetch_time(repo_url)
+    return last_fetch is not None and time.time() - last_fetch < max_age
+
+
+def get_or_create_repo(repo_url, max_age=REPO_FETCH_TTL_SECONDS):
+    """Get or create a repository object with full history.
+    Args:
+        repo_url (str): URL of the repository
+        max_age (float): Skip fetching if the last fetch is younger than this
+    Returns:
+        git.Repo: Repository object, or None on failure
+    """
     loggingConfig()
-    repo_name = repo_url.split("/")[-1]
-    repo_path = os.path.join(REPO_CACHE_DIR, repo_name)
-    git_dir = os.path.join(repo_path, ".git")
+    with repo_lock(repo_url):
+        return _get_or_create_repo_locked(repo_url, max_age)
+
+
+def _get_or_create_repo_locked(repo_url, max_age):
+    repo_path = get_repo_path(repo_url)
+    git_dir = get_git_dir(repo_path)
 
     # Check if the .git directory exists and is not empty
     if os.path.exists(git_dir) and not os.listdir(git_dir):
@@ -29,10 +91,16 @@ def get_or_create_repo(repo_url):
     if not os.path.exists(git_dir):
         logging.info(f"Cloning repository: {repo_url}")
         try:
-            # Clone with full history and all branches
-            repo = Repo.clone_from(
-                repo_url, repo_path, multi_options=["--no-single-branch"]
-            )
+            if REPO_CACHE_BARE:
+                # Bare clone whose branches track the remote's on every fetch
+                repo = Repo.clone_from(repo_url, repo_path, bare=True)
+                repo.git.config("remote.origin.fetch", "+refs/heads/*:refs/heads/*")
+            else:
+                # Clone with full history and all branches
+                repo = Repo.clone_from(
+                    repo_url, repo_path, multi_options=["--no-single-branch"]
+                )
+            record_fetch_time(repo_url)
             logging.info(f"Successfully cloned repository: {repo_url}")
             return repo
         except GitCommandError as e:
@@ -46,11 +114,19 @@ def get_or_create_repo(repo_url):
     else:
         try:
             repo = Repo(repo_path)
+            if is_fetch_fresh(repo_url, max_age):
+                logging.info(f"Repository {repo_url} was fetched recently. Skipping.")
+                return repo
+
             logging.info(f"Fetching updates for repository: {repo_url}")
 
             # Fetch all branches and tags
-            repo.git.fetch("--all")
-            repo.git.fetch("--tags")
+            repo.git.fetch("--all", "--tags")
+
+            if REPO_CACHE_BARE:
+                record_fetch_time(repo_url)
+                logging.info(f"Successfully updated repository: {repo_url}")
+                return repo
 
             # Determine the default branch
             default_branch = repo.git.symbolic_ref(
@@ -61,6 +137,7 @@ def get_or_create_repo(repo_url):
             # Reset to the default branch
             repo.git.reset("--hard", f"origin/{default_branch}")
 
+            record_fetch_time(repo_url)
             logging.info(f"Successfully updated repository: {repo_url}")
             return repo
         except GitCommandError as e:
@@ -75,57 +152,83 @@ def get_or_create_repo(repo_url):
             return None
 
 
-def get_patch_info(commit_url):
+_repos = LRUPool(get_or_create_repo, close_repo)
+
+
+def get_pooled_repo(repo_url):
+    """Get a repository object shared by every caller in this process.
+    Opened (cloned or fetched if stale) on first use; the least recently
+    used repositories are closed once more than MAX_OPEN_REPOS are open.
+    Args:
+        repo_url (str): URL of the repository
+    Returns:
+        git.Repo: Repository object, or None on failure
+    """
+    return _repos.get(repo_url)
+
+
+def prefetch_repos(
+    repo_urls, max_workers=REPO_FETCH_WORKERS, max_age=REPO_FETCH_TTL_SECONDS
+):
+    """Clone or fetch many repositories concurrently.
+    Args:
+        repo_urls (iterable): URLs of the repositories
+        max_workers (int): Maximum number of concurrent git operations
+        max_age (float): Skip fetching repos fetched more recently than this
+    Returns:
+        dict: repo_url -> True if the repository is available in the cache
+    """
+    loggingConfig()
+    repo_urls = [url for url in dict.fromkeys(repo_urls) if url]
+    stale_urls = [url for url in repo_urls if not is_fetch_fresh(url, max_age)]
+    logging.info(
+        f"Prefetching {len(stale_urls)} of {len(repo_urls)} repositories "
+        f"with {max_workers} workers"
+    )
+
+    results = {url: True for url in repo_urls}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(get_or_create_repo, url, max_age): url for url in stale_urls
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result() is not None
+    return results
+
+
+def get_patch_info(commit_url, repo=None):
     """Get the changes made in a commit
     Args:
     commit_url (str): URL to the commit
+    repo (git.Repo): Cached repository to generate the patch from, if any
     Returns:
     dict: A dictionary containing the changes made in the commit
     """
     loggingConfig()
     try:
-        clean_url = commit_url.split("#")[0]
-        patch_url = clean_url + ".patch"
-        cached_patch_path = get_cached_patch_path(clean_url)
-
-        if os.path.exists(cached_patch_path):
-            logging.info(f"Using cached patch for: {clean_url}")
-            with open(cached_patch_path, "r") as patch_file:
-                patch_content = patch_file.read()
-        else:
-            logging.info(f"Fetching patch from: {patch_url}")
-            response = requests.get(patch_url)
-            response.raise_for_status()
-            patch_content = response.text
-            with open(cached_patch_path, "w") as patch_file:
-                patch_file.write(patch_content)
-            logging.info(f"Saved patch to: {cached_patch_path}")
+        repo_url, commit_id = parse_commit_url(commit_url)
+        patch_content = get_patch(repo_url, commit_id, repo)
+        if patch_content is None:
+            logging.warning(f"No patch available for: {commit_url}")
+            return None
 
         file_changes = {}
 
-        for section in patch_content.split("diff --git")[1:]:
-            lines = section.split("\n")
-            filename = lines[0].split()[-1].lstrip("b/")
-            changes = []
-            malicious_lines = []
-            context_lines = []
+        for file_patch in parse_patch(patch_content):
+            filename = file_patch["file"].path
+            # Hunk lines with their +/-/space prefix, hunks separated by "@@"
+            lines = []
+            for _, hunk_lines in file_patch["hunks"]:
+                lines.append("@@")
+                lines.extend(line.kind + line.text for line in hunk_lines)
+
+            changes = [line for line in lines if line.startswith(("-", "+"))]
+            malicious_lines = [line for line in lines if line.startswith("-")]
             used_context_lines = False
-            in_hunk = False
             added_line_index = -1
-
             for i, line in enumerate(lines):
-                if line.startswith("@@"):
-                    in_hunk = True
-                    context_lines = []
-                elif in_hunk:
-                    if line.startswith("-"):
-                        malicious_lines.append(line)
-                        changes.append(line)
-                    elif line.startswith("+"):
-                        changes.append(line)
-                        added_line_index = i
-                    else:
-                        context_lines.append(line)
+                if line.startswith("+"):
+                    added_line_index = i
 
             if not malicious_lines and added_line_index != -1:
                 used_context_lines = True
@@ -134,7 +237,7 @@ def get_patch_info(commit_url):
                 malicious_lines = [
                     line
                     for line in lines[start:end]
-                    if not line.startswith(("+", "@@", "diff", "index"))
+                    if not line.startswith(("+", "@@"))
                 ]
 
             file_changes[filename] = {
@@ -163,17 +266,7 @@ def get_commit_metadata(repo, commit_hash):
     loggingConfig()
     try:
         clean_commit_hash = commit_hash.lstrip("^")
-        commit = repo.commit(clean_commit_hash)
-        return {
-            "hash": commit.hexsha,
-            "author": commit.author.name,
-            "author_email": commit.author.email,
-            "committed_date": commit.committed_datetime.isoformat(),
-            "message": commit.message.strip(),
-            "files_changed": list(commit.stats.files.keys()),
-            "insertions": commit.stats.total["insertions"],
-            "deletions": commit.stats.total["deletions"],
-        }
+        return get_metadata(repo, [clean_commit_hash]).get(clean_commit_hash)
     except Exception as e:
         logging.error(f"Error retrieving metadata for commit {commit_hash}: {str(e)}")
         return None
@@ -0,0 +1,205 @@
+import logging
+import threading
+import subprocess
+from collections import OrderedDict
+
+from constants import MAX_OPEN_REPOS
+
+# Revisions are sent to `git cat-file --batch-check` in chunks so neither
+# side of the pipe can fill up while the other is blocked writing
+BATCH_CHUNK_SIZE = 500
+
+
+class GitBatch:
+    """Long-lived git helper processes for a single repository.
+    Existence queries go through one persistent `git cat-file --batch-check`
+    process and ancestry queries are answered with a single `git rev-list`
+    walk, instead of forking one git process per commit.
+    """
+
+    def __init__(self, git_dir: str):
+        self.git_dir = git_dir
+        self._cat_file = None
+        self._lock = threading.Lock()
+
+    def _git(self, *args):
+        return ["git", f"--git-dir={self.git_dir}", *args]
+
+    def _get_cat_file(self):
+        if self._cat_file is None or self._cat_file.poll() is not None:
+            self._cat_file = subprocess.Popen(
+                self._git("cat-file", "--batch-check"),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+        return self._cat_file
+
+    def resolve_commits(self, revs):
+        """Resolve revisions to full commit SHAs.
+        Args:
+            revs (iterable): Revisions (SHAs, abbreviated SHAs or refs)
+        Returns:
+            dict: rev -> full commit SHA, or None if it isn't a commit
+        """
+        revs = list(dict.fromkeys(revs))
+        resolved = {}
+        with self._lock:
+            for start in range(0, len(revs), BATCH_CHUNK_SIZE):
+                chunk = revs[start : start + BATCH_CHUNK_SIZE]
+                resolved.update(self._resolve_chunk(chunk))
+        return resolved
+
+    def _resolve_chunk(self, revs):
+        resolved = {}
+        query = []
+        for rev in revs:
+            if not rev or any(c.isspace() for c in rev):
+                resolved[rev] = None
+            else:
+                query.append(rev)
+        if not query:
+            return resolved
+
+        process = self._get_cat_file()
+        try:
+            process.stdin.write(
+                "".join(f"{rev}^{{commit}}\n" for rev in query).encode()
+            )
+            process.stdin.flush()
+            for rev in query:
+                fields = process.stdout.readline().decode().split()
+                if len(fields) == 3 and fields[1] == "commit":
+                    resolved[rev] = fields[0]
+                else:
+                    resolved[rev] = None
+        except (BrokenPipeError, OSError) as e:
+            logging.error(f"git cat-file failed in {self.git_dir}: {str(e)}")
+            self._close_cat_file()
+            for rev in query:
+                resolved.setdefault(rev, None)
+        return resolved
+
+    def is_valid_commit(self, rev):
+        return self.resolve_commits([rev]).get(rev) is not None
+
+    def filter_ancestors(self, tip, candidates):
+        """Find which candidate commits are ancestors of (or equal to) tip.
+        Walks `git rev-list tip` once and stops as soon as every candidate
+        has been seen.
+        Args:
+            tip (str): Commit whose history is searched
+            candidates (iterable): Full commit SHAs
+        Returns:
+            set: The candidates reachable from tip
+        Raises:
+            subprocess.CalledProcessError: If the walk failed, e.g. because
+            tip isn't in the repository; found is then incomplete
+        """
+        remaining = set(candidates)
+        found = set()
+        if not remaining:
+            return found
+
+        process = subprocess.Popen(
+            self._git("rev-list", tip),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        completed = False
+        try:
+            for line in process.stdout:
+                sha = line.strip().decode()
+                if sha in remaining:
+                    remaining.discard(sha)
+                    found.add(sha)
+                    if not remaining:
+                        break
+            else:
+                completed = True
+        finally:
+            if completed:
+                stderr = process.stderr.read()
+            else:
+                # Every candidate was found; the rest of the walk is unneeded
+                process.kill()
+            process.stdout.close()
+            process.stderr.close()
+            returncode = process.wait()
+        if completed and returncode != 0:
+            raise subprocess.CalledProcessError(
+                returncode, process.args, stderr=stderr.decode(errors="replace")
+            )
+        return found
+
+    def _close_cat_file(self):
+        if self._cat_file is not None:
+            try:
+                self._cat_file.stdin.close()
+            except OSError:
+                pass
+            self._cat_file.kill()
+            self._cat_file.wait()
+            self._cat_file = None
+
+    def close(self):
+        with self._lock:
+            self._close_cat_file()
+
+
+class LRUPool:
+    """Bounded pool of open resources, closing the least recently used one.
+    Used to keep file descriptors and helper processes flat no matter how
+    many repositories a run touches.
+    """
+
+    def __init__(self, open_func, close_func, max_size: int = MAX_OPEN_REPOS):
+        self.open_func = open_func
+        self.close_func = close_func
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+
+        value = self.open_func(key)
+        if value is None:
+            return None
+
+        with self._lock:
+            if key in self._items:
+                # Another thread opened it meanwhile; keep a single instance
+                self.close_func(value)
+                self._items.move_to_end(key)
+                return self._items[key]
+            self._items[key] = value
+            while len(self._items) > self.max_size:
+                _, evicted = self._items.popitem(last=False)
+                self.close_func(evicted)
+        return value
+
+    def close_all(self):
+        with self._lock:
+            while self._items:
+                _, value = self._items.popitem()
+                self.close_func(value)
+
+
+def close_repo(repo):
+    """Release the helper processes a GitPython Repo keeps open."""
+    try:
+        repo.close()
+    except Exception as e:
+        logging.warning(f"Error closing repository {repo.git_dir}: {str(e)}")
+
+
+_git_batches = LRUPool(GitBatch, GitBatch.close)
+
+
+def get_git_batch(repo):
+    """Get the shared GitBatch for a GitPython Repo."""
+    return _git_batches.get(repo.git_dir)
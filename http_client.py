@@ -0,0 +1,161 @@
+import time
+import logging
+import threading
+import requests
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+from constants import (
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_RETRIES,
+    HTTP_TIMEOUT_SECONDS,
+    HTTP_BACKOFF_SECONDS,
+    HTTP_MAX_BACKOFF_SECONDS,
+)
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class HttpClient:
+    """Pooled HTTP client with retries and rate-limit handling.
+    One keep-alive session is shared by every thread; at most
+    max_connections requests are in flight at once. Failed requests are
+    retried with exponential backoff, honoring Retry-After and GitHub's
+    X-RateLimit-Reset headers.
+    """
+
+    def __init__(
+        self,
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_retries=HTTP_MAX_RETRIES,
+        timeout=HTTP_TIMEOUT_SECONDS,
+        backoff=HTTP_BACKOFF_SECONDS,
+        max_backoff=HTTP_MAX_BACKOFF_SECONDS,
+        session=None,
+    ):
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max_connections, pool_maxsize=max_connections
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._semaphore = threading.BoundedSemaphore(max_connections)
+
+    def _retry_delay(self, response, attempt):
+        """Get how long to wait before retrying a failed response."""
+        delay = self.backoff * (2**attempt)
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    delay = float(retry_after)
+                except ValueError:
+                    try:
+                        retry_at = parsedate_to_datetime(retry_after).timestamp()
+                        delay = retry_at - time.time()
+                    except (TypeError, ValueError):
+                        pass
+            elif response.headers.get("X-RateLimit-Remaining") == "0":
+                reset = response.headers.get("X-RateLimit-Reset")
+                if reset and reset.isdigit():
+                    delay = int(reset) - time.time()
+        return min(max(delay, 0), self.max_backoff)
+
+    @staticmethod
+    def _should_retry(response):
+        if response.status_code in RETRY_STATUS_CODES:
+            return True
+        # GitHub reports an exhausted rate limit as 403
+        return (
+            response.status_code == 403
+            and response.headers.get("X-RateLimit-Remaining") == "0"
+        )
+
+    def get(self, url, etag=None, last_modified=None):
+        """GET a URL, retrying transient failures.
+        Args:
+            url (str): URL to fetch
+            etag (str): ETag of a cached copy, sent as If-None-Match
+            last_modified (str): Last-Modified of a cached copy
+        Returns:
+            requests.Response: The final response; 304 if the cached copy
+            is still valid
+        Raises:
+            requests.RequestException: If every attempt failed
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                with self._semaphore:
+                    response = self.session.get(
+                        url, headers=headers, timeout=self.timeout
+                    )
+                if not self._should_retry(response):
+                    response.raise_for_status()
+                    return response
+                error = requests.HTTPError(
+                    f"{response.status_code} for url: {url}", response=response
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+
+            if attempt == self.max_retries:
+                raise error
+            delay = self._retry_delay(response, attempt)
+            logging.warning(
+                f"Request to {url} failed ({error}). Retrying in {delay:.1f}s"
+            )
+            time.sleep(delay)
+
+    def get_text(self, url):
+        """GET a URL and return its body as text."""
+        return self.get(url).text
+
+    def fetch_many(self, urls, max_workers=None):
+        """Fetch many URLs concurrently.
+        Returns:
+            dict: url -> response text, or None if the fetch failed
+        """
+        urls = list(dict.fromkeys(urls))
+        results = {}
+        if not urls:
+            return results
+
+        def fetch(url):
+            try:
+                return self.get_text(url)
+            except requests.RequestException as e:
+                logging.error(f"Failed to fetch {url}: {str(e)}")
+                return None
+
+        with ThreadPoolExecutor(
+            max_workers=max_workers or self.max_connections
+        ) as executor:
+            for url, text in zip(urls, executor.map(fetch, urls)):
+                results[url] = text
+        return results
+
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """Get the process-wide HttpClient."""
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = HttpClient()
+        return _http_client
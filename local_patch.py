@@ -0,0 +1,108 @@
+import re
+import logging
+import subprocess
+
+from git_batch import get_git_batch
+from http_client import get_http_client
+
+# Header line that starts every commit in `git log --pretty=email` output
+EMAIL_HEADER_RE = re.compile(rb"^From ([0-9a-f]{40}) Mon Sep 17 00:00:00 2001$")
+
+
+def generate_patches(repo, commit_ids):
+    """Generate the patches of many commits from the local repository.
+    All patches come from a single `git log --stdin` invocation and match
+    the format of GitHub's `/commit/<sha>.patch` downloads.
+    Args:
+        repo (git.Repo): Repository object
+        commit_ids (iterable): Commit SHAs
+    Returns:
+        dict: commit_id -> patch text, for the commits found locally
+    """
+    resolved = get_git_batch(repo).resolve_commits(commit_ids)
+    full_shas = list(dict.fromkeys(sha for sha in resolved.values() if sha))
+    if not full_shas:
+        return {}
+
+    process = subprocess.Popen(
+        [
+            "git",
+            f"--git-dir={repo.git_dir}",
+            "log",
+            "--no-walk=unsorted",
+            "--stdin",
+            "--pretty=email",
+            "--patch-with-stat",
+            "--diff-merges=first-parent",
+            "--no-color",
+        ],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    output, error = process.communicate("\n".join(full_shas).encode() + b"\n")
+    if process.returncode != 0:
+        logging.error(
+            f"git log failed in {repo.git_dir}: {error.decode(errors='replace')}"
+        )
+        return {}
+
+    # Commits come out in input order, so a header only starts a new patch
+    # when it names the next expected SHA
+    patches = {}
+    expected = iter(full_shas)
+    next_sha = next(expected, None)
+    current_sha = None
+    current_lines = []
+    for line in output.splitlines(keepends=True):
+        match = EMAIL_HEADER_RE.match(line.rstrip(b"\n"))
+        if match and match.group(1).decode() == next_sha:
+            if current_sha:
+                # Drop the blank line git log puts between commits
+                if current_lines and current_lines[-1] == b"\n":
+                    current_lines.pop()
+                patches[current_sha] = b"".join(current_lines)
+            current_sha, current_lines = next_sha, []
+            next_sha = next(expected, None)
+        current_lines.append(line)
+    if current_sha:
+        patches[current_sha] = b"".join(current_lines)
+
+    return {
+        commit_id: patches[sha].decode("utf-8", errors="replace")
+        for commit_id, sha in resolved.items()
+        if sha in patches
+    }
+
+
+def get_patches(repo, repo_url, commit_ids):
+    """Get the patches of many commits, locally first and over HTTP second.
+    Args:
+        repo (git.Repo): Repository object, or None to only use HTTP
+        repo_url (str): URL of the repository, for the HTTP fallback
+        commit_ids (iterable): Commit SHAs
+    Returns:
+        dict: commit_id -> patch text, or None if it couldn't be fetched
+    """
+    commit_ids = list(dict.fromkeys(commit_ids))
+    patches = {}
+    if repo is not None:
+        try:
+            patches = generate_patches(repo, commit_ids)
+        except Exception as e:
+            logging.error(f"Error generating patches in {repo.git_dir}: {str(e)}")
+
+    missing = [commit_id for commit_id in commit_ids if commit_id not in patches]
+    if missing:
+        logging.info(f"Fetching {len(missing)} patches not found locally")
+        patch_urls = {
+            commit_id: f"{repo_url}/commit/{commit_id}.patch" for commit_id in missing
+        }
+        fetched = get_http_client().fetch_many(patch_urls.values())
+        for commit_id in missing:
+            patches[commit_id] = fetched.get(patch_urls[commit_id])
+    return patches
+
+
+def get_patch(repo, repo_url, commit_id):
+    return get_patches(repo, repo_url, [commit_id]).get(commit_id)
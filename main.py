@@ -1,11 +1,23 @@
-from process_commits import process_commits
-from constants import COMMIT_METADATA_DIR
+import argparse
+
+from constants import COMMIT_METADATA_DIR, loggingConfig
+from pipeline import BLAME_OUTPUT_FILE, get_stages, run_pipeline, select_stages
 
 if __name__ == "__main__":
-    input_file = "commits_with_parent_ids.csv"
-    blame_output_file = "commits_with_blame_data.csv"
-    process_commits(input_file, blame_output_file)
+    parser = argparse.ArgumentParser(description="Process the commits CSV")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes, each handling whole repositories (default: 1)",
+    )
+    args = parser.parse_args()
+
+    # The commit_metadata pipeline stage, run only if its code or input changed
+    loggingConfig()
+    results = run_pipeline(select_stages(get_stages(args.workers), ["commit_metadata"]))
+    print(f"commit_metadata: {results['commit_metadata']}")
     print(
-        f"Processing complete. Results saved to {blame_output_file} and {COMMIT_METADATA_DIR}"
+        f"Processing complete. Results saved to {BLAME_OUTPUT_FILE} and {COMMIT_METADATA_DIR}"
     )
     print(f"Log file: malicious_commit_analysis.log")
@@ -1,22 +1,19 @@
 import logging
 from constants import loggingConfig
-from find_vuln_intro_commits import analyze_vulnerabilities
-from process_vuln_patches import process_vuln_patches
-from check_duplicates import check_duplicates
+from pipeline import get_stages, run_pipeline, select_stages
 
 
 def main():
     loggingConfig()
     logging.info("Starting vulnerability analysis process...")
 
-    logging.info("Step 1: Finding vulnerability-introducing commits...")
-    analyze_vulnerabilities()
-
-    logging.info("Step 2: Processing vulnerability patches...")
-    process_vuln_patches()
-
-    logging.info("Step 3: Checking for duplicates...")
-    check_duplicates()
+    # Finding the vulnerability-introducing commits, processing their
+    # patches and checking for duplicates are pipeline stages; only the
+    # ones whose code or inputs changed run
+    stages = select_stages(get_stages(), ["check_duplicates"])
+    results = run_pipeline(stages)
+    for name, result in results.items():
+        logging.info(f"{name}: {result}")
 
     logging.info("Vulnerability analysis process completed.")
 
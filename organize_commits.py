@@ -1,41 +1,39 @@
-import csv
 import json
-import os
 from collections import defaultdict
 
+from constants import COMMITS_CSV_FILE, VULNERABILITY_INTRO_METADATA_DIR
+from commit_index import iter_rows
+from commit_dataset import VULN_INTRO_METADATA, get_dataset_keys
+
 
 def process_csv(csv_file):
     repos = defaultdict(set)
     cve_to_repo = {}
 
-    with open(csv_file, "r") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            repo_url = row["repo_url"]
-            commit_id = row["commit_id"]
-            cve_id = row["cve_id"]
-            repos[repo_url].add(commit_id)
-            cve_to_repo[cve_id] = repo_url
+    for row in iter_rows(csv_file):
+        repo_url = row["repo_url"]
+        commit_id = row["commit_id"]
+        cve_id = row["cve_id"]
+        repos[repo_url].add(commit_id)
+        cve_to_repo[cve_id] = repo_url
 
     return repos, cve_to_repo
 
 
 def process_vuln_intro_metadata(folder_path, repos, cve_to_repo):
-    for cve_folder in os.listdir(folder_path):
-        cve_path = os.path.join(folder_path, cve_folder)
-        if os.path.isdir(cve_path):
-            repo_url = cve_to_repo.get(cve_folder)
-            if repo_url:
-                for commit_file in os.listdir(cve_path):
-                    if commit_file.endswith(".json"):
-                        commit_id = commit_file[:-5]  # Remove .json extension
-                        repos[repo_url].add(commit_id)
+    for key in get_dataset_keys(VULN_INTRO_METADATA, folder_path):
+        # Keys are "<cve_id>/<commit_id>.json"
+        cve_id, commit_file = key.split("/")
+        repo_url = cve_to_repo.get(cve_id)
+        if repo_url:
+            commit_id = commit_file[:-5]  # Remove .json extension
+            repos[repo_url].add(commit_id)
 
 
 def main():
-    input_csv = "commits_with_parent_ids.csv"
+    input_csv = COMMITS_CSV_FILE
     output_json = "organized_commits.json"
-    vuln_intro_folder = "vulnerability_intro_metadata"
+    vuln_intro_folder = VULNERABILITY_INTRO_METADATA_DIR
 
     repos, cve_to_repo = process_csv(input_csv)
     process_vuln_intro_metadata(vuln_intro_folder, repos, cve_to_repo)
@@ -0,0 +1,374 @@
+import re
+from itertools import chain
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Union
+
+HUNK_HEADER_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@ ?(.*)$")
+# Characters of a patch string or text file split into lines at a time
+CHUNK_SIZE = 1 << 16
+
+C_ESCAPES = {
+    "a": "\a",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+    "v": "\v",
+    "\\": "\\",
+    '"': '"',
+}
+
+
+class FileRecord(NamedTuple):
+    old_path: Optional[str]  # None for added files
+    new_path: Optional[str]  # None for deleted files
+    status: str  # "modified", "added", "deleted", "renamed" or "copied"
+    is_binary: bool
+
+    @property
+    def path(self) -> str:
+        return self.new_path if self.new_path is not None else self.old_path
+
+
+class HunkRecord(NamedTuple):
+    old_start: int
+    old_count: int
+    new_start: int
+    new_count: int
+    section: str  # text after the closing @@, usually the enclosing function
+
+
+class LineRecord(NamedTuple):
+    kind: str  # "+", "-" or " "
+    text: str  # line content without the prefix
+    old_lineno: Optional[int]  # None for added lines
+    new_lineno: Optional[int]  # None for removed lines
+
+
+Record = Union[FileRecord, HunkRecord, LineRecord]
+
+
+class _FileChanges(NamedTuple):
+    # Emitted instead of a FileRecord by _iter_patch(line_records=False);
+    # the lists are filled as the parser reads on through the file's hunks
+    file: FileRecord
+    added: List[str]
+    removed: List[str]
+
+
+def unquote_path(path: str) -> str:
+    """Undo git's C-style quoting of paths with special characters."""
+    if not (len(path) >= 2 and path.startswith('"') and path.endswith('"')):
+        return path
+    raw = bytearray()
+    body = path[1:-1]
+    i = 0
+    while i < len(body):
+        char = body[i]
+        if char == "\\" and i + 1 < len(body):
+            escape = body[i + 1]
+            if escape in "01234567":
+                octal = re.match(r"[0-7]{1,3}", body[i + 1 :]).group(0)
+                raw.append(int(octal, 8))
+                i += 1 + len(octal)
+                continue
+            raw.extend(C_ESCAPES.get(escape, escape).encode())
+            i += 2
+        else:
+            raw.extend(char.encode())
+            i += 1
+    return raw.decode("utf-8", errors="replace")
+
+
+def _strip_prefix(path: Optional[str]) -> Optional[str]:
+    if path is None or path == "/dev/null":
+        return None
+    path = unquote_path(path)
+    if path[:2] in ("a/", "b/"):
+        return path[2:]
+    return path
+
+
+def _split_diff_git_paths(rest: str):
+    """Split the "a/<old> b/<new>" part of a diff --git line."""
+    if rest.startswith('"'):
+        end = re.match(r'"(?:[^"\\]|\\.)*"', rest).end()
+        old, new = rest[:end], rest[end:].lstrip()
+        return _strip_prefix(old), _strip_prefix(new)
+    if rest.endswith('"'):
+        start = rest.rindex(' "')
+        return _strip_prefix(rest[:start]), _strip_prefix(rest[start + 1 :])
+    # Unquoted paths may contain spaces; when both sides name the same file
+    # the line is "a/<path> b/<path>" and the split point is in the middle
+    half = (len(rest) - 1) // 2
+    if rest[half] == " " and rest[2:half] == rest[half + 3 :]:
+        return rest[2:half], rest[half + 3 :]
+    old, _, new = rest.partition(" b/")
+    return _strip_prefix(old), new
+
+
+def _split_chunks(chunks: Iterable[str]) -> Iterator[List[str]]:
+    """Split text chunks into lists of lines without their line breaks."""
+    tail = ""
+    for chunk in chunks:
+        text = tail + chunk
+        lines = text.split("\n")
+        tail = lines.pop()
+        if "\r" in text:
+            lines = [line.rstrip("\r") for line in lines]
+        yield lines
+    if tail:
+        yield [tail.rstrip("\r")]
+
+
+def _iter_lines(source: Union[str, Iterable[str]]) -> Iterator[str]:
+    # Text is split a chunk at a time, so lines cost about as much as one
+    # split of the whole text while only a chunk's lines are held, and
+    # chain hands them out without a Python call per line
+    if isinstance(source, str):
+        chunks = (
+            source[start : start + CHUNK_SIZE]
+            for start in range(0, len(source), CHUNK_SIZE)
+        )
+        return chain.from_iterable(_split_chunks(chunks))
+    if hasattr(source, "read"):
+        chunks = iter(lambda: source.read(CHUNK_SIZE), "")
+        return chain.from_iterable(_split_chunks(chunks))
+    return (line.rstrip("\r\n") for line in source)
+
+
+class _FileHeader:
+    def __init__(self, old_path=None, new_path=None):
+        self.old_path = old_path
+        self.new_path = new_path
+        self.status = "modified"
+        self.is_binary = False
+
+    def record(self) -> FileRecord:
+        old_path = None if self.status == "added" else self.old_path
+        new_path = None if self.status == "deleted" else self.new_path
+        return FileRecord(old_path, new_path, self.status, self.is_binary)
+
+
+def iter_patch(source: Union[str, Iterable[str]]) -> Iterator[Record]:
+    """Parse a unified diff in a single pass over its lines.
+    Accepts git and GitHub `.patch` output, including an email preamble,
+    and yields a FileRecord per file, a HunkRecord per hunk and a
+    LineRecord per changed or context line, with old/new line numbers.
+    Args:
+        source: Patch text, or any iterable of lines such as an open file
+    Yields:
+        FileRecord, HunkRecord and LineRecord tuples in patch order
+    """
+    return _iter_patch(source, line_records=True)
+
+
+def _file_record(header, line_records):
+    if line_records:
+        return header.record()
+    # A file whose header wasn't emitted by a hunk has no changed lines
+    return _FileChanges(header.record(), [], [])
+
+
+def _hunk_records(lines, old_lineno, old_remaining, new_lineno, new_remaining):
+    """Yield the LineRecords of a hunk's body, read from lines.
+    Returns:
+        str: The line that cut the hunk short, or None if it was complete
+    """
+    # The line counts decide where the hunk ends, so lines like "--- foo"
+    # or "diff --git" in the content are not headers
+    for line in lines:
+        kind = line[:1] or " "
+        if kind == " ":
+            yield LineRecord(" ", line[1:], old_lineno, new_lineno)
+            old_lineno += 1
+            new_lineno += 1
+            old_remaining -= 1
+            new_remaining -= 1
+        elif kind == "-":
+            yield LineRecord("-", line[1:], old_lineno, None)
+            old_lineno += 1
+            old_remaining -= 1
+        elif kind == "+":
+            yield LineRecord("+", line[1:], None, new_lineno)
+            new_lineno += 1
+            new_remaining -= 1
+        elif kind == "\\":
+            continue  # "\ No newline at end of file"
+        else:
+            return line  # truncated hunk; the line is a header
+        if old_remaining <= 0 and new_remaining <= 0:
+            return None
+    return None
+
+
+def _hunk_changes(lines, old_remaining, new_remaining, added, removed):
+    """Append a hunk's added and removed lines, read from lines.
+    Returns:
+        str: The line that cut the hunk short, or None if it was complete
+    """
+    add, remove = added.append, removed.append
+    for line in lines:
+        kind = line[:1]
+        if kind == "+":
+            add(line[1:])
+            new_remaining -= 1
+        elif kind == "-":
+            remove(line[1:])
+            old_remaining -= 1
+        elif kind == " " or not line:
+            old_remaining -= 1
+            new_remaining -= 1
+        elif kind == "\\":
+            continue
+        else:
+            return line
+        if old_remaining <= 0 and new_remaining <= 0:
+            return None
+    return None
+
+
+def _iter_patch(source, line_records):
+    # Without line_records, no HunkRecords or LineRecords are yielded; the
+    # added and removed lines are appended to the lists of the file's
+    # _FileChanges, which is all get_changed_lines needs and much cheaper.
+    # Hunk bodies are read by their own loops, so only header lines go
+    # through the checks below.
+    added = removed = None
+    header = None  # _FileHeader not yet emitted
+    in_file = False  # a file header was seen, so hunks can follow
+    in_binary = False
+    plain_old_path = None
+    lines = _iter_lines(source)
+    pending = None  # a line that cut a hunk short, still to be handled
+
+    while True:
+        if pending is not None:
+            line, pending = pending, None
+        else:
+            line = next(lines, None)
+            if line is None:
+                break
+
+        if line.startswith("diff --git "):
+            if header is not None:
+                yield _file_record(header, line_records)
+            header = _FileHeader(*_split_diff_git_paths(line[len("diff --git ") :]))
+            in_file = True
+            in_binary = False
+            continue
+
+        if line.startswith("@@") and in_file:
+            match = HUNK_HEADER_RE.match(line)
+            if match is None:
+                continue
+            if header is not None:
+                if line_records:
+                    yield header.record()
+                else:
+                    added, removed = [], []
+                    yield _FileChanges(header.record(), added, removed)
+                header = None
+            old_start, old_count, new_start, new_count, section = match.groups()
+            old_remaining = int(old_count) if old_count is not None else 1
+            new_remaining = int(new_count) if new_count is not None else 1
+            if line_records:
+                old_lineno, new_lineno = int(old_start), int(new_start)
+                yield HunkRecord(
+                    old_lineno, old_remaining, new_lineno, new_remaining, section
+                )
+            if old_remaining <= 0 and new_remaining <= 0:
+                continue
+            if line_records:
+                pending = yield from _hunk_records(
+                    lines, old_lineno, old_remaining, new_lineno, new_remaining
+                )
+            else:
+                pending = _hunk_changes(
+                    lines, old_remaining, new_remaining, added, removed
+                )
+            continue
+
+        if header is None and not in_binary:
+            # Plain unified diff: a "--- " line directly followed by "+++ "
+            if line.startswith("--- "):
+                plain_old_path = line[4:].split("\t")[0]
+                continue
+            if line.startswith("+++ ") and plain_old_path is not None:
+                header = _FileHeader()
+                in_file = True
+                header.old_path = _strip_prefix(plain_old_path)
+                header.new_path = _strip_prefix(line[4:].split("\t")[0])
+                if header.old_path is None:
+                    header.status = "added"
+                elif header.new_path is None:
+                    header.status = "deleted"
+                plain_old_path = None
+                continue
+            plain_old_path = None
+            continue
+        if in_binary:
+            if not line:
+                in_binary = False
+            continue
+
+        if line.startswith("--- "):
+            header.old_path = _strip_prefix(line[4:].split("\t")[0])
+            if header.old_path is None:
+                header.status = "added"
+        elif line.startswith("+++ "):
+            header.new_path = _strip_prefix(line[4:].split("\t")[0])
+            if header.new_path is None:
+                header.status = "deleted"
+        elif line.startswith("new file mode"):
+            header.status = "added"
+        elif line.startswith("deleted file mode"):
+            header.status = "deleted"
+        elif line.startswith("rename from "):
+            header.status = "renamed"
+            header.old_path = unquote_path(line[len("rename from ") :])
+        elif line.startswith("rename to "):
+            header.new_path = unquote_path(line[len("rename to ") :])
+        elif line.startswith("copy from "):
+            header.status = "copied"
+            header.old_path = unquote_path(line[len("copy from ") :])
+        elif line.startswith("copy to "):
+            header.new_path = unquote_path(line[len("copy to ") :])
+        elif line.startswith("Binary files "):
+            header.is_binary = True
+        elif line == "GIT binary patch":
+            header.is_binary = True
+            in_binary = True
+
+    if header is not None:
+        yield _file_record(header, line_records)
+
+
+def parse_patch(source: Union[str, Iterable[str]]) -> List[dict]:
+    """Parse a patch into one dict per file.
+    Returns:
+        list: {"file": FileRecord, "hunks": [(HunkRecord, [LineRecord])]}
+    """
+    files = []
+    for record in iter_patch(source):
+        if isinstance(record, FileRecord):
+            files.append({"file": record, "hunks": []})
+        elif isinstance(record, HunkRecord):
+            files[-1]["hunks"].append((record, []))
+        else:
+            files[-1]["hunks"][-1][1].append(record)
+    return files
+
+
+def get_changed_lines(source: Union[str, Iterable[str]]) -> dict:
+    """Get the added and removed lines of every file in a patch.
+    Returns:
+        dict: path -> {"added_lines": [...], "removed_lines": [...]}
+    """
+    file_changes = {}
+    for record in _iter_patch(source, line_records=False):
+        file_changes[record.file.path] = {
+            "added_lines": record.added,
+            "removed_lines": record.removed,
+        }
+    return file_changes
@@ -0,0 +1,224 @@
+import os
+import re
+import zlib
+import sqlite3
+import logging
+import threading
+
+from constants import (
+    PATCH_STORE_DIR,
+    PATCH_STORE_SHARDS,
+    PATCH_CACHE_DIR,
+    BENIGN_PATCHES_DIR,
+)
+from git_batch import get_git_batch
+from local_patch import get_patches as generate_or_fetch_patches
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def normalize_repo_url(repo_url):
+    """Reduce a repository URL to "owner/name", the store's repo key.
+    The CSV has URLs like https://github.com//owner/name, so scheme, host,
+    duplicate slashes and a trailing .git are all dropped.
+    """
+    path = repo_url.split("://", 1)[-1]
+    parts = [part for part in path.split("/") if part]
+    key = "/".join(parts[-2:])
+    return key[:-4] if key.endswith(".git") else key
+
+
+COMMIT_SHA_RE = re.compile(r"[0-9a-fA-F]{7,40}")
+
+
+def parse_commit_url(commit_url):
+    """Split a commit URL into its repository URL and commit SHA.
+    Tolerates fragments and queries, GitLab's /-/commit/ form, and extra
+    path segments or a .patch/.diff suffix after the SHA.
+    Raises:
+        ValueError: If the URL names no commit
+    """
+    clean_url = commit_url.split("#")[0].split("?")[0]
+    if "/commit/" not in clean_url:
+        raise ValueError(f"Not a commit URL: {commit_url}")
+    repo_url, rest = clean_url.rsplit("/commit/", 1)
+    repo_url = repo_url.rstrip("/")
+    if repo_url.endswith("/-"):
+        repo_url = repo_url[:-2]
+    commit_id = rest.strip("/").split("/")[0]
+    for suffix in (".patch", ".diff"):
+        if commit_id.endswith(suffix):
+            commit_id = commit_id[: -len(suffix)]
+    if not repo_url or not COMMIT_SHA_RE.fullmatch(commit_id):
+        raise ValueError(f"Not a commit URL: {commit_url}")
+    return repo_url, commit_id
+
+
+def _compress(patch_content):
+    data = patch_content.encode("utf-8", errors="replace")
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(data)
+    return "zlib", zlib.compress(data, 9)
+
+
+def _decompress(codec, data):
+    if codec == "zstd":
+        data = zstandard.ZstdDecompressor().decompress(data)
+    elif codec == "zlib":
+        data = zlib.decompress(data)
+    return data.decode("utf-8", errors="replace")
+
+
+class PatchStore:
+    """Compressed patch store keyed by (repo, full commit SHA).
+    Patches are packed into PATCH_STORE_SHARDS SQLite files, picked by the
+    first hex digit(s) of the SHA, instead of one small file per patch.
+    """
+
+    def __init__(self, store_dir=PATCH_STORE_DIR, num_shards=PATCH_STORE_SHARDS):
+        self.store_dir = store_dir
+        self.num_shards = num_shards
+        self._connections = {}
+        self._lock = threading.Lock()
+        os.makedirs(store_dir, exist_ok=True)
+
+    def _shard(self, sha):
+        shard = int(sha[:4], 16) % self.num_shards
+        if shard not in self._connections:
+            conn = sqlite3.connect(
+                os.path.join(self.store_dir, f"shard-{shard:02d}.db"),
+                timeout=60,
+                check_same_thread=False,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS patches (
+                    repo TEXT,
+                    sha TEXT,
+                    codec TEXT,
+                    data BLOB,
+                    PRIMARY KEY (repo, sha)
+                )""")
+            conn.commit()
+            self._connections[shard] = conn
+        return self._connections[shard]
+
+    def get(self, repo_url, sha):
+        """Get a stored patch, or None if it isn't in the store."""
+        repo_key = normalize_repo_url(repo_url)
+        with self._lock:
+            row = (
+                self._shard(sha)
+                .execute(
+                    "SELECT codec, data FROM patches WHERE repo = ? AND sha = ?",
+                    (repo_key, sha),
+                )
+                .fetchone()
+            )
+        return _decompress(*row) if row else None
+
+    def contains(self, repo_url, sha):
+        repo_key = normalize_repo_url(repo_url)
+        with self._lock:
+            return (
+                self._shard(sha)
+                .execute(
+                    "SELECT 1 FROM patches WHERE repo = ? AND sha = ?",
+                    (repo_key, sha),
+                )
+                .fetchone()
+                is not None
+            )
+
+    def put(self, repo_url, sha, patch_content):
+        repo_key = normalize_repo_url(repo_url)
+        codec, data = _compress(patch_content)
+        with self._lock:
+            conn = self._shard(sha)
+            conn.execute(
+                "INSERT OR REPLACE INTO patches VALUES (?, ?, ?, ?)",
+                (repo_key, sha, codec, data),
+            )
+            conn.commit()
+
+
+_patch_store = None
+_patch_store_lock = threading.Lock()
+
+
+def get_patch_store():
+    global _patch_store
+    with _patch_store_lock:
+        if _patch_store is None:
+            _patch_store = PatchStore()
+        return _patch_store
+
+
+def _read_legacy_patch(repo_url, sha):
+    """Read a patch saved by the per-file caches that predate the store."""
+    repo_name = repo_url.rstrip("/").split("/")[-1]
+    for path in [
+        os.path.join(PATCH_CACHE_DIR, f"{sha}.patch"),
+        os.path.join(BENIGN_PATCHES_DIR, repo_name, f"{sha}.patch"),
+    ]:
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                return f.read()
+    return None
+
+
+def get_patches(repo_url, commit_ids, repo=None):
+    """Get the patches of many commits through the patch store.
+    Missing patches are generated from the cached repo, or downloaded if
+    the repo doesn't have them, and saved to the store.
+    Args:
+        repo_url (str): URL of the repository
+        commit_ids (iterable): Commit SHAs; abbreviated SHAs need a repo
+        repo (git.Repo): Cached repository object, if available
+    Returns:
+        dict: commit_id -> patch text, or None if it couldn't be obtained
+    """
+    commit_ids = list(dict.fromkeys(commit_ids))
+    full_shas = {commit_id: commit_id for commit_id in commit_ids}
+    if repo is not None:
+        short_ids = [commit_id for commit_id in commit_ids if len(commit_id) != 40]
+        if short_ids:
+            for commit_id, sha in (
+                get_git_batch(repo).resolve_commits(short_ids).items()
+            ):
+                full_shas[commit_id] = sha or commit_id
+
+    store = get_patch_store()
+    patches = {}
+    missing = []
+    for commit_id in commit_ids:
+        sha = full_shas[commit_id]
+        patch_content = store.get(repo_url, sha)
+        if patch_content is None:
+            patch_content = _read_legacy_patch(repo_url, sha)
+            if patch_content is not None:
+                store.put(repo_url, sha, patch_content)
+        if patch_content is None:
+            missing.append(commit_id)
+        else:
+            patches[commit_id] = patch_content
+
+    if missing:
+        fetched = generate_or_fetch_patches(repo, repo_url, missing)
+        for commit_id in missing:
+            patch_content = fetched.get(commit_id)
+            if patch_content is not None:
+                store.put(repo_url, full_shas[commit_id], patch_content)
+            patches[commit_id] = patch_content
+    logging.info(
+        f"Patch store served {len(commit_ids) - len(missing)} of "
+        f"{len(commit_ids)} patches for {repo_url}"
+    )
+    return patches
+
+
+def get_patch(repo_url, sha, repo=None):
+    """Get the patch of a commit; the single entry point for every stage."""
+    return get_patches(repo_url, [sha], repo).get(sha)
@@ -0,0 +1,451 @@
+import os
+import ast
+import sys
+import hashlib
+import logging
+import argparse
+import multiprocessing
+from typing import Callable, NamedTuple, Tuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from constants import (
+    COMMITS_CSV_FILE,
+    CVES_TO_PROCESS_FILE,
+    PIPELINE_MAX_PARALLEL_STAGES,
+    loggingConfig,
+)
+from stage_manifest import get_manifest
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+TOKENIZER_DIR = os.path.join(REPO_DIR, "tokenizer without semantics")
+BLAME_OUTPUT_FILE = "commits_with_blame_data.csv"
+# Manifest stage holding one row per pipeline stage, keyed by its content hash
+MANIFEST_STAGE = "pipeline"
+# Manifest stage holding the hash of each pipeline stage's code alone
+CODE_MANIFEST_STAGE = "pipeline_code"
+
+
+class Stage(NamedTuple):
+    name: str
+    func: Callable
+    deps: Tuple[str, ...] = ()
+    inputs: Tuple[str, ...] = ()  # data files read from outside the pipeline
+    code: Tuple[str, ...] = ()  # entry modules, relative to the repo
+    params: Tuple = ()
+    items: Tuple[str, ...] = ()  # manifest stages of its per-item progress
+
+
+# Stage functions import their modules lazily so each stage only needs its
+# own dependencies, and run in a fresh process with its own logging setup
+
+
+def run_process_commits(workers):
+    from process_commits import process_commits
+
+    process_commits(COMMITS_CSV_FILE, BLAME_OUTPUT_FILE, workers)
+
+
+def run_analyze_vulnerabilities(workers):
+    from find_vuln_intro_commits import analyze_vulnerabilities
+
+    loggingConfig()
+    analyze_vulnerabilities(workers)
+
+
+def run_process_vuln_patches():
+    from process_vuln_patches import process_vuln_patches
+
+    loggingConfig()
+    process_vuln_patches()
+
+
+def run_check_duplicates():
+    from check_duplicates import check_duplicates
+
+    loggingConfig()
+    check_duplicates()
+
+
+def run_organize_commits():
+    from organize_commits import main
+
+    main()
+
+
+def run_collect_benign_commits():
+    from collect_benign_commits import process_benign_commits
+
+    process_benign_commits()
+
+
+def run_tokenize(commit_type, tokenizer, workers=1):
+    from constants import (
+        BENIGN_COMMITS_DIR,
+        VULNERABILITY_INTRO_METADATA_DIR,
+        TOKENIZED_BENIGN_COMMITS_DIR,
+        TOKENIZED_VULN_INTRO_COMMITS_DIR,
+    )
+    from commit_dataset import BENIGN_COMMITS, TOKENIZED_BENIGN_COMMITS
+
+    if tokenizer == "whitespace":
+        import simple_whitespace_remover
+
+        if commit_type == "benign":
+            simple_whitespace_remover.tokenize_benign_commits()
+        else:
+            simple_whitespace_remover.tokenize_vuln_intro_commits()
+        return
+
+    sys.path.insert(0, TOKENIZER_DIR)
+    from main3 import CommitProcessor
+
+    if commit_type == "benign":
+        CommitProcessor().tokenize_commits(
+            BENIGN_COMMITS_DIR,
+            TOKENIZED_BENIGN_COMMITS_DIR,
+            "benign",
+            workers,
+            upstream_dataset=BENIGN_COMMITS,
+            dataset=TOKENIZED_BENIGN_COMMITS,
+        )
+    else:
+        CommitProcessor().tokenize_commits(
+            VULNERABILITY_INTRO_METADATA_DIR,
+            TOKENIZED_VULN_INTRO_COMMITS_DIR,
+            "vulnerability-introducing",
+            workers,
+        )
+
+
+def run_word2vec():
+    from word2vec_tokenizer import main
+
+    main()
+
+
+def run_pad_vectors():
+    from vectorized_commit_processor import main
+
+    main()
+
+
+def run_train():
+    from train import main
+
+    main()
+
+
+def get_stages(workers=1, tokenizer="semantic"):
+    """The pipeline as a graph; benign and vuln branches are independent."""
+    tokenizer_code = (
+        ("simple_whitespace_remover.py",)
+        if tokenizer == "whitespace"
+        else ("tokenizer without semantics/main3.py",)
+    )
+    return [
+        Stage(
+            "commit_metadata",
+            run_process_commits,
+            inputs=(COMMITS_CSV_FILE,),
+            code=("process_commits.py",),
+            params=(workers,),
+            items=("commit_metadata",),
+        ),
+        Stage(
+            "vuln_intro_commits",
+            run_analyze_vulnerabilities,
+            deps=("commit_metadata",),
+            inputs=(CVES_TO_PROCESS_FILE,),
+            code=("find_vuln_intro_commits.py",),
+            params=(workers,),
+            items=("vuln_intro_commits",),
+        ),
+        Stage(
+            "vuln_intro_metadata",
+            run_process_vuln_patches,
+            deps=("vuln_intro_commits",),
+            code=("process_vuln_patches.py",),
+            items=("vuln_intro_metadata", "vuln_intro_metadata_cves"),
+        ),
+        Stage(
+            "check_duplicates",
+            run_check_duplicates,
+            deps=("vuln_intro_metadata",),
+            code=("check_duplicates.py",),
+        ),
+        Stage(
+            "organize_commits",
+            run_organize_commits,
+            deps=("vuln_intro_metadata",),
+            inputs=(COMMITS_CSV_FILE,),
+            code=("organize_commits.py",),
+        ),
+        Stage(
+            "benign_commits",
+            run_collect_benign_commits,
+            deps=("organize_commits",),
+            inputs=(COMMITS_CSV_FILE,),
+            code=("collect_benign_commits.py",),
+            items=("benign_commits",),
+        ),
+        Stage(
+            "tokenized_vuln_intro_commits",
+            run_tokenize,
+            deps=("check_duplicates",),
+            code=tokenizer_code,
+            params=("vuln", tokenizer, workers),
+            items=("tokenized_vuln_intro_commits",),
+        ),
+        Stage(
+            "tokenized_benign_commits",
+            run_tokenize,
+            deps=("benign_commits",),
+            code=tokenizer_code,
+            params=("benign", tokenizer, workers),
+            items=("tokenized_benign_commits",),
+        ),
+        Stage(
+            "vectors",
+            run_word2vec,
+            deps=("tokenized_vuln_intro_commits", "tokenized_benign_commits"),
+            code=("word2vec_tokenizer.py",),
+        ),
+        Stage(
+            "padded_vectors",
+            run_pad_vectors,
+            deps=("vectors",),
+            code=("vectorized_commit_processor.py",),
+            items=("padded_benign_commits", "padded_vuln_intro_commits"),
+        ),
+        Stage(
+            "model",
+            run_train,
+            deps=("padded_vectors",),
+            code=("train.py",),
+        ),
+    ]
+
+
+def _hash_file(path, sha256):
+    if not os.path.exists(path):
+        sha256.update(b"missing")
+        return
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+
+
+def _local_imports(path):
+    """Get the repo modules a source file imports, relative to the repo.
+    Modules are looked up next to the file first, then at the repo root,
+    as the scripts' sys.path does.
+    """
+    with open(os.path.join(REPO_DIR, path), "rb") as f:
+        tree = ast.parse(f.read(), path)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split(".")[0])
+    imports = set()
+    for name in names:
+        for directory in (os.path.dirname(path), ""):
+            candidate = os.path.join(directory, f"{name}.py")
+            if os.path.exists(os.path.join(REPO_DIR, candidate)):
+                imports.add(candidate)
+                break
+    return imports
+
+
+def get_code_files(code):
+    """Get a stage's entry modules plus every repo module they import,
+    directly or not, and constants.py, which configures every stage.
+    Returns:
+        list: Paths relative to the repo, sorted
+    """
+    files = set()
+    todo = ["constants.py", *code]
+    while todo:
+        path = todo.pop()
+        if path in files:
+            continue
+        files.add(path)
+        if os.path.exists(os.path.join(REPO_DIR, path)):
+            todo.extend(_local_imports(path))
+    return sorted(files)
+
+
+def compute_code_key(stage):
+    """Hash a stage's code alone, the part that decides how items are made."""
+    sha256 = hashlib.sha256()
+    for path in get_code_files(stage.code):
+        sha256.update(path.encode())
+        _hash_file(os.path.join(REPO_DIR, path), sha256)
+    return sha256.hexdigest()
+
+
+def compute_keys(stages):
+    """Key every stage by its code, params, inputs and its upstream keys.
+    The code is the stage's modules and everything they import from the
+    repo, so a change anywhere changes the key of that stage and
+    everything downstream of it, and nothing else.
+    """
+    keys = {}
+    for stage in stages:  # stages are listed in dependency order
+        sha256 = hashlib.sha256(stage.name.encode())
+        for path in get_code_files(stage.code):
+            sha256.update(path.encode())
+            _hash_file(os.path.join(REPO_DIR, path), sha256)
+        for path in stage.inputs:
+            sha256.update(path.encode())
+            _hash_file(path, sha256)
+        sha256.update(repr(stage.params).encode())
+        for dep in stage.deps:
+            sha256.update(keys[dep].encode())
+        keys[stage.name] = sha256.hexdigest()
+    return keys
+
+
+def _run_stage(stage):
+    stage.func(*stage.params)
+
+
+def invalidate_items(stage, forced=False):
+    """Mark a stage's items stale if its code changed or it is forced.
+    Stages skip items by their input hashes, which don't cover the code,
+    so without this a stage rerun for a code change would redo nothing.
+    A change upstream only changes input hashes, so downstream stages
+    still redo just the items whose inputs changed.
+    """
+    manifest = get_manifest()
+    code_key = compute_code_key(stage)
+    row = manifest.get_items(CODE_MANIFEST_STAGE).get(stage.name)
+    # Recorded before the stage runs, so a resumed run keeps its progress
+    manifest.record(CODE_MANIFEST_STAGE, stage.name, "done", code_key)
+    if not forced and (row is None or row["input_hash"] == code_key):
+        return
+    for item_stage in stage.items:
+        count = manifest.invalidate(item_stage)
+        logging.info(f"Marked {count} items of {item_stage} stale")
+
+
+def select_stages(stages, targets):
+    """Get the target stages and everything upstream of them, in order."""
+    by_name = {stage.name: stage for stage in stages}
+    selected = set()
+    todo = list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in selected:
+            selected.add(name)
+            todo.extend(by_name[name].deps)
+    return [stage for stage in stages if stage.name in selected]
+
+
+def run_pipeline(
+    stages, force=(), dry_run=False, max_parallel=PIPELINE_MAX_PARALLEL_STAGES
+):
+    """Run the stages whose key changed, independent ones concurrently.
+    Each stage itself skips the items it already processed, so a rerun
+    stage only redoes the items whose inputs changed, or all of them if
+    its own code changed or it is forced.
+    Args:
+        stages (list): Stage tuples in dependency order
+        force (iterable): Names of stages to rerun even if unchanged
+        dry_run (bool): Only log which stages would run
+        max_parallel (int): Maximum number of stages running at once
+    Returns:
+        dict: stage name -> "skipped", "done", "failed" or "blocked"
+    """
+    manifest = get_manifest()
+    keys = compute_keys(stages)
+    by_name = {stage.name: stage for stage in stages}
+    force = set(force)
+    results = {}
+    for stage in stages:
+        if stage.name not in force and manifest.is_done(
+            MANIFEST_STAGE, stage.name, keys[stage.name]
+        ):
+            results[stage.name] = "skipped"
+    logging.info(
+        f"Stages up to date: {sorted(results)}; to run: "
+        f"{[stage.name for stage in stages if stage.name not in results]}"
+    )
+    if dry_run:
+        return results
+
+    # Spawned processes start from a clean interpreter for every stage
+    context = multiprocessing.get_context("spawn")
+    running = {}
+    with ProcessPoolExecutor(max_workers=max_parallel, mp_context=context) as executor:
+        while True:
+            for stage in stages:
+                if stage.name in results or stage.name in running.values():
+                    continue
+                dep_results = [results.get(dep) for dep in stage.deps]
+                if any(result in ("failed", "blocked") for result in dep_results):
+                    results[stage.name] = "blocked"
+                    logging.error(f"Stage {stage.name} blocked by a failed dependency")
+                elif all(result in ("skipped", "done") for result in dep_results):
+                    logging.info(f"Starting stage {stage.name}")
+                    invalidate_items(stage, stage.name in force)
+                    running[executor.submit(_run_stage, stage)] = stage.name
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.error(f"Stage {name} failed: {str(e)}")
+                    manifest.record(MANIFEST_STAGE, name, "failed", keys[name])
+                    results[name] = "failed"
+                    continue
+                manifest.record(MANIFEST_STAGE, name, "done", keys[name])
+                results[name] = "done"
+                logging.info(f"Finished stage {name}")
+
+    for name, stage in by_name.items():
+        results.setdefault(name, "blocked")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the pipeline stages whose code or inputs changed"
+    )
+    parser.add_argument(
+        "targets",
+        nargs="*",
+        help="Stages to bring up to date, with their dependencies (default: all)",
+    )
+    parser.add_argument("--force", nargs="*", default=[], help="Stages to rerun")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Worker processes per stage"
+    )
+    parser.add_argument(
+        "--tokenizer", choices=["semantic", "whitespace"], default="semantic"
+    )
+    parser.add_argument(
+        "--max-parallel", type=int, default=PIPELINE_MAX_PARALLEL_STAGES
+    )
+    args = parser.parse_args()
+
+    loggingConfig()
+    stages = get_stages(args.workers, args.tokenizer)
+    unknown = set(args.targets + args.force) - {stage.name for stage in stages}
+    if unknown:
+        parser.error(f"Unknown stages: {sorted(unknown)}")
+    if args.targets:
+        stages = select_stages(stages, args.targets)
+    results = run_pipeline(stages, args.force, args.dry_run, args.max_parallel)
+    for name, result in results.items():
+        print(f"{name}: {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import threading
+
+# Seconds the feeder waits for a free slot before checking for shutdown
+FEED_POLL_SECONDS = 0.5
+
+
+def imap_bounded(pool, func, tasks, chunksize=1, window=None):
+    """Like pool.imap, but read at most window tasks ahead of the results.
+    Pool.imap's feeder thread drains the task iterable as fast as it can,
+    so a generator over a whole dataset would still end up in memory;
+    here the feeder waits for results to be taken before reading on.
+    Args:
+        pool: multiprocessing Pool
+        tasks (iterable): Tasks, read lazily by the pool's feeder thread
+        chunksize (int): Tasks handed to a worker at a time
+        window (int): Tasks in flight; defaults to 4 chunks
+    Yields:
+        The results of func, in task order
+    """
+    slots = threading.Semaphore(max(window or 4 * chunksize, chunksize))
+    stop = threading.Event()
+
+    def feed():
+        for task in tasks:
+            while not slots.acquire(timeout=FEED_POLL_SECONDS):
+                # Lets the pool's feeder thread end if results stop being
+                # taken, so closing the pool doesn't wait for it forever
+                if stop.is_set():
+                    return
+            yield task
+
+    try:
+        for result in pool.imap(func, feed(), chunksize):
+            slots.release()
+            yield result
+    finally:
+        stop.set()
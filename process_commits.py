@@ -1,116 +1,245 @@
 from tqdm import tqdm
 import csv
 import os
-import json
 import logging
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from ensure_directories import ensure_dirs
 from constants import COMMIT_METADATA_DIR
 from constants import loggingConfig
 from read_existing_data import read_existing_blame_data, read_existing_metadata
-from get_cache import get_or_create_repo, get_patch_info, get_commit_metadata
-
+from get_cache import (
+    get_or_create_repo,
+    get_patch_info,
+    get_commit_metadata,
+    prefetch_repos,
+)
+from commit_index import get_fieldnames, iter_rows
+from git_batch import close_repo
+from commit_metadata import get_metadata
+from stage_manifest import get_manifest
+from commit_dataset import COMMIT_METADATA, save_records
+
+MANIFEST_STAGE = "commit_metadata"
+
+
+def get_item(row):
+    return f"{row['cve_id']}/{row['commit_id']}"
+
+
+def register_legacy_rows(input_file, blame_output_file, blame_fieldnames):
+    """Record rows finished before the manifest existed.
+    Uses the old check of a complete blame row plus a metadata JSON with
+    commit_metadata, reading each CVE's JSON once; only runs while the
+    manifest has no rows for this stage.
+    """
+    existing_blame_data = read_existing_blame_data(blame_output_file)
+    if not existing_blame_data:
+        return
+    metadata_by_cve = {}
+    done = []
+    for row in iter_rows(input_file):
+        existing_row = existing_blame_data.get(row["commit_id"])
+        if not existing_row or not all(
+            field in existing_row for field in blame_fieldnames
+        ):
+            continue
+        cve_id = row["cve_id"]
+        if cve_id not in metadata_by_cve:
+            metadata_by_cve[cve_id] = read_existing_metadata(cve_id)
+        if metadata_by_cve[cve_id] and "commit_metadata" in metadata_by_cve[cve_id]:
+            done.append((get_item(row), "done", None, None, None))
+    get_manifest().record_many(MANIFEST_STAGE, done)
+    logging.info(f"Registered {len(done)} commits processed before the manifest")
+
+
+def get_todo_rows(input_file, blame_output_file, blame_fieldnames):
+    """Get the CSV rows that still need processing, grouped by repository.
+    Returns:
+        dict: repo_url -> rows in CSV order
+    """
+    manifest = get_manifest()
+    if not manifest.get_items(MANIFEST_STAGE):
+        register_legacy_rows(input_file, blame_output_file, blame_fieldnames)
+
+    todo = defaultdict(list)
+    for row in iter_rows(input_file):
+        if not manifest.is_done(MANIFEST_STAGE, get_item(row)):
+            todo[row["repo_url"]].append(row)
+    return todo
+
+
+def process_commit_row(repo, row):
+    """Compute the blame CSV row and metadata JSON of one commit.
+    Returns:
+        tuple: (blame row, commit data), or None if the patch has no info
+    """
+    cve_id = row["cve_id"]
+    commit_id = row["commit_id"]
+
+    patch_info = get_patch_info(row["commit_url"], repo)
+    logging.info(f"Patch info: {patch_info}")
+    if not patch_info:
+        logging.warning(f"No patch info found for commit: {commit_id}")
+        return None
+
+    malicious_files = list(patch_info.keys())
+    used_context_lines = any(
+        file_info["used_context_lines"] for file_info in patch_info.values()
+    )
 
-def process_commits(input_file, blame_output_file):
+    commit_data = {
+        "cve_id": cve_id,
+        "project_name": row["project_name"],
+        "commit_id": commit_id,
+        "malicious_files": malicious_files,
+        "file_changes": {},
+    }
+
+    for filename, file_info in patch_info.items():
+        commit_data["file_changes"][filename] = {
+            "malicious_lines": file_info["malicious_lines"],
+            "used_context_lines": file_info["used_context_lines"],
+        }
+
+    blame_row = dict(row)
+    blame_row["malicious_files"] = ",".join(malicious_files)
+    blame_row["used_context_lines"] = "Yes" if used_context_lines else "No"
+
+    # Get metadata for the commit
+    metadata = get_commit_metadata(repo, commit_id)
+    if metadata:
+        commit_data["commit_metadata"] = metadata
+
+    return blame_row, commit_data
+
+
+def process_repo_rows(repo_url, rows):
+    """Process the to-do rows of one repository; runs in a worker.
+    Returns:
+        list: (row, result of process_commit_row) pairs in CSV order
+    """
+    repo = get_or_create_repo(repo_url)
+    if repo is None:
+        return [(row, None) for row in rows]
+    try:
+        # Extract the metadata of all of the repo's commits in one git call;
+        # get_commit_metadata then reads it from the store
+        get_metadata(repo, [row["commit_id"] for row in rows])
+        results = []
+        for row in rows:
+            try:
+                results.append((row, process_commit_row(repo, row)))
+            except Exception as e:
+                logging.error(f"Error processing commit {row['commit_id']}: {str(e)}")
+                results.append((row, None))
+        return results
+    finally:
+        close_repo(repo)
+
+
+def process_commits(input_file, blame_output_file, num_workers=1):
+    """Process the commits of the CSV that aren't done yet.
+    Args:
+        input_file (str): Commits CSV
+        blame_output_file (str): Blame CSV that results are appended to
+        num_workers (int): Worker processes, each handling whole repos;
+            1 processes every repo in this process
+    """
     loggingConfig()
     ensure_dirs()
-    repos = {}
-
-    existing_blame_data = read_existing_blame_data(blame_output_file)
-
-    with open(input_file, "r") as in_f, open(
-        blame_output_file, "a", newline=""
-    ) as blame_out_f:
-        reader = csv.DictReader(in_f)
-        blame_fieldnames = reader.fieldnames + ["malicious_files", "used_context_lines"]
+    manifest = get_manifest()
+
+    blame_fieldnames = get_fieldnames(input_file) + [
+        "malicious_files",
+        "used_context_lines",
+    ]
+    todo = get_todo_rows(input_file, blame_output_file, blame_fieldnames)
+    num_todo = sum(len(rows) for rows in todo.values())
+    logging.info(f"{num_todo} commits in {len(todo)} repositories to process")
+    if not todo:
+        logging.info("All commits are already processed")
+        return
+
+    # Clone/fetch only the repositories with work left
+    prefetch_repos(todo)
+
+    write_header = (
+        not os.path.exists(blame_output_file) or os.path.getsize(blame_output_file) == 0
+    )
+    with open(blame_output_file, "a", newline="") as blame_out_f:
         blame_writer = csv.DictWriter(blame_out_f, fieldnames=blame_fieldnames)
-
-        if not existing_blame_data:
+        if write_header:
             blame_writer.writeheader()
 
-        total_rows = sum(1 for row in reader)
-        in_f.seek(0)
-        next(reader)  # Skip header row
-
-        current_cve = None
-        for row in tqdm(reader, desc="Processing commits", total=total_rows):
-            cve_id = row["cve_id"]
-            commit_id = row["commit_id"]
-
-            # Log when starting a new CVE
-            if cve_id != current_cve:
-                if current_cve is not None:
-                    logging.info(f"Finished processing CVE: {current_cve}")
-                current_cve = cve_id
-                logging.info(f"Starting to process CVE: {cve_id}")
-
-            # Check if we need to process this commit
-            existing_row = existing_blame_data.get(commit_id)
-            existing_metadata = read_existing_metadata(cve_id)
-
-            if (
-                existing_row
-                and existing_metadata
-                and all(field in existing_row for field in blame_fieldnames)
-                and "commit_metadata" in existing_metadata
-            ):
-                logging.info(
-                    f"Skipping commit: {commit_id} because it's already been processed"
-                )
-                continue  # Skip if we have complete data for this commit
-            if existing_row:
-                logging.info(f"Reprocessing commit: {commit_id}")
-
-            project_name = row["project_name"]
-            repo_url = row["repo_url"]
-            commit_url = row["commit_url"]
-
-            if repo_url not in repos:
-                repo = get_or_create_repo(repo_url)
-                if repo is None:
+        def merge(results):
+            """Append a repo's results to the shared CSV and JSON outputs."""
+            records = []  # (row, commit_data, json_filename), saved at once
+            for row, result in results:
+                if result is None:
                     continue
-                repos[repo_url] = repo
-            else:
-                repo = repos[repo_url]
-
-            patch_info = get_patch_info(commit_url)
-            logging.info(f"Patch info: {patch_info}")
-            if not patch_info:
-                logging.warning(f"No patch info found for commit: {commit_id}")
-                continue
-
-            malicious_files = list(patch_info.keys())
-            used_context_lines = any(
-                file_info["used_context_lines"] for file_info in patch_info.values()
+                blame_row, commit_data = result
+                blame_writer.writerow(blame_row)
+                # One record per CVE, also written as its JSON file
+                json_filename = os.path.join(
+                    COMMIT_METADATA_DIR, f"{row['cve_id']}.json"
+                )
+                records.append((row, commit_data, json_filename))
+            output_hashes = save_records(
+                COMMIT_METADATA,
+                (
+                    (f"{row['cve_id']}.json", commit_data, json_filename)
+                    for row, commit_data, json_filename in records
+                ),
             )
-
-            commit_data = {
-                "cve_id": cve_id,
-                "project_name": project_name,
-                "commit_id": commit_id,
-                "malicious_files": malicious_files,
-                "file_changes": {},
-            }
-
-            for filename, file_info in patch_info.items():
-                commit_data["file_changes"][filename] = {
-                    "malicious_lines": file_info["malicious_lines"],
-                    "used_context_lines": file_info["used_context_lines"],
-                }
-
-            row["malicious_files"] = ",".join(malicious_files)
-            row["used_context_lines"] = "Yes" if used_context_lines else "No"
-            blame_writer.writerow(row)
-
-            # Get metadata for the commit
-            metadata = get_commit_metadata(repo, commit_id)
-            if metadata:
-                commit_data["commit_metadata"] = metadata
-
-            # Write individual JSON file for each CVE
-            json_filename = os.path.join(COMMIT_METADATA_DIR, f"{cve_id}.json")
-            with open(json_filename, "w") as json_out_f:
-                json.dump(commit_data, json_out_f, indent=2)
+            # Like the legacy check, a commit without metadata isn't done;
+            # recording it as failed retries it on the next run
+            manifest.record_many(
+                MANIFEST_STAGE,
+                (
+                    (
+                        get_item(row),
+                        "done" if "commit_metadata" in commit_data else "failed",
+                        None,
+                        json_filename,
+                        output_hash,
+                    )
+                    for (row, commit_data, json_filename), output_hash in zip(
+                        records, output_hashes
+                    )
+                ),
+            )
+            blame_out_f.flush()
+
+        with tqdm(total=num_todo, desc="Processing commits") as pbar:
+            if num_workers <= 1:
+                for repo_url, rows in todo.items():
+                    logging.info(f"Processing {len(rows)} commits of {repo_url}")
+                    merge(process_repo_rows(repo_url, rows))
+                    pbar.update(len(rows))
+            else:
+                # Spawned workers open their own SQLite connections
+                context = multiprocessing.get_context("spawn")
+                with ProcessPoolExecutor(
+                    max_workers=num_workers,
+                    mp_context=context,
+                    initializer=loggingConfig,
+                ) as executor:
+                    futures = {
+                        executor.submit(process_repo_rows, repo_url, rows): repo_url
+                        for repo_url, rows in sorted(
+                            todo.items(), key=lambda item: len(item[1]), reverse=True
+                        )
+                    }
+                    for future in as_completed(futures):
+                        repo_url = futures[future]
+                        try:
+                            merge(future.result())
+                        except Exception as e:
+                            logging.error(f"Worker failed for {repo_url}: {str(e)}")
+                        pbar.update(len(todo[repo_url]))
 
     logging.info(
         f"Processing complete. Results saved to {blame_output_file} and {COMMIT_METADATA_DIR}"
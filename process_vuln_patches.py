@@ -7,32 +7,71 @@ from tqdm import tqdm
 from constants import (
     VULNERABILITY_PATCHES_DIR,
     VULNERABILITY_INTRO_METADATA_DIR,
+    VULN_COMMITS_FILE,
     loggingConfig,
 )
 from ensure_directories import ensure_dirs
+from patch_parser import get_changed_lines
+from patch_store import get_patch
+from stage_manifest import get_manifest, hash_bytes
+from commit_dataset import VULN_INTRO_METADATA, save_records
+
+UPSTREAM_STAGE = "vuln_intro_commits"
+# One item per commit's metadata file, and one per CVE once all are done
+MANIFEST_STAGE = "vuln_intro_metadata"
+CVE_STAGE = "vuln_intro_metadata_cves"
 
 
 def get_patch_info(patch_content):
-    file_changes = {}
-    current_file = None
-    for line in patch_content.split("\n"):
-        if line.startswith("diff --git"):
-            current_file = line.split()[-1][2:]
-            file_changes[current_file] = {"added_lines": [], "removed_lines": []}
-        elif current_file:
-            if line.startswith("+") and not line.startswith("+++"):
-                file_changes[current_file]["added_lines"].append(line[1:])
-            elif line.startswith("-") and not line.startswith("---"):
-                file_changes[current_file]["removed_lines"].append(line[1:])
-    return file_changes
+    return get_changed_lines(patch_content)
+
+
+def list_cve_commits(patches_path):
+    """List a CVE's vulnerability-introducing commits.
+    Returns:
+        tuple: (repo_url or None, list of commit IDs)
+    """
+    repo_url = None
+    commit_ids = []
+    vuln_commits_file = os.path.join(patches_path, VULN_COMMITS_FILE)
+    if os.path.exists(vuln_commits_file):
+        with open(vuln_commits_file, "r") as f:
+            vuln_commits = json.load(f)
+        repo_url = vuln_commits["repo_url"]
+        commit_ids.extend(vuln_commits["commit_ids"])
+
+    # Patch files written before the patch store existed
+    for patch_file in sorted(os.listdir(patches_path)):
+        if patch_file.endswith(".patch") and patch_file[:-6] not in commit_ids:
+            commit_ids.append(patch_file[:-6])
+    return repo_url, commit_ids
+
+
+def read_cve_patch(patches_path, repo_url, commit_id):
+    patch_path = os.path.join(patches_path, f"{commit_id}.patch")
+    if os.path.exists(patch_path):
+        with open(patch_path, "r") as f:
+            return f.read()
+    if repo_url is None:
+        return None
+    return get_patch(repo_url, commit_id)
 
 
 def process_vuln_patches():
     ensure_dirs()
+    manifest = get_manifest()
+    vuln_commits = manifest.get_items(UPSTREAM_STAGE)
 
     for cve_dir in tqdm(
         os.listdir(VULNERABILITY_PATCHES_DIR), desc="Processing vulnerability patches"
     ):
+        # Skip CVEs finished for their current list of vuln commits; CVEs
+        # finished before the manifest existed still have a flag file
+        upstream = vuln_commits.get(cve_dir, {})
+        if manifest.is_done(CVE_STAGE, cve_dir, upstream.get("output_hash")):
+            logging.info(f"CVE {cve_dir} has already been processed. Skipping.")
+            continue
+
         patches_path = os.path.join(VULNERABILITY_PATCHES_DIR, cve_dir)
         if not os.path.isdir(patches_path):
             continue
@@ -41,72 +80,64 @@ def process_vuln_patches():
         cve_output_dir = os.path.join(VULNERABILITY_INTRO_METADATA_DIR, cve_dir)
         os.makedirs(cve_output_dir, exist_ok=True)
 
-        # Check if this CVE has already been processed
-        processed_flag_file = os.path.join(cve_output_dir, "processed")
-        if os.path.exists(processed_flag_file):
+        if cve_dir not in manifest.get_items(CVE_STAGE) and os.path.exists(
+            os.path.join(cve_output_dir, "processed")
+        ):
+            manifest.record(CVE_STAGE, cve_dir, input_hash=upstream.get("output_hash"))
             logging.info(f"CVE {cve_dir} has already been processed. Skipping.")
             continue
 
         cve_processed = False
+        pending = []  # (item, metadata, output_path, patch hash), saved at once
 
-        for patch_file in os.listdir(patches_path):
-            if not patch_file.endswith(".patch"):
-                continue
-
-            patch_path = os.path.join(patches_path, patch_file)
-            output_path = os.path.join(cve_output_dir, f"{patch_file[:-6]}.json")
+        repo_url, commit_ids = list_cve_commits(patches_path)
+        for commit_id in commit_ids:
+            item = f"{cve_dir}/{commit_id}.json"
+            output_path = os.path.join(cve_output_dir, f"{commit_id}.json")
 
-            if os.path.exists(output_path):
+            if manifest.is_done(MANIFEST_STAGE, item):
                 logging.info(
-                    f"Metadata for {cve_dir}, commit {patch_file[:-6]} already exists. Skipping."
+                    f"Metadata for {cve_dir}, commit {commit_id} already exists. Skipping."
                 )
                 cve_processed = True
                 continue
 
-            with open(patch_path, "r") as f:
-                patch_content = f.read()
+            patch_content = read_cve_patch(patches_path, repo_url, commit_id)
+            if patch_content is None:
+                logging.warning(f"No patch found for {cve_dir}, commit {commit_id}")
+                continue
 
             patch_info = get_patch_info(patch_content)
 
             metadata = {
                 "cve_id": cve_dir,
-                "commit_id": patch_file[:-6],
+                "commit_id": commit_id,
                 "file_changes": patch_info,
             }
 
-            with open(output_path, "w") as f:
-                json.dump(metadata, f, indent=2)
+            pending.append((item, metadata, output_path, hash_bytes(patch_content)))
 
-            logging.info(
-                f"Processed and saved metadata for {cve_dir}, commit {patch_file[:-6]}"
+        if pending:
+            output_hashes = save_records(
+                VULN_INTRO_METADATA,
+                ((item, metadata, path) for item, metadata, path, _ in pending),
+            )
+            manifest.record_many(
+                MANIFEST_STAGE,
+                (
+                    (item, "done", input_hash, path, output_hash)
+                    for (item, _, path, input_hash), output_hash in zip(
+                        pending, output_hashes
+                    )
+                ),
             )
-            cve_processed = True
-
-        if cve_processed:
-            # Create a flag file to indicate that this CVE has been processed
-            with open(processed_flag_file, "w") as f:
-                f.write("")
-
-            patch_info = get_patch_info(patch_content)
-
-            metadata = {
-                "cve_id": cve_dir,
-                "commit_id": patch_file[:-6],
-                "file_changes": patch_info,
-            }
-
-            with open(output_path, "w") as f:
-                json.dump(metadata, f, indent=2)
-
             logging.info(
-                f"Processed and saved metadata for {cve_dir}, commit {patch_file[:-6]}"
+                f"Processed and saved metadata for {len(pending)} commits of {cve_dir}"
             )
             cve_processed = True
 
         if cve_processed:
-            # Create a flag file to indicate that this CVE has been processed
-            with open(processed_flag_file, "w") as f:
-                f.write("")
+            manifest.record(CVE_STAGE, cve_dir, input_hash=upstream.get("output_hash"))
 
 
 if __name__ == "__main__":
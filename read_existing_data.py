@@ -2,6 +2,7 @@ import os
 import json
 import csv
 from constants import COMMIT_METADATA_DIR
+from commit_dataset import COMMIT_METADATA, get_dataset
 
 
 def read_existing_blame_data(blame_output_file):
@@ -15,6 +16,9 @@ def read_existing_blame_data(blame_output_file):
 
 
 def read_existing_metadata(cve_id):
+    metadata = get_dataset(COMMIT_METADATA).get(f"{cve_id}.json")
+    if metadata is not None:
+        return metadata
     json_filename = os.path.join(COMMIT_METADATA_DIR, f"{cve_id}.json")
     if os.path.exists(json_filename):
         with open(json_filename, "r") as f:
@@ -1,6 +1,6 @@
 import os
-import json
 import logging
+from itertools import chain
 from multiprocessing import Pool
 from tqdm import tqdm
 from constants import (
@@ -9,7 +9,11 @@ from constants import (
     VULNERABILITY_INTRO_METADATA_DIR,
     TOKENIZED_BENIGN_COMMITS_DIR,
     TOKENIZED_VULN_INTRO_COMMITS_DIR,
+    DATASET_WRITE_BATCH,
 )
+from stage_manifest import get_manifest
+from commit_dataset import count_records, iter_json_records, record_hash, save_records
+from pool_feed import imap_bounded
 
 # Set up logging
 tokenization_loggingConfig()
@@ -40,60 +44,127 @@ def process_commit(commit_data):
     return processed_commit
 
 
-def process_file(args):
-    input_path, output_path = args
+def is_up_to_date(stage, item, input_hash, input_path, output_path):
+    """Check an item against the manifest, or by mtime if it has no hashes."""
+    row = get_manifest().get_items(stage).get(item)
+    if row and row["status"] != "done":
+        return False  # failed, or marked stale by a code change
+    if row and row["input_hash"]:
+        return row["input_hash"] == input_hash
+    # Items written before the manifest existed
+    return (
+        os.path.exists(output_path)
+        and os.path.exists(input_path)
+        and os.path.getmtime(output_path) > os.path.getmtime(input_path)
+    )
+
 
-    # Check if the output file already exists and is newer than the input file
-    if os.path.exists(output_path) and os.path.getmtime(output_path) > os.path.getmtime(
-        input_path
-    ):
-        logger.info(f"Skipping already processed file: {input_path}")
-        return
+def process_file(args):
+    commit_data, input_hash, output_path, stage, item = args
 
-    logger.info(f"Processing file: {input_path}")
+    logger.info(f"Processing record: {item}")
     try:
-        with open(input_path, "r") as f:
-            commit_data = json.load(f)
+        # The main process saves the results in batches
+        return stage, item, input_hash, output_path, process_commit(commit_data)
+    except Exception as e:
+        logger.error(f"Error processing record {item}: {str(e)}")
+        return None
+
+
+def process_directory(input_dir, output_dir, stage, upstream_stage, pbar=None):
+    """Yield tasks for the records of the upstream dataset not yet tokenized.
+
+    Args:
+        pbar (tqdm): Progress bar advanced for each skipped record
+    """
+    skipped = 0
+    # One sequential scan of the upstream dataset, read as the workers need
+    # it, so records are never all in memory
+    for item, commit_data in iter_json_records(upstream_stage, input_dir):
+        input_hash = record_hash(commit_data)
+        output_path = os.path.join(output_dir, item)
+        if is_up_to_date(
+            stage, item, input_hash, os.path.join(input_dir, item), output_path
+        ):
+            skipped += 1
+            if pbar is not None:
+                pbar.update(1)
+            continue
+        yield commit_data, input_hash, output_path, stage, item
+    logger.info(f"Skipping {skipped} already processed records of {input_dir}")
+
+
+def save_results(results):
+    """Save processed records with one put_many and manifest write per stage."""
+    by_stage = {}
+    for stage, item, input_hash, output_path, processed_data in results:
+        by_stage.setdefault(stage, []).append(
+            (item, input_hash, output_path, processed_data)
+        )
+    manifest = get_manifest()
+    for stage, records in by_stage.items():
+        # Output datasets are named after their stage
+        output_hashes = save_records(
+            stage, ((item, data, path) for item, _, path, data in records)
+        )
+        manifest.record_many(
+            stage,
+            (
+                (item, "done", input_hash, path, output_hash)
+                for (item, input_hash, path, _), output_hash in zip(
+                    records, output_hashes
+                )
+            ),
+        )
+    logger.info(f"Saved {len(results)} processed records")
 
-        processed_data = process_commit(commit_data)
 
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        with open(output_path, "w") as f:
-            json.dump(processed_data, f, indent=2)
+def run_tasks(directories):
+    """Tokenize the records of (input_dir, output_dir, stage, upstream_stage)
+    directories in one pool, reading each upstream dataset lazily."""
+    total = sum(
+        count_records(upstream_stage, input_dir)
+        for input_dir, _, _, upstream_stage in directories
+    )
+    results = []
+    with Pool(2) as p, tqdm(total=total, desc="Processing files") as pbar:
+        tasks = chain.from_iterable(
+            process_directory(*directory, pbar=pbar) for directory in directories
+        )
+        for result in imap_bounded(p, process_file, tasks, window=64):
+            if result is not None:
+                results.append(result)
+            if len(results) >= DATASET_WRITE_BATCH:
+                save_results(results)
+                results = []
+            pbar.update(1)
+    save_results(results)
 
-        logger.info(f"Processed and saved: {output_path}")
-    except Exception as e:
-        logger.error(f"Error processing file {input_path}: {str(e)}")
 
+BENIGN_DIRECTORY = (
+    BENIGN_COMMITS_DIR,
+    TOKENIZED_BENIGN_COMMITS_DIR,
+    "tokenized_benign_commits",
+    "benign_commits",
+)
+VULN_INTRO_DIRECTORY = (
+    VULNERABILITY_INTRO_METADATA_DIR,
+    TOKENIZED_VULN_INTRO_COMMITS_DIR,
+    "tokenized_vuln_intro_commits",
+    "vuln_intro_metadata",
+)
 
-def process_directory(input_dir, output_dir):
-    tasks = []
-    for root, _, files in os.walk(input_dir):
-        for file in files:
-            if file.endswith(".json"):
-                input_path = os.path.join(root, file)
-                relative_path = os.path.relpath(input_path, input_dir)
-                output_path = os.path.join(output_dir, relative_path)
-                tasks.append((input_path, output_path))
-    return tasks
 
+def tokenize_benign_commits():
+    run_tasks([BENIGN_DIRECTORY])
 
-def main():
-    benign_tasks = process_directory(BENIGN_COMMITS_DIR, TOKENIZED_BENIGN_COMMITS_DIR)
-    vuln_tasks = process_directory(
-        VULNERABILITY_INTRO_METADATA_DIR, TOKENIZED_VULN_INTRO_COMMITS_DIR
-    )
 
-    all_tasks = benign_tasks + vuln_tasks
+def tokenize_vuln_intro_commits():
+    run_tasks([VULN_INTRO_DIRECTORY])
 
-    with Pool(2) as p:
-        list(
-            tqdm(
-                p.imap(process_file, all_tasks),
-                total=len(all_tasks),
-                desc="Processing files",
-            )
-        )
+
+def main():
+    run_tasks([BENIGN_DIRECTORY, VULN_INTRO_DIRECTORY])
 
 
 if __name__ == "__main__":
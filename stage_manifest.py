@@ -0,0 +1,172 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from constants import STAGE_MANIFEST_DB
+
+
+def hash_bytes(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def dump_json(path, data):
+    """Write data as indented JSON, like json.dump, and return its hash.
+    The hash is of the exact bytes written, so the stage reading the file
+    gets the same value by hashing what it reads.
+    """
+    content = json.dumps(data, indent=2)
+    with open(path, "w") as f:
+        f.write(content)
+    return hash_bytes(content)
+
+
+class StageManifest:
+    """Resume state of every pipeline stage, one row per (stage, item).
+    Each row records the hash of the item's input, where its output went,
+    the hash of that output and a status. A stage finds its finished items
+    with one query instead of a marker file or stat call per item, and an
+    item is stale when its recorded input hash no longer matches the
+    output hash its upstream stage recorded.
+    """
+
+    def __init__(self, db_file=STAGE_MANIFEST_DB):
+        self._lock = threading.Lock()
+        self._items = {}  # stage -> {item: row}, loaded once per stage
+        self._conn = sqlite3.connect(db_file, timeout=60, check_same_thread=False)
+        # Queue workers on other nodes record their items here too, so use a
+        # rollback journal like the work queue: WAL needs shared memory that
+        # network storage doesn't provide. Set explicitly, as a database
+        # stays in WAL mode once it was opened in it
+        self._conn.execute("PRAGMA journal_mode=DELETE")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS manifest (
+                stage TEXT,
+                item TEXT,
+                input_hash TEXT,
+                output TEXT,
+                output_hash TEXT,
+                status TEXT,
+                updated REAL,
+                PRIMARY KEY (stage, item)
+            )""")
+        self._conn.commit()
+
+    def get_items(self, stage):
+        """Get every recorded item of a stage in one query.
+        Returns:
+            dict: item -> {"input_hash", "output", "output_hash", "status"}
+        """
+        with self._lock:
+            if stage not in self._items:
+                self._items[stage] = {
+                    item: {
+                        "input_hash": input_hash,
+                        "output": output,
+                        "output_hash": output_hash,
+                        "status": status,
+                    }
+                    for item, input_hash, output, output_hash, status in self._conn.execute(
+                        """SELECT item, input_hash, output, output_hash, status
+                        FROM manifest WHERE stage = ?""",
+                        (stage,),
+                    )
+                }
+            return self._items[stage]
+
+    def is_done(self, stage, item, input_hash=None):
+        """Check whether an item finished, for this input if a hash is given."""
+        row = self.get_items(stage).get(item)
+        if row is None or row["status"] != "done":
+            return False
+        return input_hash is None or row["input_hash"] == input_hash
+
+    def record(
+        self,
+        stage,
+        item,
+        status="done",
+        input_hash=None,
+        output=None,
+        output_hash=None,
+    ):
+        self.record_many(stage, [(item, status, input_hash, output, output_hash)])
+
+    def record_many(self, stage, rows):
+        """Record many (item, status, input_hash, output, output_hash) rows."""
+        rows = list(rows)
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO manifest VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (stage, item, input_hash, output, output_hash, status, now)
+                    for item, status, input_hash, output, output_hash in rows
+                ),
+            )
+            self._conn.commit()
+            if stage in self._items:
+                for item, status, input_hash, output, output_hash in rows:
+                    self._items[stage][item] = {
+                        "input_hash": input_hash,
+                        "output": output,
+                        "output_hash": output_hash,
+                        "status": status,
+                    }
+
+    def count_done(self, stage, prefix=""):
+        """Count a stage's finished items whose name starts with prefix."""
+        with self._lock:
+            return self._conn.execute(
+                """SELECT COUNT(*) FROM manifest
+                WHERE stage = ? AND status = 'done' AND substr(item, 1, ?) = ?""",
+                (stage, len(prefix), prefix),
+            ).fetchone()[0]
+
+    def invalidate(self, stage):
+        """Mark every finished item of a stage stale, so it is redone.
+        The rows are kept, so a stage can tell them from items finished
+        before the manifest existed. Returns the number of rows marked.
+        """
+        with self._lock:
+            count = self._conn.execute(
+                "UPDATE manifest SET status = 'stale' WHERE stage = ? AND status = 'done'",
+                (stage,),
+            ).rowcount
+            self._conn.commit()
+            for row in self._items.get(stage, {}).values():
+                if row["status"] == "done":
+                    row["status"] = "stale"
+        return count
+
+    def get_stale(self, stage, upstream_stage):
+        """Get upstream items this stage hasn't processed for their current output.
+        Returns:
+            dict: item -> upstream output hash
+        """
+        with self._lock:
+            return dict(
+                self._conn.execute(
+                    """SELECT u.item, u.output_hash FROM manifest u
+                    LEFT JOIN manifest d ON d.stage = ? AND d.item = u.item
+                    WHERE u.stage = ? AND u.status = 'done' AND (
+                        d.item IS NULL OR d.status != 'done'
+                        OR d.input_hash IS NOT u.output_hash
+                    )""",
+                    (stage, upstream_stage),
+                ).fetchall()
+            )
+
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def get_manifest():
+    global _manifest
+    with _manifest_lock:
+        if _manifest is None:
+            _manifest = StageManifest()
+        return _manifest
@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tokenizer import CodeTokenizer
+
+# One representative diff line per language, keyed by the file type that
+# determine_file_type returns for it
+SAMPLE_LINES = {
+    ".c": "    if (len >= size) return -EINVAL;",
+    ".cpp": "    std::vector<int> values(count, 0);",
+    ".java": "        int index = buffer.indexOf(delimiter, offset);",
+    ".js": "    const result = items.filter((item) => item.id !== id);",
+    ".css": "    margin: 0 auto; padding: 4px 8px;",
+    ".sql": "SELECT id, name FROM users WHERE id = ?;",
+    "text/x-python": "        return self.cache.get(key, default)",
+    "text/plain": "Fix the bounds check in the packet parser",
+}
+
+
+# How long a tokenizer's engines live: rebuilt for every line (as before
+# the session existed), a new CodeTokenizer per file, or one shared session
+MODES = ("per-line", "per-file", "session")
+
+
+def measure(file_type, line, num_files, lines_per_file, mode):
+    """Tokenize num_files files of lines_per_file lines each.
+    Args:
+        mode (str): One of MODES
+    Returns:
+        float: Lines per second
+    """
+    tokenizer = CodeTokenizer()
+    start = time.perf_counter()
+    for _ in range(num_files):
+        if mode == "per-file":
+            tokenizer = CodeTokenizer()
+        for _ in range(lines_per_file):
+            if mode == "per-line":
+                tokenizer.reset_engines()
+            tokenizer.subtokenize(tokenizer.tokenize_code(line, file_type))
+    return num_files * lines_per_file / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark tokenizer throughput per language"
+    )
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--lines-per-file", type=int, default=25)
+    parser.add_argument(
+        "--types", nargs="*", default=list(SAMPLE_LINES), help="File types to run"
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'type':<16}"
+        + "".join(f"{mode + ' lines/s':>20}" for mode in MODES)
+        + f"{'speedup':>10}"
+    )
+    for file_type in args.types:
+        line = SAMPLE_LINES[file_type]
+        rates = [
+            measure(file_type, line, args.files, args.lines_per_file, mode)
+            for mode in MODES
+        ]
+        # Session throughput against rebuilding the engines per line
+        print(
+            f"{file_type:<16}"
+            + "".join(f"{rate:>20.0f}" for rate in rates)
+            + f"{rates[-1] / rates[0]:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,15 +2,134 @@ import mimetypes
 import magic
 import os
 import logging
+from collections import Counter
+from functools import lru_cache
 from constants import tokenization_loggingConfig
 
+# Set up logging
+tokenization_loggingConfig()
+
+# Extensions and lowercased basenames CodeTokenizer has a dedicated
+# tokenizer for, mapped to the language of its tokenize_* method. When
+# mimetypes has no type for them they are returned as the file type, so the
+# tokenizer's own key is used instead of a libmagic guess
+SUFFIX_TOKENIZERS = {
+    ".c": "c",
+    ".h": "cpp",
+    ".cpp": "cpp",
+    ".hpp": "cpp",
+    ".hxx": "cpp",
+    ".hh": "cpp",
+    ".java": "java",
+    ".js": "javascript",
+    ".jsx": "javascript",
+    ".php": "php",
+    ".css": "css",
+    ".xml": "xml",
+    ".sql": "sql",
+    ".yaml": "yaml",
+    ".ini": "ini",
+    ".conf": "ini",
+    ".config": "ini",
+    ".properties": "ini",
+    ".md": "markdown",
+    ".mdown": "markdown",
+    ".mkd": "markdown",
+    ".mkdn": "markdown",
+    ".mdwn": "markdown",
+    ".mdtxt": "markdown",
+    ".mdtext": "markdown",
+    ".text": "markdown",
+    ".Rmd": "markdown",
+    ".rmd": "markdown",
+    ".rst": "markdown",
+    ".rest": "markdown",
+    ".textile": "markdown",
+    ".pod": "markdown",
+    ".txt": "plain_text",
+    "changelog": "plain_text",
+    "readme": "plain_text",
+    "license": "plain_text",
+    "copy": "plain_text",
+    "copying": "plain_text",
+    "copyright": "plain_text",
+}
+TOKENIZER_EXTENSIONS = frozenset(
+    suffix for suffix in SUFFIX_TOKENIZERS if suffix.startswith(".")
+)
+TOKENIZER_BASENAMES = frozenset(SUFFIX_TOKENIZERS) - TOKENIZER_EXTENSIONS
+
+# How often each source answered, per process: "table", "mimetypes", "magic"
+# (a libmagic call), "magic_cached" (a line libmagic already saw) or "empty"
+detection_stats = Counter()
+
 
 def is_text_file(file_content):
     return all(ord(c) < 128 for c in file_content)
 
 
+def get_suffix(file_path):
+    """The part of a path its type depends on: the extension, else the basename."""
+    basename = os.path.basename(file_path)
+    root, extension = os.path.splitext(basename)
+    if extension.lower() in mimetypes.encodings_map:
+        # mimetypes types "x.tar.gz" by the extension under the encoding
+        extension = os.path.splitext(root)[1] + extension
+    return extension or basename
+
+
+@lru_cache(maxsize=None)
+def _init_mimetypes():
+    # Reads the system mime databases, so only once per process
+    mimetypes.init()
+
+
+def lookup_suffix(suffix):
+    """Find the tokenizer key of a suffix in the tables.
+    Returns:
+        str: The file type, or None if no table knows the suffix
+    """
+    if suffix in TOKENIZER_EXTENSIONS:
+        return suffix
+    if suffix.lower() in TOKENIZER_BASENAMES:
+        return suffix.lower()
+    return None
+
+
+@lru_cache(maxsize=4096)
+def resolve_suffix(suffix):
+    """Get the type of a suffix from mimetypes, else the suffix table.
+    Returns:
+        tuple: (source, file type), source being "mimetypes" or "table";
+        (None, None) if neither knows the suffix
+    """
+    _init_mimetypes()
+    # mimetypes only looks at the extension of a path
+    mime_type, _ = mimetypes.guess_type(
+        f"file{suffix}" if suffix.startswith(".") else suffix
+    )
+    if mime_type:
+        return "mimetypes", mime_type
+
+    file_type = lookup_suffix(suffix)
+    if file_type:
+        return "table", file_type
+    return None, None
+
+
+@lru_cache(maxsize=4096)
+def _magic_from_line(content_line):
+    file_type = magic.from_buffer(content_line.encode(), mime=True)
+
+    if file_type.startswith("text/") and is_text_file(content_line):
+        return "text/plain"
+
+    return (
+        file_type if file_type else "application/octet-stream"
+    )  # Default to binary if type couldn't be determined
+
+
 def determine_file_type_using_python_magic(file_path, file_content):
-    tokenization_loggingConfig()
     logger = logging.getLogger(__name__)
 
     logger.info(f"Using python-magic to determine the type of {file_path}")
@@ -18,6 +137,7 @@ def determine_file_type_using_python_magic(file_path, file_content):
     try:
         if not file_content["added_lines"] and not file_content["removed_lines"]:
             logger.warning(f"File {file_path} appears to be empty")
+            detection_stats["empty"] += 1
             return "text/plain"  # Default to plain text for empty files
 
         # Try to use the first non-empty line from added_lines or removed_lines
@@ -32,16 +152,17 @@ def determine_file_type_using_python_magic(file_path, file_content):
 
         if not content_line:
             logger.warning(f"No non-empty lines found in {file_path}")
+            detection_stats["empty"] += 1
             return "text/plain"  # Default to plain text if no non-empty lines
 
-        file_type = magic.from_buffer(content_line.encode(), mime=True)
-
-        if file_type.startswith("text/") and is_text_file(content_line):
-            return "text/plain"
-
-        return (
-            file_type if file_type else "application/octet-stream"
-        )  # Default to binary if type couldn't be determined
+        # Files often start with the same line (license headers, includes)
+        hits = _magic_from_line.cache_info().hits
+        file_type = _magic_from_line(content_line)
+        if _magic_from_line.cache_info().hits > hits:
+            detection_stats["magic_cached"] += 1
+        else:
+            detection_stats["magic"] += 1
+        return file_type
 
     except Exception as e:
         logger.error(f"Error determining file type for {file_path}: {str(e)}")
@@ -49,19 +170,21 @@ def determine_file_type_using_python_magic(file_path, file_content):
 
 
 def determine_file_type(file_path, file_content):
-    tokenization_loggingConfig()
+    """Get a file's type from mimetypes, the suffix table, or its content.
+    mimetypes answers first, as it did before the table existed, so files
+    it knows keep their type and tokenizer across runs; the table only
+    replaces libmagic for suffixes mimetypes has no type for. Both depend
+    only on the suffix, so the decision is memoized per suffix.
+    """
+    source, file_type = resolve_suffix(get_suffix(file_path))
+    if source:
+        detection_stats[source] += 1
+        return file_type
 
-    # Initialize mimetypes
-    mimetypes.init()
-
-    # Get the file extension
-    _, extension = os.path.splitext(file_path)
+    return determine_file_type_using_python_magic(file_path, file_content)
 
-    # Use mimetypes to guess the type
-    mime_type, _ = mimetypes.guess_type(file_path)
 
-    if mime_type:
-        logging.info(f"Using mimetypes to determine the type of {file_path}")
-        return mime_type
-
-    return determine_file_type_using_python_magic(file_path, file_content)
+def get_detection_stats():
+    """Get per-source hit counts plus the suffix memo's cache statistics."""
+    info = resolve_suffix.cache_info()
+    return dict(detection_stats, memo_hits=info.hits, memo_misses=info.misses)
@@ -1,6 +1,9 @@
 import os
 import json
 import logging
+import argparse
+from collections import Counter
+from multiprocessing import Pool
 from typing import Dict, Any
 from tqdm import tqdm
 from constants import (
@@ -9,10 +12,43 @@ from constants import (
     VULNERABILITY_INTRO_METADATA_DIR,
     TOKENIZED_BENIGN_COMMITS_DIR,
     TOKENIZED_VULN_INTRO_COMMITS_DIR,
+    TOKENIZER_WORKERS,
+    TOKENIZER_CHUNKSIZE,
+    DATASET_WRITE_BATCH,
 )
-from file_type_detector import determine_file_type
-from tokenizer import tokenize_file
+from file_type_detector import determine_file_type, get_detection_stats
+from tokenizer import get_tokenizer
 from ensure_directories import ensure_dirs
+from stage_manifest import get_manifest
+from pool_feed import imap_bounded
+from commit_dataset import (
+    BENIGN_COMMITS,
+    VULN_INTRO_METADATA,
+    TOKENIZED_BENIGN_COMMITS,
+    TOKENIZED_VULN_INTRO_COMMITS,
+    count_records,
+    get_dataset_keys,
+    iter_json_records,
+    record_hash,
+    save_records,
+)
+
+
+def init_worker():
+    """Set up a worker's tokenizer session once, before its first task."""
+    tokenization_loggingConfig()
+    get_tokenizer()
+
+
+def tokenize_task(task):
+    item, commit_data, input_hash = task
+    try:
+        tokenized_data = get_tokenizer().tokenize_commit(commit_data)
+    except Exception as e:
+        logging.getLogger(__name__).error(f"Error tokenizing {item}: {str(e)}")
+        tokenized_data = None
+    # Detection stats are cumulative per process; the latest ones win
+    return item, input_hash, tokenized_data, os.getpid(), get_detection_stats()
 
 
 class CommitProcessor:
@@ -54,38 +90,120 @@ class CommitProcessor:
 
         return results
 
-    def tokenize_commits(self, input_dir: str, output_dir: str, commit_type: str):
+    def tokenize_commits(
+        self,
+        input_dir: str,
+        output_dir: str,
+        commit_type: str,
+        num_workers: int = TOKENIZER_WORKERS,
+        chunksize: int = TOKENIZER_CHUNKSIZE,
+        upstream_dataset: str = VULN_INTRO_METADATA,
+        dataset: str = TOKENIZED_VULN_INTRO_COMMITS,
+    ):
+        """Tokenize the commits of a dataset whose input changed since their
+        output was written, or that have no output yet.
+        Args:
+            input_dir (str): Directory of JSON files upstream_dataset replaces
+            output_dir (str): Directory of JSON files dataset replaces
+            num_workers (int): Worker processes, each with its own tokenizer
+                session; 1 tokenizes in this process
+            chunksize (int): Commits handed to a worker at a time
+            upstream_dataset (str): Dataset of the commits to tokenize
+            dataset (str): Dataset, and manifest stage, of the output
+        """
         self.logger.info(f"Tokenizing {commit_type} commits")
         try:
-            input_files = []
-            for root, _, files in os.walk(input_dir):
-                for file in files:
-                    if file.endswith(".json"):
-                        input_files.append(os.path.join(root, file))
-
-            total_files = len(input_files)
+            recorded = get_manifest().get_items(dataset)
+            # Outputs written before their input hash was recorded
+            legacy_done = set(get_dataset_keys(dataset, output_dir))
+            total_files = count_records(upstream_dataset, input_dir)
+            pbar = tqdm(total=total_files, desc=f"Tokenizing {commit_type} commits")
+
+            def iter_tasks():
+                # One sequential scan of the upstream dataset, read as the
+                # workers need it, so records are never all in memory
+                for item, commit_data in iter_json_records(upstream_dataset, input_dir):
+                    input_hash = record_hash(commit_data)
+                    row = recorded.get(item)
+                    if row and row["status"] != "done":
+                        up_to_date = False  # failed, or marked stale
+                    elif row and row["input_hash"]:
+                        up_to_date = row["input_hash"] == input_hash
+                    else:
+                        up_to_date = item in legacy_done
+                    if up_to_date:
+                        self.logger.info(f"Skipping already processed commit: {item}")
+                        pbar.update(1)
+                        continue
+                    yield item, commit_data, input_hash
+
+            pending = []  # (item, input hash, tokenized data)
             processed_files = 0
 
-            with tqdm(
-                total=total_files, desc=f"Tokenizing {commit_type} commits"
-            ) as pbar:
-                for input_path in input_files:
-                    relative_path = os.path.relpath(input_path, input_dir)
-                    output_path = os.path.join(output_dir, relative_path)
-
-                    # Create output directory if it doesn't exist
-                    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-
-                    # Check if the output file already exists
-                    if not os.path.exists(output_path):
-                        tokenize_file(input_path, output_path)
-                        processed_files += 1
-                    else:
-                        self.logger.info(
-                            f"Skipping already processed file: {relative_path}"
+            def save_pending():
+                output_hashes = save_records(
+                    dataset,
+                    (
+                        (item, data, os.path.join(output_dir, item))
+                        for item, _, data in pending
+                    ),
+                )
+                get_manifest().record_many(
+                    dataset,
+                    (
+                        (
+                            item,
+                            "done",
+                            input_hash,
+                            os.path.join(output_dir, item),
+                            output_hash,
                         )
-
-                    pbar.update(1)
+                        for (item, input_hash, _), output_hash in zip(
+                            pending, output_hashes
+                        )
+                    ),
+                )
+                pending.clear()
+
+            def collect(item, input_hash, tokenized_data):
+                nonlocal processed_files
+                processed_files += 1
+                if tokenized_data is not None:
+                    pending.append((item, input_hash, tokenized_data))
+                if len(pending) >= DATASET_WRITE_BATCH:
+                    save_pending()
+                pbar.update(1)
+
+            with pbar:
+                if num_workers <= 1:
+                    before = Counter(get_detection_stats())
+                    for task in iter_tasks():
+                        item, input_hash, tokenized_data, _, _ = tokenize_task(task)
+                        collect(item, input_hash, tokenized_data)
+                    detection_stats = Counter(get_detection_stats()) - before
+                else:
+                    stats_by_worker = {}
+                    with Pool(num_workers, initializer=init_worker) as pool:
+                        # Results come in task order, so progress and the
+                        # log follow the dataset
+                        results = imap_bounded(
+                            pool,
+                            tokenize_task,
+                            iter_tasks(),
+                            chunksize,
+                            window=2 * num_workers * chunksize,
+                        )
+                        for item, input_hash, tokenized_data, pid, stats in results:
+                            collect(item, input_hash, tokenized_data)
+                            stats_by_worker[pid] = stats
+                    detection_stats = sum(
+                        (Counter(stats) for stats in stats_by_worker.values()),
+                        Counter(),
+                    )
+                save_pending()
+            self.logger.info(
+                f"File type detection for {commit_type} commits: {dict(detection_stats)}"
+            )
 
             self.logger.info(
                 f"Successfully tokenized {processed_files} out of {total_files} {commit_type} commits"
@@ -93,25 +211,40 @@ class CommitProcessor:
         except Exception as e:
             self.logger.error(f"Error tokenizing {commit_type} commits: {str(e)}")
 
-    def run(self):
+    def run(self, num_workers: int = TOKENIZER_WORKERS):
         self.logger.info("Starting commit processing")
 
         self.tokenize_commits(
             VULNERABILITY_INTRO_METADATA_DIR,
             TOKENIZED_VULN_INTRO_COMMITS_DIR,
             "vulnerability-introducing",
+            num_workers,
         )
 
         self.tokenize_commits(
-            BENIGN_COMMITS_DIR, TOKENIZED_BENIGN_COMMITS_DIR, "benign"
+            BENIGN_COMMITS_DIR,
+            TOKENIZED_BENIGN_COMMITS_DIR,
+            "benign",
+            num_workers,
+            upstream_dataset=BENIGN_COMMITS,
+            dataset=TOKENIZED_BENIGN_COMMITS,
         )
 
         self.logger.info("Commit processing completed")
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Tokenize vuln and benign commits")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=TOKENIZER_WORKERS,
+        help="Worker processes (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
     processor = CommitProcessor()
-    processor.run()
+    processor.run(args.workers)
 
 
 if __name__ == "__main__":
@@ -4,9 +4,11 @@ import re
 import json
 import os
 import logging
-from typing import Dict, List, Any
-from constants import tokenization_loggingConfig
-from file_type_detector import determine_file_type
+from bisect import bisect_right
+from functools import partial
+from typing import Dict, List, Any, Iterable, Tuple
+from constants import tokenization_loggingConfig, TOKENIZER_BATCH_LINES
+from file_type_detector import SUFFIX_TOKENIZERS, determine_file_type
 from tokenize_rt import src_to_tokens
 from pygments import lex
 from pygments.lexers import get_lexer_by_name, guess_lexer, get_lexer_for_mimetype
@@ -26,9 +28,17 @@ from markdown import markdown  # For Markdown
 
 
 class CodeTokenizer:
-    def __init__(self):
+    """Tokenizer session; reuse one instance across all files of a run.
+    Parser engines (the clang index, pygments lexers, the C parser) are
+    created on first use and kept, instead of rebuilt for every line.
+    """
+
+    def __init__(self, batch_lines: bool = TOKENIZER_BATCH_LINES):
         self.logger = self._setup_logger()
         self.tokenizers = self._setup_tokenizers()
+        self.line_tokenizers = self._setup_line_tokenizers()
+        self.batch_lines = batch_lines
+        self.reset_engines()
 
     def _setup_logger(self) -> logging.Logger:
         tokenization_loggingConfig()
@@ -37,77 +47,88 @@ class CodeTokenizer:
         return logger
 
     def _setup_tokenizers(self) -> Dict[str, Any]:
-        return {
+        tokenizers = {
             "text/x-c++src": self.tokenize_cpp,
             "text/x-c++hdr": self.tokenize_cpp,
             "c++": self.tokenize_cpp,
-            ".cpp": self.tokenize_cpp,
-            ".hpp": self.tokenize_cpp,
-            ".hxx": self.tokenize_cpp,
-            ".hh": self.tokenize_cpp,
             "text/xml": self.tokenize_xml,
             "xml": self.tokenize_xml,
-            ".xml": self.tokenize_xml,
             "text/css": self.tokenize_css,
             "css": self.tokenize_css,
-            ".css": self.tokenize_css,
             "text/x-sql": self.tokenize_sql,
             "sql": self.tokenize_sql,
-            ".sql": self.tokenize_sql,
             "text/yaml": self.tokenize_yaml,
             "yaml": self.tokenize_yaml,
-            ".yaml": self.tokenize_yaml,
             "text/x-ini": self.tokenize_ini,
             "ini": self.tokenize_ini,
-            ".ini": self.tokenize_ini,
             "text/markdown": self.tokenize_markdown,
             "markdown": self.tokenize_markdown,
-            ".md": self.tokenize_markdown,
             "text/x-csrc": self.tokenize_c,
             "c": self.tokenize_c,
-            ".c": self.tokenize_c,
             "text/x-php": self.tokenize_php,
             "php": self.tokenize_php,
-            ".php": self.tokenize_php,
             "text/x-java": self.tokenize_java,
             "java": self.tokenize_java,
-            ".java": self.tokenize_java,
             "text/javascript": self.tokenize_javascript,
             "javascript": self.tokenize_javascript,
-            ".js": self.tokenize_javascript,
-            ".h": self.tokenize_cpp,
-            "changelog": self.tokenize_plain_text,
-            "readme": self.tokenize_plain_text,
-            "license": self.tokenize_plain_text,
-            "copy": self.tokenize_plain_text,
-            "copying": self.tokenize_plain_text,
-            "copyright": self.tokenize_plain_text,
-            ".jsx": self.tokenize_javascript,
-            ".conf": self.tokenize_ini,
-            ".properties": self.tokenize_ini,
-            ".config": self.tokenize_ini,
-            ".mdown": self.tokenize_markdown,
-            ".mkd": self.tokenize_markdown,
-            ".mkdn": self.tokenize_markdown,
-            ".mdwn": self.tokenize_markdown,
-            ".mdtxt": self.tokenize_markdown,
-            ".mdtext": self.tokenize_markdown,
-            ".text": self.tokenize_markdown,
-            ".Rmd": self.tokenize_markdown,
-            ".rmd": self.tokenize_markdown,
-            ".rst": self.tokenize_markdown,
-            ".rest": self.tokenize_markdown,
-            ".txt": self.tokenize_markdown,
-            ".textile": self.tokenize_markdown,
-            ".pod": self.tokenize_markdown,
             "text/plain": self.tokenize_plain_text,
             "text": self.tokenize_plain_text,
-            ".txt": self.tokenize_plain_text,
+        }
+        # Suffix keys come from the detector's table, so every suffix it
+        # returns has a tokenizer
+        for suffix, language in SUFFIX_TOKENIZERS.items():
+            tokenizers[suffix] = getattr(self, f"tokenize_{language}")
+        return tokenizers
+
+    def reset_engines(self):
+        """Drop the cached parser engines; the next use creates them again."""
+        self._clang_index = None
+        self._c_parser = None
+        self._lexers = {}  # (kind, name) -> lexer, or None if not found
+
+    def get_clang_index(self) -> Index:
+        if self._clang_index is None:
+            self._clang_index = Index.create()
+        return self._clang_index
+
+    def get_c_parser(self) -> c_parser.CParser:
+        # CParser resets its state on every parse, so one instance is enough
+        if self._c_parser is None:
+            self._c_parser = c_parser.CParser()
+        return self._c_parser
+
+    def get_lexer(self, name: str):
+        """Get a cached pygments lexer by name; raises ClassNotFound."""
+        key = ("name", name)
+        if key not in self._lexers:
+            self._lexers[key] = get_lexer_by_name(name, stripall=True)
+        return self._lexers[key]
+
+    def _setup_line_tokenizers(self) -> Dict[Any, Any]:
+        """Engines that can tokenize many lines at once and report each
+        token's line, keyed by the per-line tokenizer they stand in for.
+        Each takes the joined code and returns (line index, token) pairs.
+        """
+        return {
+            self.tokenize_cpp: lambda code: self._lex_clang(
+                code, "tmp.cpp", ["-std=c++11"]
+            ),
+            # pycparser can't parse a fragment nor report token offsets, so
+            # C goes through the clang lexer too
+            self.tokenize_c: lambda code: self._lex_clang(code, "tmp.c", ["-x", "c"]),
+            self.tokenize_java: self._lex_java,
+            self.tokenize_css: lambda code: self._lex_pygments(
+                self.get_lexer("css"), code
+            ),
+            self.tokenize_javascript: lambda code: self._lex_pygments(
+                self.get_lexer("javascript"), code
+            ),
+            self.tokenize_plain_text: self._lex_plain_text,
         }
 
     def tokenize_cpp(self, code: str) -> List[str]:
         try:
-            index = Index.create()
+            index = self.get_clang_index()
             tu = index.parse(
                 "tmp.cpp", args=["-std=c++11"], unsaved_files=[("tmp.cpp", code)]
             )
@@ -125,7 +146,7 @@ class CodeTokenizer:
 
     def tokenize_css(self, code: str) -> List[str]:
         try:
-            lexer = get_lexer_by_name("css", stripall=True)
+            lexer = self.get_lexer("css")
             return [token[1] for token in lex(code, lexer)]
         except Exception as e:
             self.logger.error(f"Error tokenizing CSS code: {str(e)}")
@@ -163,7 +184,7 @@ class CodeTokenizer:
 
     def tokenize_c(self, code: str) -> List[str]:
         try:
-            parser = c_parser.CParser()
+            parser = self.get_c_parser()
             return [token for _, token in parser.parse(code).children()]
         except Exception as e:
             self.logger.error(f"Error tokenizing C code: {str(e)}")
@@ -185,7 +206,7 @@ class CodeTokenizer:
 
     def tokenize_javascript(self, code: str) -> List[str]:
         try:
-            lexer = get_lexer_by_name("javascript", stripall=True)
+            lexer = self.get_lexer("javascript")
             return [token[1] for token in lex(code, lexer)]
         except Exception as e:
             self.logger.error(f"Error tokenizing JavaScript code: {str(e)}")
@@ -195,16 +216,21 @@ class CodeTokenizer:
         return re.findall(r"\w+|[^\w\s]", code)
 
     def get_pygments_lexer(self, file_type: str, code: str):
-        try:
-            return get_lexer_by_name(file_type, stripall=True)
-        except ClassNotFound:
+        # Lookups by name and mimetype are cached, misses included, so only
+        # guess_lexer, which depends on the code, runs more than once per type
+        key = ("type", file_type)
+        if key not in self._lexers:
             try:
-                return get_lexer_for_mimetype(file_type, stripall=True)
+                self._lexers[key] = get_lexer_by_name(file_type, stripall=True)
             except ClassNotFound:
-                self.logger.warning(
-                    f"Could not find lexer for {file_type}, guessing lexer."
-                )
-                return guess_lexer(code)
+                try:
+                    self._lexers[key] = get_lexer_for_mimetype(file_type, stripall=True)
+                except ClassNotFound:
+                    self._lexers[key] = None
+        if self._lexers[key] is not None:
+            return self._lexers[key]
+        self.logger.warning(f"Could not find lexer for {file_type}, guessing lexer.")
+        return guess_lexer(code)
 
     def tokenize_code(self, code: str, file_type: str) -> List[str]:
         self.logger.info(f"Tokenizing code of type: {file_type}")
@@ -219,6 +245,102 @@ class CodeTokenizer:
             self.logger.error(f"First 100 characters of problematic code: {code[:100]}")
             return self.fallback_tokenize(code)
 
+    def _lex_clang(
+        self, code: str, filename: str, args: List[str]
+    ) -> List[Tuple[int, str]]:
+        tu = self.get_clang_index().parse(
+            filename, args=args, unsaved_files=[(filename, code)]
+        )
+        return [
+            (token.location.line - 1, token.spelling)
+            for token in tu.get_tokens(extent=tu.cursor.extent)
+        ]
+
+    def _lex_java(self, code: str) -> List[Tuple[int, str]]:
+        return [(token.position[0] - 1, token.value) for token in java_tokenize(code)]
+
+    def _lex_pygments(self, lexer, code: str) -> Iterable[Tuple[int, str]]:
+        # get_tokens_unprocessed skips stripall and tab expansion, so the
+        # offsets it reports are offsets into code itself
+        line_starts = [0]
+        for match in re.finditer("\n", code):
+            line_starts.append(match.end())
+        return (
+            (bisect_right(line_starts, offset) - 1, value)
+            for offset, _, value in lexer.get_tokens_unprocessed(code)
+        )
+
+    def _lex_plain_text(self, code: str) -> Iterable[Tuple[int, str]]:
+        return (
+            (i, token)
+            for i, line in enumerate(code.split("\n"))
+            for token in self.tokenize_plain_text(line)
+        )
+
+    def _split_by_line(
+        self, line_tokens: Iterable[Tuple[int, str]], num_lines: int
+    ) -> Tuple[List[List[str]], set]:
+        """Split (line index, token) pairs into the tokens of each line.
+        Returns:
+            tuple: (tokens of each line, indexes of the lines that a token
+            starting on an earlier line has non-whitespace text on)
+        """
+        tokens_by_line = [[] for _ in range(num_lines)]
+        swallowed = set()
+        for line, token in line_tokens:
+            # Tokens spanning lines, like block comments, are split so
+            # each line keeps its own part
+            for i, part in enumerate(token.split("\n")):
+                if not part or not 0 <= line + i < num_lines:
+                    continue
+                tokens_by_line[line + i].append(part)
+                if i and part.strip():
+                    swallowed.add(line + i)
+        return tokens_by_line, swallowed
+
+    def tokenize_lines(self, lines: List[str], file_type: str) -> List[List[str]]:
+        """Tokenize lines in one call and split the tokens back per line.
+        The lines are joined into one block, so a parser sees them together
+        instead of failing on every fragment. Types without a line-aware
+        engine are tokenized line by line.
+        Returns:
+            list: The tokens of each line, in the order of lines
+        """
+        if not lines:
+            return []
+        tokenizer = self.tokenizers.get(file_type)
+        if tokenizer is not None and tokenizer not in self.line_tokenizers:
+            return [self.tokenize_code(line, file_type) for line in lines]
+
+        code = "\n".join(lines)
+        self.logger.info(f"Tokenizing {len(lines)} lines of type: {file_type}")
+        try:
+            if tokenizer is not None:
+                lex = self.line_tokenizers[tokenizer]
+            else:
+                lexer = self.get_pygments_lexer(file_type, code)
+                lex = partial(self._lex_pygments, lexer)
+            tokens_by_line, swallowed = self._split_by_line(lex(code), len(lines))
+        except Exception as e:
+            self.logger.error(
+                f"Error tokenizing {len(lines)} lines of type {file_type}: {str(e)}"
+            )
+            return [self.tokenize_plain_text(line) for line in lines]
+
+        # The lines come from separate hunks, so text a token carries into
+        # a later line may be an unterminated string or comment that
+        # swallowed it, and clang emits nothing for a line inside a
+        # comment. Such lines are lexed alone by the same engine; a
+        # comment-only line then rightly stays without tokens.
+        for i, line in enumerate(lines):
+            if i in swallowed or (line.strip() and not tokens_by_line[i]):
+                try:
+                    tokens_by_line[i] = self._split_by_line(lex(line), 1)[0][0]
+                except Exception as e:
+                    self.logger.error(f"Error tokenizing line alone: {str(e)}")
+                    tokens_by_line[i] = self.tokenize_plain_text(line)
+        return tokens_by_line
+
     def subtokenize(self, tokens: List[str]) -> List[str]:
         subtokens = []
         for token in tokens:
@@ -234,6 +356,17 @@ class CodeTokenizer:
         for file_path, changes in file_changes.items():
             try:
                 file_type = determine_file_type(file_path, changes)
+                if self.batch_lines:
+                    tokenized_changes[file_path] = {
+                        key: [
+                            self.subtokenize(tokens)
+                            for tokens in self.tokenize_lines(
+                                changes.get(key, []), file_type
+                            )
+                        ]
+                        for key in ("added_lines", "removed_lines")
+                    }
+                    continue
                 tokenized_changes[file_path] = {
                     "added_lines": [
                         self.subtokenize(self.tokenize_code(line, file_type))
@@ -274,8 +407,12 @@ class CodeTokenizer:
 
             tokenized_data = self.tokenize_commit(commit_data)
 
-            with open(output_path, "w") as f:
+            # Write then rename, so a killed worker never leaves a partial
+            # file that a rerun would skip as done
+            temp_path = f"{output_path}.tmp"
+            with open(temp_path, "w") as f:
                 json.dump(tokenized_data, f, indent=2)
+            os.replace(temp_path, output_path)
 
             self.logger.info(f"Tokenized and saved: {output_path}")
         except json.JSONDecodeError as e:
@@ -301,11 +438,20 @@ class CodeTokenizer:
                     self.tokenize_file(input_path, output_path)
 
 
+_tokenizer = None
+
+
+def get_tokenizer() -> CodeTokenizer:
+    """Get the process-wide tokenizer session, creating it on first use."""
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = CodeTokenizer()
+    return _tokenizer
+
+
 def tokenize_file(input_path: str, output_path: str):
-    tokenizer = CodeTokenizer()
-    tokenizer.tokenize_file(input_path, output_path)
+    get_tokenizer().tokenize_file(input_path, output_path)
 
 
 def tokenize_directory(input_dir: str, output_dir: str):
-    tokenizer = CodeTokenizer()
-    tokenizer.tokenize_directory(input_dir, output_dir)
+    get_tokenizer().tokenize_directory(input_dir, output_dir)
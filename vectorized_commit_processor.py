@@ -10,6 +10,7 @@ from constants import (
     PADDED_BENIGN_COMMITS_DIR,
 )
 from ensure_directories import ensure_dirs
+from stage_manifest import get_manifest, dump_json
 
 
 def read_json_file(file_path: str) -> Dict:
@@ -47,15 +48,25 @@ def process_file_changes(
     return processed_changes
 
 
-def process_json_file(
-    input_file: str, output_file: str, threshold: int, pad_vector: List[float]
-):
-    # Check if output file already exists and is up to date
-    if os.path.exists(output_file) and os.path.getmtime(
+def is_up_to_date(
+    stage: str, upstream_stage: str, item: str, input_file: str, output_file: str
+) -> bool:
+    manifest = get_manifest()
+    row = manifest.get_items(stage).get(item)
+    upstream = manifest.get_items(upstream_stage).get(item)
+    if row and row["status"] != "done":
+        return False  # failed, or marked stale by a code change
+    if upstream and upstream["output_hash"] and row and row["status"] == "done":
+        return row["input_hash"] == upstream["output_hash"]
+    # Files written before the manifest existed
+    return os.path.exists(output_file) and os.path.getmtime(
         output_file
-    ) >= os.path.getmtime(input_file):
-        return  # Skip processing if output is up to date
+    ) >= os.path.getmtime(input_file)
+
 
+def process_json_file(
+    input_file: str, output_file: str, threshold: int, pad_vector: List[float]
+) -> str:
     data = read_json_file(input_file)
     processed_data = {}
 
@@ -66,13 +77,15 @@ def process_json_file(
     while len(processed_data) < threshold:
         processed_data[f"pad_{len(processed_data)}"] = pad_vector
 
-    write_json_file(output_file, processed_data)
+    return dump_json(output_file, processed_data)
 
 
 def process_folder(
     input_folder: str, output_folder: str, threshold: int, pad_vector: List[float]
 ):
     os.makedirs(output_folder, exist_ok=True)
+    stage = os.path.basename(output_folder)
+    upstream_stage = os.path.basename(input_folder)
     files_to_process = []
 
     for root, _, files in os.walk(input_folder):
@@ -81,14 +94,26 @@ def process_folder(
                 input_file = os.path.join(root, filename)
                 relative_path = os.path.relpath(root, input_folder)
                 output_subdir = os.path.join(output_folder, relative_path)
-                os.makedirs(output_subdir, exist_ok=True)
                 output_file = os.path.join(output_subdir, filename)
-                files_to_process.append((input_file, output_file))
+                item = os.path.relpath(input_file, input_folder)
+                if is_up_to_date(stage, upstream_stage, item, input_file, output_file):
+                    continue  # Skip processing if output is up to date
+                os.makedirs(output_subdir, exist_ok=True)
+                files_to_process.append((input_file, output_file, item))
 
-    for input_file, output_file in tqdm(
+    manifest = get_manifest()
+    upstream_items = manifest.get_items(upstream_stage)
+    for input_file, output_file, item in tqdm(
         files_to_process, desc=f"Processing {input_folder}"
     ):
-        process_json_file(input_file, output_file, threshold, pad_vector)
+        output_hash = process_json_file(input_file, output_file, threshold, pad_vector)
+        manifest.record(
+            stage,
+            item,
+            input_hash=upstream_items.get(item, {}).get("output_hash"),
+            output=output_file,
+            output_hash=output_hash,
+        )
 
 
 def get_vector_dim(directory: str) -> int:
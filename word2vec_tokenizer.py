@@ -11,17 +11,34 @@ from constants import (
 )
 from constants import tokenization_loggingConfig
 from ensure_directories import ensure_dirs
+from stage_manifest import get_manifest, dump_json
+from commit_dataset import (
+    TOKENIZED_BENIGN_COMMITS,
+    TOKENIZED_VULN_INTRO_COMMITS,
+    get_dataset,
+    get_dataset_keys,
+)
 
 # Set up logging
 tokenization_loggingConfig()
 logger = logging.getLogger(__name__)
 
+# Tokenized commits are read from their datasets; a path names the record
+# of the dataset that replaced its directory
+TOKENIZED_DATASETS = {
+    TOKENIZED_BENIGN_COMMITS_DIR: TOKENIZED_BENIGN_COMMITS,
+    TOKENIZED_VULN_INTRO_COMMITS_DIR: TOKENIZED_VULN_INTRO_COMMITS,
+}
+
 
 def get_random_json_files(directory, num_files=10000):
-    all_json_files = []
-    for root, dirs, files in os.walk(directory):
-        json_files = [os.path.join(root, f) for f in files if f.endswith(".json")]
-        all_json_files.append(json_files)
+    # Group the dataset's keys by subfolder, as the walk did
+    by_subfolder = {}
+    for key in get_dataset_keys(TOKENIZED_DATASETS[directory], directory):
+        by_subfolder.setdefault(os.path.dirname(key), []).append(
+            os.path.join(directory, key)
+        )
+    all_json_files = list(by_subfolder.values())
 
     total_files = sum(len(files) for files in all_json_files)
     if total_files <= num_files:
@@ -47,10 +64,20 @@ def save_selected_files(files, output_file):
     logger.info(f"Selected files list saved to {output_file}")
 
 
+def load_record(file_path):
+    """Read the record a path names from its dataset, else from the file."""
+    for directory, name in TOKENIZED_DATASETS.items():
+        if file_path.startswith(directory + os.sep):
+            data = get_dataset(name).get(os.path.relpath(file_path, directory))
+            if data is not None:
+                return data
+    with open(file_path, "r") as f:
+        return json.load(f)
+
+
 def load_tokens_from_json(file_path):
     try:
-        with open(file_path, "r") as f:
-            data = json.load(f)
+        data = load_record(file_path)
 
         tokens = []
         if "file_changes" in data:
@@ -110,6 +137,7 @@ def load_model(file_path):
 
 def process_files(input_files, output_dir, model):
     file_count = len(input_files)
+    manifest = get_manifest()
     processed = 0
     errors = 0
 
@@ -123,8 +151,14 @@ def process_files(input_files, output_dir, model):
             tokens = load_tokens_from_json(input_file)
             vector_dict = tokens_to_vectors(model, tokens)
 
-            with open(output_file, "w") as f:
-                json.dump(vector_dict, f, indent=2)
+            output_hash = dump_json(output_file, vector_dict)
+            # Recorded so the padding stage can tell which vectors changed
+            manifest.record(
+                os.path.basename(output_dir),
+                relative_path,
+                output=output_file,
+                output_hash=output_hash,
+            )
 
             processed += 1
             if processed % 100 == 0:
@@ -0,0 +1,327 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import threading
+from typing import NamedTuple, Optional
+
+from constants import WORK_QUEUE_DB, WORK_LEASE_SECONDS, WORK_MAX_ATTEMPTS
+
+
+class Job(NamedTuple):
+    id: int
+    kind: str  # e.g. "cve", "repo" or "commit"
+    item: str
+    payload: Optional[dict]
+    attempts: int
+
+
+def get_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue:
+    """Persistent job queue that any number of worker processes can pull from.
+    Workers lease jobs for lease_seconds and extend the lease with
+    heartbeats while they work. A job whose lease runs out (its worker
+    died) is handed to the next worker; after max_attempts it is moved to
+    the dead-letter table instead. The database uses a rollback journal
+    rather than WAL so it also works on shared network storage.
+    """
+
+    def __init__(
+        self,
+        db_file=WORK_QUEUE_DB,
+        lease_seconds=WORK_LEASE_SECONDS,
+        max_attempts=WORK_MAX_ATTEMPTS,
+    ):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            db_file, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                kind TEXT,
+                item TEXT,
+                payload TEXT,
+                status TEXT,
+                attempts INTEGER DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires REAL,
+                last_error TEXT,
+                updated REAL,
+                UNIQUE (kind, item)
+            )""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS dead_letter (
+                job_id INTEGER PRIMARY KEY,
+                kind TEXT,
+                item TEXT,
+                payload TEXT,
+                attempts INTEGER,
+                last_error TEXT,
+                failed_at REAL
+            )""")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (kind, status, id)"
+        )
+
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can
+        # never lease the same job
+        self._conn.execute("BEGIN IMMEDIATE")
+
+    def enqueue(self, kind, items, payloads=None):
+        """Add jobs; items already in the queue, in any state, are ignored.
+        Args:
+            kind (str): Job kind
+            items (iterable): Job items, unique per kind
+            payloads (dict): Optional item -> JSON-serializable payload
+        Returns:
+            int: Number of jobs added
+        """
+        payloads = payloads or {}
+        now = time.time()
+        with self._lock:
+            self._transaction()
+            try:
+                before = self._conn.total_changes
+                self._conn.executemany(
+                    """INSERT OR IGNORE INTO jobs (kind, item, payload, status, updated)
+                    VALUES (?, ?, ?, 'pending', ?)""",
+                    (
+                        (
+                            kind,
+                            item,
+                            json.dumps(payloads[item]) if item in payloads else None,
+                            now,
+                        )
+                        for item in items
+                    ),
+                )
+                added = self._conn.total_changes - before
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return added
+
+    def lease(self, worker_id, kind, limit=1):
+        """Lease up to limit pending jobs, or jobs whose lease has expired.
+        Returns:
+            list: Leased Job tuples
+        """
+        now = time.time()
+        with self._lock:
+            self._transaction()
+            try:
+                self._bury_expired(kind, now)
+                rows = self._conn.execute(
+                    """SELECT id, kind, item, payload, attempts FROM jobs
+                    WHERE kind = ? AND (status = 'pending'
+                        OR (status = 'leased' AND lease_expires < ?))
+                    ORDER BY id LIMIT ?""",
+                    (kind, now, limit),
+                ).fetchall()
+                self._conn.executemany(
+                    """UPDATE jobs SET status = 'leased', attempts = attempts + 1,
+                    lease_owner = ?, lease_expires = ?, updated = ? WHERE id = ?""",
+                    (
+                        (worker_id, now + self.lease_seconds, now, row[0])
+                        for row in rows
+                    ),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [
+            Job(
+                job_id,
+                kind,
+                item,
+                json.loads(payload) if payload else None,
+                attempts + 1,
+            )
+            for job_id, kind, item, payload, attempts in rows
+        ]
+
+    def _bury_expired(self, kind, now):
+        """Dead-letter expired jobs that have used up their attempts."""
+        rows = self._conn.execute(
+            """SELECT id FROM jobs WHERE kind = ? AND status = 'leased'
+            AND lease_expires < ? AND attempts >= ?""",
+            (kind, now, self.max_attempts),
+        ).fetchall()
+        for (job_id,) in rows:
+            self._bury(job_id, "lease expired", now)
+
+    def _bury(self, job_id, error, now):
+        self._conn.execute(
+            """INSERT OR REPLACE INTO dead_letter
+            SELECT id, kind, item, payload, attempts, ?, ? FROM jobs WHERE id = ?""",
+            (error, now, job_id),
+        )
+        self._conn.execute(
+            """UPDATE jobs SET status = 'dead', lease_owner = NULL,
+            last_error = ?, updated = ? WHERE id = ?""",
+            (error, now, job_id),
+        )
+
+    def heartbeat(self, worker_id, job_ids):
+        """Extend the leases a worker still holds.
+        Returns:
+            int: Number of leases extended; fewer than len(job_ids) means
+            some jobs were handed to another worker
+        """
+        now = time.time()
+        with self._lock:
+            self._transaction()
+            try:
+                before = self._conn.total_changes
+                self._conn.executemany(
+                    """UPDATE jobs SET lease_expires = ?, updated = ?
+                    WHERE id = ? AND status = 'leased' AND lease_owner = ?""",
+                    (
+                        (now + self.lease_seconds, now, job_id, worker_id)
+                        for job_id in job_ids
+                    ),
+                )
+                extended = self._conn.total_changes - before
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return extended
+
+    def complete(self, worker_id, job_id):
+        with self._lock:
+            self._conn.execute(
+                """UPDATE jobs SET status = 'done', lease_owner = NULL,
+                lease_expires = NULL, updated = ?
+                WHERE id = ? AND lease_owner = ?""",
+                (time.time(), job_id, worker_id),
+            )
+
+    def fail(self, worker_id, job_id, error):
+        """Give a job back for retry, or dead-letter it if out of attempts."""
+        now = time.time()
+        with self._lock:
+            self._transaction()
+            try:
+                row = self._conn.execute(
+                    "SELECT attempts FROM jobs WHERE id = ? AND lease_owner = ?",
+                    (job_id, worker_id),
+                ).fetchone()
+                if row is not None and row[0] >= self.max_attempts:
+                    self._bury(job_id, error, now)
+                elif row is not None:
+                    self._conn.execute(
+                        """UPDATE jobs SET status = 'pending', lease_owner = NULL,
+                        lease_expires = NULL, last_error = ?, updated = ?
+                        WHERE id = ?""",
+                        (error, now, job_id),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def requeue_dead(self, kind):
+        """Move a kind's dead-lettered jobs back to pending with fresh attempts."""
+        with self._lock:
+            self._transaction()
+            try:
+                self._conn.execute(
+                    """UPDATE jobs SET status = 'pending', attempts = 0, updated = ?
+                    WHERE kind = ? AND status = 'dead'""",
+                    (time.time(), kind),
+                )
+                self._conn.execute("DELETE FROM dead_letter WHERE kind = ?", (kind,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get_counts(self, kind):
+        """Get the number of jobs of a kind in each status."""
+        with self._lock:
+            return dict(
+                self._conn.execute(
+                    "SELECT status, COUNT(*) FROM jobs WHERE kind = ? GROUP BY status",
+                    (kind,),
+                ).fetchall()
+            )
+
+
+class Heartbeat:
+    """Context manager that keeps a worker's leases alive from a thread."""
+
+    def __init__(self, work_queue, worker_id, job_ids):
+        self.work_queue = work_queue
+        self.worker_id = worker_id
+        self.job_ids = list(job_ids)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        interval = self.work_queue.lease_seconds / 3
+        while not self._stop.wait(interval):
+            try:
+                self.work_queue.heartbeat(self.worker_id, self.job_ids)
+            except sqlite3.Error as e:
+                logging.error(f"Heartbeat failed for {self.worker_id}: {str(e)}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_worker(kind, handle_job, work_queue=None, worker_id=None):
+    """Pull jobs of one kind until the queue has none left.
+    Args:
+        kind (str): Job kind to work on
+        handle_job (callable): Called with each Job; returning normally
+            completes the job, raising fails it
+        work_queue (WorkQueue): Queue to pull from, the default one if None
+        worker_id (str): Lease owner name, host:pid if None
+    Returns:
+        int: Number of jobs completed by this worker
+    """
+    work_queue = work_queue or WorkQueue()
+    worker_id = worker_id or get_worker_id()
+    completed = 0
+    while True:
+        jobs = work_queue.lease(worker_id, kind)
+        if not jobs:
+            # Wait out other workers' leases; if one of them died its job
+            # becomes leasable again when the lease expires
+            if not work_queue.get_counts(kind).get("leased"):
+                break
+            time.sleep(min(60, work_queue.lease_seconds / 3))
+            continue
+        job = jobs[0]
+        logging.info(
+            f"Worker {worker_id} leased {kind} {job.item} (attempt {job.attempts})"
+        )
+        try:
+            with Heartbeat(work_queue, worker_id, [job.id]):
+                handle_job(job)
+        except Exception as e:
+            logging.error(f"Job {kind} {job.item} failed: {str(e)}")
+            work_queue.fail(worker_id, job.id, str(e))
+            continue
+        work_queue.complete(worker_id, job.id)
+        completed += 1
+    logging.info(
+        f"Worker {worker_id} finished after {completed} {kind} jobs: "
+        f"{work_queue.get_counts(kind)}"
+    )
+    return completed